@@ -0,0 +1,239 @@
+"""
+Benchmarks for the dual inducer assay protocol.
+Run with `python benchmark.py`. Exits with a non-zero status if any budget is exceeded, or if the throughput grid
+regressed against benchmark_baseline.json.
+
+Usage: python benchmark.py [--update-baseline] [--json results.json]
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import subprocess
+import sys
+import os
+import time
+
+import estimator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+## BUDGETS
+# importing the protocol module must not build a simulator or touch the disk
+IMPORT_TIME_BUDGET_S = 0.05
+# transposed B mode must save time at every replicate count it accepts (see TRANSPOSED_B_MIN_REPLICATES) that the default mode runs too
+TRANSPOSED_B_REPLICATES = tuple(range(estimator.assay.TRANSPOSED_B_MIN_REPLICATES, len(estimator.assay.B_SOURCE_COLUMNS) + 1))
+# calculating and rendering a screening-sized list of targets in the GUI
+DILUTION_TABLE_TARGETS = 10_000
+DILUTION_TABLE_BUDGET_S = 0.5
+# run() is simulated across this grid. Counts and predicted robot time must not grow past the baseline.
+GRID_REPLICATES = (1, 2, 3)
+GRID_VISCOUS = (False, True)
+# (aspirate, dispense, blow-out) flow rates in uL/s: the GUI defaults, then slower and faster settings
+GRID_FLOW_RATES = ((50.0, 150.0, 150.0), (25.0, 75.0, 75.0), (100.0, 300.0, 300.0))
+GRID_METRICS = ('commands', 'tips', 'aspirates', 'dispenses', 'robot_min')
+BASELINE_PATH = os.path.join(HERE, 'benchmark_baseline.json')
+# predicted robot time is deterministic, so this only absorbs float noise
+ROBOT_TIME_TOLERANCE_S = 1.0
+# simulation wall time depends on the machine, so only a large slowdown of the whole grid fails
+WALL_TIME_TOLERANCE = 2.0
+
+def bench_import_time(repeats: int = 5) -> dict:
+    """
+    Times `import dual_inducer_assay` in fresh interpreters and checks that it pulls in no opentrons modules.
+    Returns the best time of all repeats, which is the least noisy estimate.
+    """
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import dual_inducer_assay\n"
+        "elapsed = time.perf_counter() - start\n"
+        "print(elapsed, any(m.split('.')[0] == 'opentrons' for m in sys.modules))\n"
+    )
+    samples = []
+    imports_opentrons = False
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", code], cwd=HERE, capture_output=True, text=True, check=True).stdout.split()
+        samples.append(float(out[0]))
+        imports_opentrons = imports_opentrons or out[1] == "True"
+    best = min(samples)
+    details = ["importing the protocol module pulled in opentrons"] if imports_opentrons else []
+    return {
+        "name": "import_time",
+        "value_s": best,
+        "budget_s": IMPORT_TIME_BUDGET_S,
+        "passed": best <= IMPORT_TIME_BUDGET_S and not imports_opentrons,
+        "imports_opentrons": imports_opentrons,
+        "summary": f"{best * 1000:.1f} ms (budget {IMPORT_TIME_BUDGET_S * 1000:.0f} ms)",
+        "details": details,
+    }
+
+def bench_transposed_b() -> dict:
+    """
+    Predicted run time with and without transposed B mode, from full simulator passes.
+    Passes when transposed B mode is faster at every one of TRANSPOSED_B_REPLICATES.
+    """
+    minutes = {}
+    # the simulator logs calibration warnings to stdout and stderr
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        for replicates in TRANSPOSED_B_REPLICATES:
+            for transposed_b in (False, True):
+                config = dict(estimator.assay.DEFAULT_CONFIG, replicates=replicates, transposed_b=transposed_b)
+                minutes[replicates, transposed_b] = estimator.estimate_simulated(config).total_s / 60
+    saved = {replicates: minutes[replicates, False] - minutes[replicates, True] for replicates in TRANSPOSED_B_REPLICATES}
+    details = [f"{'Replicates':<12}{'Default':>9}{'Transposed':>12}{'Saved':>8}"]
+    details += [f"{replicates:<12}{minutes[replicates, False]:>9.2f}{minutes[replicates, True]:>12.2f}{saved[replicates]:>8.2f}" for replicates in TRANSPOSED_B_REPLICATES]
+    return {
+        "name": "transposed_b",
+        "value_s": min(saved.values()) * 60,
+        "passed": min(saved.values()) > 0,
+        "summary": f"at least {min(saved.values()):.2f} min saved at {', '.join(str(r) for r in TRANSPOSED_B_REPLICATES)} replicates (minutes per run below)",
+        "details": details,
+    }
+
+def bench_dilution_table(repeats: int = 3) -> dict:
+    """
+    Times the GUI's Calculate button for DILUTION_TABLE_TARGETS targets, up to the table being painted,
+    in fresh interpreters with an offscreen Qt platform. Returns the best time of all repeats.
+    """
+    code = (
+        "import time\n"
+        "from PySide6.QtWidgets import QApplication\n"
+        "import config_gui\n"
+        "app = QApplication([])\n"
+        "window = config_gui.DilutionApp()\n"
+        "window.show()\n"
+        # all targets at or below the default stock concentration, so no warning dialog blocks the run
+        f"window.input_targets.setText(', '.join(str(15 * i / {DILUTION_TABLE_TARGETS}) for i in range({DILUTION_TABLE_TARGETS})))\n"
+        "app.processEvents()\n"
+        "start = time.perf_counter()\n"
+        "window.run_calculation()\n"
+        "window.table.viewport().repaint()\n"
+        "app.processEvents()\n"
+        "print(time.perf_counter() - start, window.table_model.rowCount())\n"
+    )
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    samples = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", code], cwd=HERE, env=env, capture_output=True, text=True, check=True).stdout.split()
+        samples.append(float(out[0]))
+        rows = int(out[1])
+    best = min(samples)
+    return {
+        "name": "dilution_table",
+        "value_s": best,
+        "budget_s": DILUTION_TABLE_BUDGET_S,
+        "passed": best <= DILUTION_TABLE_BUDGET_S and rows == DILUTION_TABLE_TARGETS,
+        "summary": f"{best * 1000:.1f} ms for {rows} targets (budget {DILUTION_TABLE_BUDGET_S * 1000:.0f} ms)",
+        "details": [],
+    }
+
+def grid_configs() -> list[dict]:
+    configs = []
+    for replicates, viscous, (asp_rate, disp_rate, blowout_rate) in itertools.product(GRID_REPLICATES, GRID_VISCOUS, GRID_FLOW_RATES):
+        configs.append(dict(estimator.assay.DEFAULT_CONFIG, replicates=replicates, viscous_check=viscous, asp_rate=asp_rate, disp_rate=disp_rate, blowout_rate=blowout_rate))
+    return configs
+
+def measure_config(config: dict) -> dict:
+    """Simulates run() for a config and returns the GRID_METRICS, plus the simulation's wall time."""
+    commands = []
+    start = time.perf_counter()
+    steps = estimator.record_steps(config, commands)
+    wall_s = time.perf_counter() - start
+    estimate = estimator.estimate_steps(steps)
+    return {
+        "config": config,
+        "commands": len(commands),
+        "tips": estimate.total_count('pick_up_tip'),
+        # mixes count as one aspirate and one dispense per repetition
+        "aspirates": estimate.total_count('aspirate'),
+        "dispenses": estimate.total_count('dispense'),
+        "robot_min": round(estimate.total_s / 60, 3),
+        "wall_s": round(wall_s, 3),
+    }
+
+def compare_to_baseline(rows: list[dict], baseline: list[dict]) -> tuple[list[str], list[str]]:
+    """Regressions and improvements of each grid row against the baseline row with the same config."""
+    baseline_rows = {json.dumps(row["config"], sort_keys=True): row for row in baseline}
+    regressions, improvements = [], []
+    for row in rows:
+        old = baseline_rows.get(json.dumps(row["config"], sort_keys=True))
+        name = _grid_label(row["config"])
+        if old is None:
+            improvements.append(f"{name}: not in the baseline")
+            continue
+        for metric in GRID_METRICS:
+            tolerance = ROBOT_TIME_TOLERANCE_S / 60 if metric == 'robot_min' else 0
+            if row[metric] > old[metric] + tolerance:
+                regressions.append(f"{name}: {metric} {old[metric]:g} -> {row[metric]:g}")
+            elif row[metric] < old[metric] - tolerance:
+                improvements.append(f"{name}: {metric} {old[metric]:g} -> {row[metric]:g}")
+    wall_s, old_wall_s = sum(row["wall_s"] for row in rows), sum(row["wall_s"] for row in baseline)
+    if wall_s > WALL_TIME_TOLERANCE * old_wall_s:
+        regressions.append(f"grid simulation wall time {old_wall_s:.1f} s -> {wall_s:.1f} s")
+    return regressions, improvements
+
+def _grid_label(config: dict) -> str:
+    viscous = "viscous" if config["viscous_check"] else "normal"
+    return f"{config['replicates']} rep, {viscous}, {config['asp_rate']:g}/{config['disp_rate']:g}/{config['blowout_rate']:g} uL/s"
+
+def bench_grid(update_baseline: bool = False) -> dict:
+    """
+    Simulates run() for every grid_configs() config and compares the results with BASELINE_PATH.
+    Fails if any count or predicted robot time grew, or the grid took WALL_TIME_TOLERANCE times longer to simulate.
+    Writes the baseline if asked to, or if there is none yet.
+    """
+    # imported up front, so the first config's wall time does not include it
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        from opentrons import simulate  # noqa: F401
+        rows = [measure_config(config) for config in grid_configs()]
+    details = [f"{'Config':<36}{'Commands':>9}{'Tips':>6}{'Aspirates':>10}{'Dispenses':>10}{'Robot (min)':>12}{'Wall (s)':>9}"]
+    details += [f"{_grid_label(row['config']):<36}{row['commands']:>9}{row['tips']:>6}{row['aspirates']:>10}{row['dispenses']:>10}{row['robot_min']:>12.2f}{row['wall_s']:>9.2f}" for row in rows]
+    regressions, improvements = [], []
+    if update_baseline or not os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(rows, f, indent=1)
+            f.write("\n")
+        summary = f"{len(rows)} configs, baseline written to {os.path.basename(BASELINE_PATH)}"
+    else:
+        with open(BASELINE_PATH) as f:
+            regressions, improvements = compare_to_baseline(rows, json.load(f))
+        summary = f"{len(rows)} configs, {len(regressions)} regressions against {os.path.basename(BASELINE_PATH)}"
+        details += [f"REGRESSION {line}" for line in regressions]
+        # improvements pass, but stay in the report until the baseline is updated
+        details += [f"changed    {line} (run with --update-baseline to keep)" for line in improvements]
+    return {
+        "name": "throughput_grid",
+        "value_s": sum(row["wall_s"] for row in rows),
+        "passed": not regressions,
+        "summary": summary,
+        "details": details,
+        "rows": rows,
+    }
+
+BENCHMARKS = [bench_import_time, bench_transposed_b, bench_dilution_table, bench_grid]
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--update-baseline', action='store_true', help="accept the throughput grid's results as the new baseline")
+    parser.add_argument('--json', help="also write every benchmark's results to this file")
+    args = parser.parse_args(argv)
+
+    failed = False
+    results = []
+    for bench in BENCHMARKS:
+        result = bench(update_baseline=args.update_baseline) if bench is bench_grid else bench()
+        results.append(result)
+        status = "PASS" if result["passed"] else "FAIL"
+        print(f"[{status}] {result['name']}: {result['summary']}")
+        for line in result["details"]:
+            print(f"       {line}")
+        failed = failed or not result["passed"]
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,206 @@
+"""
+Campaign scheduler: packs a study of several configs (inducer pairs), each with any number of replicates,
+into OT-2 runs of as many replicates as one run holds (see max_replicates): 3 destination plates, or more
+replicates per plate with 384-well plates or fewer A levels, as far as the tip racks and reservoir allow.
+In transposed B mode one source dilution can serve up to 8 plates, so later runs reuse the source plates
+on the deck instead of diluting again. Part-used tip racks carry over to the next run, as does the single-channel's
+own rack with mixed_pipettes.
+Prints per-run deck layouts and reservoir fill sheets, and can write a config per run.
+
+Usage: python campaign.py study.json [-o campaign_dir]
+study.json is a list of configs (or config file paths), or {"configs": [...]}.
+"""
+import argparse
+import json
+import os
+import sys
+from dataclasses import dataclass, field
+
+import dual_inducer_assay as assay
+import estimator
+
+GRADIENT_TRANSFER_VOL = 30 # uL each destination plate takes from every gradient well
+
+@dataclass
+class CampaignRun:
+    """One robot run of a campaign."""
+    number: int
+    name: str
+    config: dict
+    plates: list # replicate numbers within the config's study, from 1 (a destination plate each in the default layout)
+    dilution: int # campaign-wide number of the source dilution the run uses
+    reuses_from: int | None # run that made the source plates, if this run reuses them
+    deck: dict = field(default_factory=dict) # slot -> what goes there
+    fill_sheet: dict = field(default_factory=dict) # reservoir column -> (liquid, uL per row A-H)
+    fresh_racks: int = 0
+    minutes: float = 0.0
+
+def plates_per_dilution(config: dict) -> int:
+    """Replicates one source dilution can serve."""
+    # every replicate takes one transfer from each A gradient well
+    a_plates = (assay.FLOW_VOL['disp_vol'] - assay.SOURCE_DEAD_VOL) // GRADIENT_TRANSFER_VOL
+    # the transposed B plate holds one B gradient per row; the default mode makes one B column per replicate of its run
+    b_plates = assay.B_PLATE_ROWS if config.get("transposed_b", False) else assay.max_replicates(config)
+    return min(a_plates, b_plates)
+
+def split_runs(replicates: int, capacity: int, per_run: int) -> list[list[int]]:
+    """
+    Splits the replicates of one config into the fewest runs of at most per_run, and the runs into as few
+    dilutions as fit. Returns the run sizes grouped by dilution.
+    """
+    sizes = [per_run] * (replicates // per_run) + ([replicates % per_run] if replicates % per_run else [])
+    # runs sharing a dilution are packed like dispenses sharing an aspirate
+    order = assay.order_for_packing(sizes, capacity, 0)
+    sizes = [sizes[i] for i in order]
+    return [[sizes[i] for i in group] for group in assay.pack_dispenses(sizes, capacity, 0)]
+
+def used_tips(plan: dict) -> set:
+    """Every tip gone once a plan has run."""
+    used = assay.tips_gone(plan)
+    for kind, mount, *_ in plan['ops']:
+        if kind == 'pick_up_tip':
+            assay.next_tip(plan, mount, used)
+    return used
+
+def tips_left(plan: dict) -> int | None:
+    """First unused column of the last tip rack a plan uses, or None if it ends on a full rack."""
+    used = used_tips(plan)
+    racks = plan['pipettes']['left']['tip_racks']
+    last_rack = max(i for i, rack in enumerate(racks) if any(tip.startswith(f"{rack}/") for tip in used))
+    last_col = max(int(tip.split('/')[1][1:]) for tip in used if tip.startswith(f"{racks[last_rack]}/"))
+    return last_col + 1 if last_col < 12 else None
+
+def single_tips_left(plan: dict) -> str | None:
+    """Next tip of the single-channel's own rack (mixed_pipettes), or None if a plan empties it."""
+    used = used_tips(plan)
+    rack = plan['pipettes']['right']['tip_racks'][0]
+    return next((f"{row}{col}" for col in range(1, 13) for row in assay.ROWS if f"{rack}/{row}{col}" not in used), None)
+
+def schedule_campaign(configs: list[dict], share: bool = True) -> list[CampaignRun]:
+    """
+    Packs every config into runs, in order, carrying the part-used tip rack from run to run.
+    Without share, every run dilutes and starts on fresh tip racks, as separate runs would.
+    """
+    runs: list[CampaignRun] = []
+    tip_start_column = 1
+    single_tip_start = "A1"
+    dilution = 0
+    ledger = None
+    for index, config in enumerate(configs):
+        replicates = config.get("replicates")
+        if not isinstance(replicates, int) or replicates < 1:
+            raise ValueError(f"Config {index + 1}: replicates must be a positive whole number. Got: {replicates}")
+        name = config.get("name", f"config {index + 1}")
+        plate = 1
+        per_run = assay.max_replicates(config)
+        mixed = config.get("mixed_pipettes", False)
+        for sizes in split_runs(replicates, plates_per_dilution(config) if share else per_run, per_run):
+            dilution += 1
+            first_run = len(runs) + 1
+            offset = 0
+            for size in sizes:
+                run_config = dict(config, replicates=size, reuse_source=offset > 0, plate_offset=offset, tip_start_column=tip_start_column)
+                # a run too small for transposed B mode to pay off, diluting for itself alone, uses the default mode
+                if len(sizes) == 1 and size < assay.TRANSPOSED_B_MIN_REPLICATES:
+                    run_config["transposed_b"] = False
+                if mixed:
+                    run_config["single_tip_start"] = single_tip_start
+                # a part-used rack can take one rack more than a full run needs (or the single-channel's rack its
+                # slot), so it is left out if the run then overflows the deck
+                try:
+                    assay.config_tip_usage(run_config)
+                except ValueError:
+                    tip_start_column = run_config["tip_start_column"] = 1
+                plan = assay.compile_plan(run_config)
+                run = CampaignRun(len(runs) + 1, name, run_config, list(range(plate, plate + size)), dilution, first_run if offset else None)
+                # runs reusing source plates start from what the runs before them left there
+                ledger = assay.track_volumes(plan, ledger if offset else None)
+                issues = ledger.check()
+                if issues:
+                    raise ValueError(f"Run {run.number}: {assay.format_issues(issues)}")
+                run.deck = deck_layout(run, plan)
+                run.fill_sheet = assay.fill_sheet(ledger)
+                run.fresh_racks = len(plan['pipettes']['left']['tip_racks']) - (1 if tip_start_column > 1 else 0) + (1 if mixed and single_tip_start == "A1" else 0)
+                run.minutes = estimator.estimate_plan(plan).total_s / 60
+                runs.append(run)
+                tip_start_column = (tips_left(plan) or 1) if share else 1
+                if mixed:
+                    single_tip_start = (single_tips_left(plan) or "A1") if share else "A1"
+                plate += size
+                offset += size
+    return runs
+
+def deck_layout(run: CampaignRun, plan: dict) -> dict:
+    layout = {}
+    for i, slot in enumerate(plan['pipettes']['left']['tip_racks']):
+        carried = i == 0 and run.config["tip_start_column"] > 1
+        layout[int(slot)] = f"tip rack from run {run.number - 1}, first tip in column {run.config['tip_start_column']}" if carried else "fresh tip rack"
+    if run.config.get("mixed_pipettes", False):
+        start = run.config["single_tip_start"]
+        slot = int(plan['pipettes']['right']['tip_racks'][0])
+        layout[slot] = f"single-channel tip rack from run {run.number - 1}, first tip {start}" if start != "A1" else "fresh single-channel tip rack"
+    plate_layout = assay.plate_layout(run.config)
+    for i, slot in enumerate(plate_layout.plate_slots):
+        # several replicates share a plate with 384-well plates or fewer A levels
+        plates = [plate for plate, region in zip(run.plates, plate_layout.regions) if region.plate == i]
+        layout[slot] = f"destination plate {plates[0]}" if len(plates) == 1 else f"destination plate, replicates {', '.join(str(p) for p in plates)}"
+    layout[5] = "reservoir"
+    keep = f" (keep from run {run.reuses_from})" if run.reuses_from else " (empty)"
+    layout[6] = "source plate" + keep
+    if run.config.get("transposed_b", False):
+        layout[assay.B_PLATE_SLOT] = "B plate" + keep
+    return dict(sorted(layout.items()))
+
+def summary_line(label: str, runs: list[CampaignRun]) -> str:
+    dilutions = len({run.dilution for run in runs})
+    racks = sum(run.fresh_racks for run in runs)
+    return f"{label}: {len(runs)} runs, {dilutions} dilutions, {racks} fresh tip racks, {sum(run.minutes for run in runs):.1f} min"
+
+def format_campaign(runs: list[CampaignRun], baseline: list[CampaignRun] | None = None) -> str:
+    lines = []
+    for run in runs:
+        plates = ", ".join(str(p) for p in run.plates)
+        reuse = f"reuses source plates of run {run.reuses_from}" if run.reuses_from else "new dilution"
+        lines.append(f"Run {run.number}: {run.name}, plates {plates} ({reuse}), {run.minutes:.1f} min")
+        lines.append("  Deck:")
+        lines += [f"    slot {slot:>2}: {what}" for slot, what in run.deck.items()]
+        lines.append("  Reservoir (uL per well, rows A-H unless noted):")
+        lines += ["    " + line for line in assay.format_fill_sheet(run.fill_sheet)]
+    lines.append(summary_line("Total", runs))
+    if baseline is not None:
+        lines.append(summary_line("Unshared", baseline))
+    return "\n".join(lines)
+
+def load_study(path: str) -> list[dict]:
+    with open(path) as f:
+        study = json.load(f)
+    entries = study["configs"] if isinstance(study, dict) else study
+    base = os.path.dirname(os.path.abspath(path))
+    return [assay.load_config(os.path.join(base, entry)) if isinstance(entry, str) else dict(entry) for entry in entries]
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('study')
+    parser.add_argument('-o', '--output', help="write a config per run (run_01.json, ...) and campaign.json here")
+    args = parser.parse_args(argv)
+
+    configs = load_study(args.study)
+    runs = schedule_campaign(configs)
+    print(format_campaign(runs, schedule_campaign(configs, share=False)))
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        for run in runs:
+            with open(os.path.join(args.output, f"run_{run.number:02d}.json"), 'w') as f:
+                json.dump(run.config, f, indent=4)
+        summary = [
+            {'run': run.number, 'name': run.name, 'plates': run.plates, 'dilution': run.dilution, 'reuses_from': run.reuses_from,
+             'deck': run.deck, 'fill_sheet': {col: {'liquid': liquid, 'uL_per_row': volumes} for col, (liquid, volumes) in run.fill_sheet.items()},
+             'fresh_racks': run.fresh_racks, 'minutes': round(run.minutes, 2)}
+            for run in runs
+        ]
+        with open(os.path.join(args.output, "campaign.json"), 'w') as f:
+            json.dump(summary, f, indent=4)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
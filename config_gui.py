@@ -1,49 +1,87 @@
 import sys
 import json
-from dataclasses import dataclass, asdict
 from typing import List, Optional
+import numpy as np
 from PySide6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QFormLayout, 
-                               QLineEdit, QDoubleSpinBox, QPushButton, QTableWidget, 
-                               QTableWidgetItem, QHeaderView, QGroupBox, QTextEdit, 
-                               QMessageBox, QFileDialog, QTabWidget, QCheckBox)
-from PySide6.QtCore import Qt
+                               QLineEdit, QDoubleSpinBox, QPushButton, QTableView, 
+                               QHeaderView, QGroupBox, QTextEdit, QLabel,
+                               QMessageBox, QFileDialog, QTabWidget, QCheckBox, QComboBox)
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QObject, QRunnable, QThreadPool, QTimer, Signal
+from PySide6.QtGui import QColor
 import os
 
+import dual_inducer_assay as assay
+# the calculation, config building and validation are Qt-free, for batch use
+from config_tools import (EXPERIMENT_DEFAULTS, DilutionResult, SimulationCancelled, ValidationReport, calculate_dilutions,
+                          make_config, over_volume_message, parse_targets, validate_config)
+
 ## CONSTANTS
 COL_CONC = 0
 COL_STOCK = 1
 COL_DILUENT = 2
+HEADERS = ["Final Conc (μM)", "Stock Vol (μL)", "Diluent Vol (μL)"]
+OVER_VOLUME_COLOR = QColor("#f8d7da")
+TARGETS_MAX_LENGTH = 1_000_000 # QLineEdit cuts pasted text at 32767 characters by default
+VALIDATION_DEBOUNCE_MS = 500 # quiet time after the last input change before a simulation starts
 
-## WellData objects
-@dataclass
-class WellData:
-    final_conc_uM: float
-    stock_vol_uL: float
-    diluent_vol_uL: float
-
-## dilutions calculator function
-def calculate_dilutions(stock_conc_uM: float, total_vol_uL: float, targets_uM: List[float]) -> List[WellData]:
-    """
-    returns a list of WellData objects
-    """
-    results = []
-    for target in targets_uM:
-        # C1V1 = C2V2  =>  V1 = (C2 * V2) / C1
-        if stock_conc_uM == 0:
-            stock_vol = 0.0
-        else:
-            stock_vol = (target * total_vol_uL) / stock_conc_uM
-            
-        diluent_vol = total_vol_uL - stock_vol
-        
-        # create WellData object
-        well = WellData(
-            final_conc_uM=target,
-            stock_vol_uL=stock_vol,
-            diluent_vol_uL=diluent_vol
-        )
-        results.append(well)
-    return results
+## table model over a DilutionResult, so the table only renders the rows in view
+class DilutionTableModel(QAbstractTableModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.result = DilutionResult()
+        self._columns: List[np.ndarray] = []
+
+    def set_result(self, result: DilutionResult):
+        self.beginResetModel()
+        self.result = result
+        # rounded once for display, not per cell
+        self._columns = [np.round(column, 3) for column in (result.final_conc_uM, result.stock_vol_uL, result.diluent_vol_uL)]
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.result)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return float(self._columns[index.column()][index.row()])
+        if role == Qt.BackgroundRole and self.result.over_volume[index.row()]:
+            return OVER_VOLUME_COLOR
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+## SIMULATION WORKER
+# The config on screen is compiled and simulated off the GUI thread whenever the inputs change, so infeasible
+# configs (over-volume wells, too few tips, simulator errors) show up before the JSON is loaded on the robot.
+class WorkerSignals(QObject):
+    finished = Signal(int, object) # job id, ValidationReport
+
+class SimulationWorker(QRunnable):
+    """Runs validate_config() on a QThreadPool. Cancelling it makes the simulation stop at its next command."""
+    def __init__(self, job_id: int, config: dict):
+        super().__init__()
+        self.job_id = job_id
+        self.config = config
+        self.signals = WorkerSignals()
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        try:
+            report = validate_config(self.config, lambda: self._cancelled)
+        except SimulationCancelled:
+            return
+        self.signals.finished.emit(self.job_id, report)
 
 ## UI LAYER
 class DilutionApp(QWidget):
@@ -53,7 +91,7 @@ class DilutionApp(QWidget):
         self.setWindowTitle("Generate Dose-Response Opentrons Config")
         
         # store calculated data here. The Table and JSON view just reflect this.
-        self.experiment_data: List[WellData] = []
+        self.experiment_data = DilutionResult()
         
         # main layout
         self.main_layout = QVBoxLayout()
@@ -66,18 +104,38 @@ class DilutionApp(QWidget):
         self.tab_setup = QWidget()
         self.tab_table = QWidget()
         self.tab_json = QWidget()        
+        self.tab_validation = QWidget()
         
         self.tabs.addTab(self.tab_setup, "Input Parameters")
         self.tabs.addTab(self.tab_table, "Table Preview")
         self.tabs.addTab(self.tab_json, "JSON Output")        
+        self.tabs.addTab(self.tab_validation, "Simulation")
         
         self.create_setup_tab()
         self.create_table_tab()
         self.create_json_tab()
+        self.create_validation_tab()
         
         # populate with default data
         self.set_defaults()
 
+        # one simulation at a time; a newer one cancels the running one
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.validation_job = 0
+        self.validation_worker: Optional[SimulationWorker] = None
+        self.validation_timer = QTimer(self)
+        self.validation_timer.setSingleShot(True)
+        self.validation_timer.setInterval(VALIDATION_DEBOUNCE_MS)
+        self.validation_timer.timeout.connect(self.start_validation)
+        for widget in (self.input_stock_conc, self.input_asp_rate, self.input_disp_rate, self.input_blowout_rate, self.input_total_vol, self.replicates, self.input_a_levels):
+            widget.valueChanged.connect(self.schedule_validation)
+        self.input_plate_format.currentIndexChanged.connect(self.schedule_validation)
+        for widget in (self.input_viscous_liquid, self.input_tip_economy, self.input_multi_dispense, self.input_transposed_b, self.input_direct_dilution, self.input_optimize_travel, self.input_mixed_pipettes):
+            widget.stateChanged.connect(self.schedule_validation)
+        self.input_targets.textChanged.connect(self.schedule_validation)
+        self.schedule_validation()
+
     ## input setup
     def create_setup_tab(self):
         # setup tab layout
@@ -117,8 +175,27 @@ class DilutionApp(QWidget):
         # viscous liquid check
         self.input_viscous_liquid = add_input("Is Viscous Liquid?", QCheckBox(), " μL")
         self.input_viscous_liquid.stateChanged.connect(self.onStateChanged)
+        self.input_viscous_liquid.setToolTip("Pipettes both inducers in the viscous liquid class (see Liquid Classes in the README)") # type: ignore
         self.viscous_bool: bool = False
 
+        # tip economy mode (reorders the destination phase to reuse tips)
+        self.input_tip_economy = add_input("Tip Economy Mode?", QCheckBox())
+
+        # multi-dispense mode (one aspirate per several columns for PBS and control fills)
+        self.input_multi_dispense = add_input("Multi-Dispense Mode?", QCheckBox())
+
+        # transposed B mode (B gradient built along columns with the multichannel, on an extra plate in slot 3)
+        self.input_transposed_b = add_input("Transposed B Dilution?", QCheckBox())
+
+        # direct dilution mode (the robot makes the A gradient at the target concentrations below)
+        self.input_direct_dilution = add_input("Direct Dilution?", QCheckBox())
+
+        # optimize travel (the compiled plan is reordered to cut gantry travel)
+        self.input_optimize_travel = add_input("Optimize Travel?", QCheckBox())
+
+        # mixed-pipette scheduling (the single-channel batches its transfers, from a tip rack of its own)
+        self.input_mixed_pipettes = add_input("Mixed-Pipette Scheduling?", QCheckBox())
+
         # input diluent name
         self.input_diluent_name = add_input("Diluent Name:", QLineEdit())
         self.input_diluent_name.setPlaceholderText("e.g., Buffer") # type: ignore
@@ -131,11 +208,21 @@ class DilutionApp(QWidget):
         self.input_targets = add_input("Target Concentrations (μM):", QLineEdit())
         self.input_targets.setPlaceholderText("e.g., 0, 5, 10, 50, 100") # type: ignore
         self.input_targets.setToolTip("Enter comma-separated values in μM") # type: ignore
+        self.input_targets.setMaxLength(TARGETS_MAX_LENGTH) # type: ignore
         
-        # input the number of replicates
+        # input the number of replicates; how many fit depends on the modes and plates (the Simulation tab says when they do not)
         self.replicates = add_input("Number of Replicates:", QDoubleSpinBox())
-        self.replicates.setRange(0, 3) # type: ignore
+        self.replicates.setRange(1, assay.B_PLATE_ROWS) # type: ignore
         self.replicates.setDecimals(0) # type: ignore
+
+        # destination plate format (a 384-well plate holds four replicates, see Plate Layout in the README)
+        self.input_plate_format = add_input("Destination Plate Wells:", QComboBox())
+        self.input_plate_format.addItems([str(plate_format) for plate_format in assay.PLATE_FORMATS]) # type: ignore
+
+        # number of A gradient levels (source plate columns 1 to a_levels)
+        self.input_a_levels = add_input("Inducer A Levels:", QDoubleSpinBox())
+        self.input_a_levels.setRange(1, assay.MAX_A_LEVELS) # type: ignore
+        self.input_a_levels.setDecimals(0) # type: ignore
         
         # layout of above experimental parameters in group
         group_box.setLayout(form_layout)
@@ -164,9 +251,9 @@ class DilutionApp(QWidget):
     def create_table_tab(self):
         layout = QVBoxLayout()
         
-        self.table = QTableWidget()
-        self.table.setColumnCount(3)
-        self.table.setHorizontalHeaderLabels(["Final Conc (μM)", "Stock Vol (μL)", "Diluent Vol (μL)"])
+        self.table_model = DilutionTableModel(self)
+        self.table = QTableView()
+        self.table.setModel(self.table_model)
         self.table.setAlternatingRowColors(True)
         
         header = self.table.horizontalHeader()
@@ -192,17 +279,41 @@ class DilutionApp(QWidget):
         layout.addWidget(self.output_text)
         self.tab_json.setLayout(layout)
 
+    ## simulation results setup
+    def create_validation_tab(self):
+        layout = QVBoxLayout()
+        form_layout = QFormLayout()
+
+        self.label_validation_status = QLabel()
+        self.label_duration = QLabel("-")
+        self.label_tips = QLabel("-")
+        self.label_commands = QLabel("-")
+        form_layout.addRow("Status:", self.label_validation_status)
+        form_layout.addRow("Estimated Duration:", self.label_duration)
+        form_layout.addRow("Tips:", self.label_tips)
+        form_layout.addRow("Simulated Commands:", self.label_commands)
+
+        self.validation_text = QTextEdit()
+        self.validation_text.setReadOnly(True)
+        self.validation_text.setStyleSheet("background-color: #f8f8f8; font-family: monospace;")
+
+        layout.addLayout(form_layout)
+        layout.addWidget(self.validation_text)
+        self.tab_validation.setLayout(layout)
+
     ## handle defaults
     def set_defaults(self):
-        self.input_stock_name.setText("Stock Solution") # type: ignore
-        self.input_diluent_name.setText("Buffer") # type: ignore
-        self.input_stock_conc.setValue(15) # type: ignore
-        self.input_total_vol.setValue(100.0) # type: ignore
-        self.input_asp_rate.setValue(50)
-        self.input_blowout_rate.setValue(150)
-        self.input_disp_rate.setValue(150)
-        self.input_targets.setText("0, 2, 4, 6, 8, 10, 12, 14") # type: ignore
-        self.replicates.setValue(1) # type: ignore
+        self.input_stock_name.setText(EXPERIMENT_DEFAULTS["stock_name"]) # type: ignore
+        self.input_diluent_name.setText(EXPERIMENT_DEFAULTS["diluent_name"]) # type: ignore
+        self.input_stock_conc.setValue(EXPERIMENT_DEFAULTS["stock_conc_uM"]) # type: ignore
+        self.input_total_vol.setValue(EXPERIMENT_DEFAULTS["total_vol_uL"]) # type: ignore
+        self.input_asp_rate.setValue(EXPERIMENT_DEFAULTS["asp_rate"])
+        self.input_blowout_rate.setValue(EXPERIMENT_DEFAULTS["blowout_rate"])
+        self.input_disp_rate.setValue(EXPERIMENT_DEFAULTS["disp_rate"])
+        self.input_targets.setText(EXPERIMENT_DEFAULTS["targets_uM"]) # type: ignore
+        self.replicates.setValue(EXPERIMENT_DEFAULTS["replicates"]) # type: ignore
+        self.input_plate_format.setCurrentText(str(EXPERIMENT_DEFAULTS["plate_format"])) # type: ignore
+        self.input_a_levels.setValue(EXPERIMENT_DEFAULTS["a_levels"]) # type: ignore
 
     ## calls function calculate dilutions to populate ui
     def run_calculation(self):
@@ -217,15 +328,14 @@ class DilutionApp(QWidget):
             # first we get inputs from the user
             stock_conc = self.input_stock_conc.value() # type: ignore
             total_vol = self.input_total_vol.value() # type: ignore
-            raw_targets = self.input_targets.text().split(',') # type: ignore
-            targets = [float(x.strip()) for x in raw_targets if x.strip()] 
+            targets = parse_targets(self.input_targets.text()) # type: ignore
 
             # input validation
             if stock_conc <= 0:
                 QMessageBox.warning(self, "Error", "Stock concentration must be greater than 0.")
                 return
 
-            # call calculate dilutions and obtain a welldata object
+            # call calculate dilutions and obtain a DilutionResult
             new_data = calculate_dilutions(stock_conc, total_vol, targets)
             
             # update data model
@@ -243,51 +353,91 @@ class DilutionApp(QWidget):
     ## referesh table with input data
     def refresh_table(self):
         """Updates the table based entirely on self.experiment_data."""
-        self.table.setRowCount(len(self.experiment_data))
-        
-        for row_idx, well in enumerate(self.experiment_data):
-            # check for warnings (logic inside UI update is okay for visual alerts)
-            if well.stock_vol_uL > self.input_total_vol.value(): # type: ignore
-                QMessageBox.warning(self, "Warning", f"Target {well.final_conc_uM} requires more stock than total volume!")
+        self.table_model.set_result(self.experiment_data)
 
-            # table item helper
-            def make_item(val: float) -> QTableWidgetItem:
-                item = QTableWidgetItem()
-                item.setData(Qt.EditRole, round(val, 3))
-                return item
+        # one summary for all targets that need more stock than the total volume
+        message = over_volume_message(self.experiment_data)
+        if message is not None:
+            QMessageBox.warning(self, "Warning", f"{message} (highlighted)")
 
-            self.table.setItem(row_idx, COL_CONC, make_item(well.final_conc_uM))
-            self.table.setItem(row_idx, COL_STOCK, make_item(well.stock_vol_uL))
-            self.table.setItem(row_idx, COL_DILUENT, make_item(well.diluent_vol_uL))
+    ## background simulation of the config on screen
+    def schedule_validation(self):
+        """Called on every input change. Cancels the running simulation and restarts the debounce timer."""
+        if self.validation_worker is not None:
+            self.validation_worker.cancel()
+            self.validation_worker = None
+        self.label_validation_status.setText("Waiting for input to settle...")
+        self.validation_timer.start()
 
-    ## generate json with class data
-    def generate_json(self):
-        """Builds JSON from the Data Model, NOT the Table."""
-        #
-        if not self.experiment_data:
-            QMessageBox.warning(self, "Warning", "No data to export. Please calculate first.")
+    def start_validation(self):
+        try:
+            result = calculate_dilutions(self.input_stock_conc.value(), self.input_total_vol.value(), parse_targets(self.input_targets.text())) # type: ignore
+        except ValueError:
+            self.show_validation(ValidationReport(errors=["Invalid input in Target Concentrations. Please use numbers separated by commas."]))
             return
+        self.validation_job += 1
+        self.validation_worker = SimulationWorker(self.validation_job, self.build_config(result))
+        self.validation_worker.signals.finished.connect(self.on_validation_finished)
+        self.label_validation_status.setText("Simulating...")
+        self.pool.start(self.validation_worker)
 
-        # build structure
-        data = {
-            "stock_name": self.input_stock_name.text(), # type: ignore
+    def on_validation_finished(self, job_id: int, report: ValidationReport):
+        # results of a job that was superseded are dropped
+        if job_id != self.validation_job:
+            return
+        self.validation_worker = None
+        self.show_validation(report)
 
+    def show_validation(self, report: ValidationReport):
+        self.label_validation_status.setText(f"{len(report.errors)} error(s)" if report.errors else "OK")
+        self.label_duration.setText("-" if report.minutes is None else f"{report.minutes:.1f} min")
+        self.label_tips.setText("-" if report.tips is None else f"{report.tips} ({report.tip_racks} racks)")
+        self.label_commands.setText("-" if report.commands is None else str(report.commands))
+        lines = [f"ERROR: {error}" for error in report.errors]
+        if report.fill_sheet:
+            lines += ["Reservoir (uL per well, rows A-H unless noted):"] + report.fill_sheet
+        self.validation_text.setText("\n".join(lines))
+
+    def closeEvent(self, event):
+        self.validation_timer.stop()
+        if self.validation_worker is not None:
+            self.validation_worker.cancel()
+        self.pool.waitForDone()
+        super().closeEvent(event)
+
+    ## config from the inputs and a DilutionResult
+    def build_config(self, result: DilutionResult) -> dict:
+        inputs = {
+            "stock_name": self.input_stock_name.text(), # type: ignore
             "stock_conc_uM": self.input_stock_conc.value(), # type: ignore
             "diluent_name": self.input_diluent_name.text(), # type: ignore
             "total_vol_uL": self.input_total_vol.value(), # type: ignore
             "replicates": int(self.replicates.value()), # type: ignore
             "viscous_check": self.viscous_bool,
+            "tip_economy": self.input_tip_economy.isChecked(), # type: ignore
+            "multi_dispense": self.input_multi_dispense.isChecked(), # type: ignore
+            "transposed_b": self.input_transposed_b.isChecked(), # type: ignore
+            "direct_dilution": self.input_direct_dilution.isChecked(), # type: ignore
+            "optimize_travel": self.input_optimize_travel.isChecked(), # type: ignore
+            "mixed_pipettes": self.input_mixed_pipettes.isChecked(), # type: ignore
+            "plate_format": int(self.input_plate_format.currentText()), # type: ignore
+            "a_levels": int(self.input_a_levels.value()), # type: ignore
             "asp_rate": self.input_asp_rate.value(),
             "disp_rate": self.input_disp_rate.value(),
             "blowout_rate": self.input_blowout_rate.value(),
-
-            # converts dataclasses to list of dicts or separate arrays
-            "wells": [asdict(well) for well in self.experiment_data],
-            "final_conc_uM": [w.final_conc_uM for w in self.experiment_data],
-            "stock_vol_uL": [w.stock_vol_uL for w in self.experiment_data],
-            "diluent_vol_uL": [w.diluent_vol_uL for w in self.experiment_data]
-            
         }
+        return make_config(inputs, result)
+
+    ## generate json with class data
+    def generate_json(self):
+        """Builds JSON from the Data Model, NOT the Table."""
+        #
+        if not len(self.experiment_data):
+            QMessageBox.warning(self, "Warning", "No data to export. Please calculate first.")
+            return
+
+        # build structure
+        data = self.build_config(self.experiment_data)
 
         # dump data json to ui and file  
         try:
@@ -0,0 +1,287 @@
+"""
+Qt-free config generation: the dilution calculation and config building behind config_gui.py, and a batch CLI
+that turns a CSV, YAML or JSON file of experiments into validated configs, one JSON file per experiment.
+Experiments are validated (compiled, volume-checked, estimated and simulated) in parallel worker processes.
+Nothing here imports PySide6.
+
+Usage: python config_tools.py experiments.csv [-o configs] [-j WORKERS] [--no-simulate]
+An experiment has a 'name' and any of the EXPERIMENT_DEFAULTS fields; 'targets_uM' is a comma-separated list
+(semicolons also work in CSV files). YAML and JSON files hold a list of experiments, or
+{"defaults": {...}, "experiments": [...]}.
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+import dual_inducer_assay as assay
+import estimator
+import simulation
+
+## CONSTANTS
+# the GUI's starting values, and what an experiment leaves out
+EXPERIMENT_DEFAULTS = {
+    "stock_name": "Stock Solution",
+    "stock_conc_uM": 15.0,
+    "diluent_name": "Buffer",
+    "total_vol_uL": 100.0,
+    "targets_uM": "0, 2, 4, 6, 8, 10, 12, 14",
+    "replicates": 1,
+    "viscous_check": False,
+    "tip_economy": False,
+    "multi_dispense": False,
+    "transposed_b": False,
+    "direct_dilution": False,
+    "optimize_travel": False,
+    "mixed_pipettes": False,
+    "plate_format": 96, # or 384, see PLATE LAYOUT in dual_inducer_assay.py
+    "a_levels": 8, # A gradient columns, 1-8
+    "asp_rate": 50.0,
+    "disp_rate": 150.0,
+    "blowout_rate": 150.0,
+}
+MAX_LISTED_WARNINGS = 10 # over-volume targets named in the warning summary
+EXPERIMENT_NAME = re.compile(r'[\w.-]+')
+
+## dilution results, one array per column
+@dataclass
+class DilutionResult:
+    final_conc_uM: np.ndarray = field(default_factory=lambda: np.empty(0))
+    stock_vol_uL: np.ndarray = field(default_factory=lambda: np.empty(0))
+    diluent_vol_uL: np.ndarray = field(default_factory=lambda: np.empty(0))
+    over_volume: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=bool)) # needs more stock than the total volume
+
+    def __len__(self) -> int:
+        return len(self.final_conc_uM)
+
+    def to_wells(self) -> List[dict]:
+        """Per-well dicts, as written to the config's 'wells'."""
+        columns = (self.final_conc_uM.tolist(), self.stock_vol_uL.tolist(), self.diluent_vol_uL.tolist())
+        return [{"final_conc_uM": c, "stock_vol_uL": s, "diluent_vol_uL": d} for c, s, d in zip(*columns)]
+
+## dilutions calculator function
+def parse_targets(text: str) -> np.ndarray:
+    """Comma-separated concentrations to an array. Raises ValueError on anything that is not a number."""
+    return np.array([x for x in text.split(',') if x.strip()], dtype=float)
+
+def calculate_dilutions(stock_conc_uM: float, total_vol_uL: float, targets_uM) -> DilutionResult:
+    """
+    returns a DilutionResult for all targets at once
+    """
+    targets = np.asarray(targets_uM, dtype=float)
+    # C1V1 = C2V2  =>  V1 = (C2 * V2) / C1
+    if stock_conc_uM == 0:
+        stock_vol = np.zeros_like(targets)
+    else:
+        stock_vol = targets * total_vol_uL / stock_conc_uM
+    diluent_vol = total_vol_uL - stock_vol
+    return DilutionResult(targets, stock_vol, diluent_vol, stock_vol > total_vol_uL)
+
+def over_volume_message(result: DilutionResult) -> Optional[str]:
+    """One summary of all targets that need more stock than the total volume, or None."""
+    over = result.final_conc_uM[result.over_volume]
+    if not len(over):
+        return None
+    listed = ", ".join(f"{conc:g}" for conc in over[:MAX_LISTED_WARNINGS])
+    more = f" and {len(over) - MAX_LISTED_WARNINGS} more" if len(over) > MAX_LISTED_WARNINGS else ""
+    return f"{len(over)} target(s) require more stock than total volume: {listed}{more} μM"
+
+## config building
+def make_config(inputs: dict, result: DilutionResult) -> dict:
+    """The config written to dilution_config.json, from the EXPERIMENT_DEFAULTS fields and their dilutions."""
+    config = {key: value for key, value in inputs.items() if key in EXPERIMENT_DEFAULTS and key != "targets_uM"}
+    # converts dataclasses to list of dicts or separate arrays
+    config.update({
+        "wells": result.to_wells(),
+        "final_conc_uM": result.final_conc_uM.tolist(),
+        "stock_vol_uL": result.stock_vol_uL.tolist(),
+        "diluent_vol_uL": result.diluent_vol_uL.tolist(),
+    })
+    return config
+
+def coerce_experiment(raw: dict) -> dict:
+    """
+    Checks an experiment's fields and converts them to the types of EXPERIMENT_DEFAULTS, so CSV text like
+    'yes' or '3' works. Raises ValueError on unknown fields and unreadable values.
+    """
+    experiment = {}
+    for key, value in raw.items():
+        if key == "name":
+            experiment[key] = str(value)
+            continue
+        if key not in EXPERIMENT_DEFAULTS:
+            raise ValueError(f"Unknown experiment field '{key}'")
+        kind = type(EXPERIMENT_DEFAULTS[key])
+        if kind is bool and isinstance(value, str):
+            if value.strip().lower() not in ("true", "yes", "y", "1", "false", "no", "n", "0"):
+                raise ValueError(f"'{key}' expected yes or no, got '{value}'")
+            value = value.strip().lower() in ("true", "yes", "y", "1")
+        elif kind is bool and not isinstance(value, bool):
+            raise ValueError(f"'{key}' expected bool, got {type(value)}")
+        elif key == "targets_uM" and isinstance(value, (list, tuple)):
+            value = ", ".join(str(target) for target in value)
+        elif kind is not bool:
+            try:
+                value = int(float(value)) if kind is int else kind(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"'{key}' expected {kind.__name__}, got '{value}'") from None
+        experiment[key] = value
+    return experiment
+
+def experiment_config(experiment: dict) -> dict:
+    """
+    The config for one experiment, with EXPERIMENT_DEFAULTS for the fields it leaves out.
+    Raises ValueError on bad inputs, and on targets that need more stock than the total volume.
+    """
+    inputs = {**EXPERIMENT_DEFAULTS, **coerce_experiment(experiment)}
+    if inputs["stock_conc_uM"] <= 0:
+        raise ValueError("Stock concentration must be greater than 0.")
+    try:
+        targets = parse_targets(inputs["targets_uM"])
+    except ValueError:
+        raise ValueError("Invalid input in Target Concentrations. Please use numbers separated by commas.") from None
+    result = calculate_dilutions(inputs["stock_conc_uM"], inputs["total_vol_uL"], targets)
+    message = over_volume_message(result)
+    if message is not None:
+        raise ValueError(message)
+    return make_config(inputs, result)
+
+## validation
+class SimulationCancelled(Exception):
+    pass
+
+@dataclass
+class ValidationReport:
+    minutes: Optional[float] = None
+    tips: Optional[int] = None
+    tip_racks: Optional[int] = None
+    commands: Optional[int] = None
+    fill_sheet: List[str] = field(default_factory=list) # reservoir uL per well, see dual_inducer_assay.format_fill_sheet
+    errors: List[str] = field(default_factory=list)
+
+def validate_config(config: dict, is_cancelled=lambda: False, simulate: bool = True) -> ValidationReport:
+    """
+    Compiles, volume-checks, estimates and (unless simulate is False) simulates a config, through the simulation cache.
+    Raises SimulationCancelled as soon as is_cancelled() returns True, between stages or between simulated commands.
+    """
+    report = ValidationReport()
+
+    def check_cancelled(_command: str = ""):
+        if is_cancelled():
+            raise SimulationCancelled()
+
+    try:
+        # ValueError: invalid parameters, or wells that would run dry or overflow
+        plan = assay.compile_plan(config)
+        check_cancelled()
+        report.fill_sheet = assay.format_fill_sheet(assay.fill_sheet(assay.track_volumes(plan)))
+        report.tip_racks = len(assay.config_tip_usage(config)['tip_slots'])
+        # ValueError: the tip racks run out
+        estimate = estimator.estimate_plan(plan)
+        report.minutes = estimate.total_s / 60
+        report.tips = estimate.total_count('pick_up_tip')
+        check_cancelled()
+        if simulate:
+            report.commands = len(simulation.simulate(config, emit=check_cancelled).commands)
+    except SimulationCancelled:
+        raise
+    except Exception as e:
+        # the simulator raises its own exception types, and all of them mean the config cannot run
+        report.errors.append(str(e) or type(e).__name__)
+    return report
+
+## batch input
+def read_experiments(path: str) -> List[dict]:
+    """Experiments from a CSV, YAML or JSON file, each with a unique 'name' (experiment_NN if it has none)."""
+    extension = os.path.splitext(path)[1].lower()
+    defaults = {}
+    if extension == ".csv":
+        with open(path, newline='') as f:
+            # empty cells fall back to the defaults
+            experiments = [{key: value.replace(';', ',') for key, value in row.items() if value and value.strip()} for row in csv.DictReader(f)]
+    elif extension in (".yaml", ".yml", ".json"):
+        with open(path) as f:
+            if extension == ".json":
+                data = json.load(f)
+            else:
+                try:
+                    import yaml
+                except ImportError:
+                    raise ImportError("Reading YAML experiments needs PyYAML: pip install pyyaml") from None
+                data = yaml.safe_load(f)
+        if isinstance(data, dict):
+            defaults, experiments = data.get("defaults", {}), data.get("experiments", [])
+        else:
+            experiments = data
+    else:
+        raise ValueError(f"Experiments must be a .csv, .yaml, .yml or .json file. Got: {path}")
+
+    named = []
+    for i, experiment in enumerate(experiments, start=1):
+        experiment = {**defaults, **experiment}
+        experiment["name"] = str(experiment.get("name") or f"experiment_{i:02d}")
+        if not EXPERIMENT_NAME.fullmatch(experiment["name"]):
+            raise ValueError(f"Experiment names may only hold letters, digits, '_', '-' and '.'. Got: '{experiment['name']}'")
+        named.append(experiment)
+    names = [experiment["name"] for experiment in named]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate experiment names: {', '.join(duplicates)}")
+    return named
+
+def _validate_in_worker(config: dict, simulate: bool) -> ValidationReport:
+    return validate_config(config, simulate=simulate)
+
+def validate_configs(configs: List[dict], workers: int = 1, simulate: bool = True) -> List[ValidationReport]:
+    """validate_config() for many configs, in up to workers processes (the simulator is pure Python, so threads would not help)."""
+    if workers <= 1 or len(configs) <= 1:
+        return [validate_config(config, simulate=simulate) for config in configs]
+    with ProcessPoolExecutor(max_workers=min(workers, len(configs))) as pool:
+        return list(pool.map(_validate_in_worker, configs, [simulate] * len(configs)))
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('experiments', help="CSV, YAML or JSON file of experiments")
+    parser.add_argument('-o', '--output-dir', default='configs', help="where to write one config per valid experiment")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help="validation processes")
+    parser.add_argument('--no-simulate', action='store_true', help="compile, volume-check and estimate only")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    experiments = read_experiments(args.experiments)
+    configs, reports = {}, {}
+    for experiment in experiments:
+        try:
+            configs[experiment["name"]] = experiment_config(experiment)
+        except ValueError as e:
+            reports[experiment["name"]] = ValidationReport(errors=[str(e)])
+    reports.update(zip(configs, validate_configs(list(configs.values()), args.workers, not args.no_simulate)))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    lines = [f"{'Experiment':<24}{'Status':<8}{'Minutes':>9}{'Tips':>6}{'Racks':>7}{'Commands':>10}"]
+    errors = []
+    for experiment in experiments:
+        name = experiment["name"]
+        report = reports[name]
+        if not report.errors:
+            # same format as the GUI's "Generate JSON"
+            with open(os.path.join(args.output_dir, f"{name}.json"), 'w') as f:
+                f.write(json.dumps(configs[name], indent=4))
+        errors += [f"{name}: {error}" for error in report.errors]
+        minutes = "-" if report.minutes is None else f"{report.minutes:.2f}"
+        lines.append(f"{name:<24}{'FAIL' if report.errors else 'OK':<8}{minutes:>9}{report.tips or '-':>6}{report.tip_racks or '-':>7}{report.commands or '-':>10}")
+    print("\n".join(lines + errors))
+    valid = sum(not report.errors for report in reports.values())
+    print(f"{valid} of {len(experiments)} configs written to {args.output_dir} in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+    return 0 if valid == len(experiments) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,268 @@
+"""
+Monte-Carlo model of dose accuracy: how far the inducer concentrations in the destination plates drift from
+nominal once pipetting errors compound through the dilution chains. Every trial replays a config's compiled
+plan, so it follows the exact transfers of the A and B gradients and of their placement, with:
+- a random volume error per aspirate and dispense (volume_cv), shared by the channels of a multichannel, and a
+  systematic one per pipette and run (systematic_cv);
+- incomplete mixing: a dispense leaves the well stratified, and the dispense itself and every mix repetition
+  remove mix_efficiency of the difference between what an aspirate draws and the well's mean;
+- liquid left in the tip by every dispense (dead_volume_ul), which leaves with the next blow-out.
+Trials run vectorised with NumPy, in chunks to bound memory. Doses are relative to the inducer stocks.
+
+Usage: python dose_accuracy.py [dilution_config.json] [--trials N] [--tolerance 0.1] [--sweep]
+"""
+import argparse
+import sys
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+import dual_inducer_assay as assay
+import estimator
+
+SPECIES = ('a', 'b')
+TRIALS = 100_000
+CHUNK_TRIALS = 10_000 # trials simulated at once; memory is about 20 bytes per well of every labware slot per trial
+TOLERANCE = 0.10 # relative dose error still counted as accurate
+ACCURATE_SHARE = 0.95 # share of trials a dose level must have within the tolerance
+ERROR_BINS = np.linspace(-0.5, 0.5, 1001) # relative error histogram edges; errors beyond go into the end bins
+SWEEP_MIX_REPS = (1, 2, 3, 5)
+
+@dataclass(frozen=True)
+class ErrorModel:
+    """Pipetting errors of a trial, see the module docstring. The defaults are rough figures for a P300 GEN2."""
+    volume_cv: float = 0.02
+    systematic_cv: float = 0.01
+    mix_efficiency: float = 0.8
+    dead_volume_ul: float = 1.0
+
+PERFECT = ErrorModel(0.0, 0.0, 1.0, 0.0)
+
+@dataclass
+class DoseAccuracy:
+    """Per-well distributions of the relative dose error (dose / nominal - 1) of every destination well."""
+    wells: list[str]
+    nominal: np.ndarray # (species, wells), relative to the stock
+    histogram: np.ndarray # (species, wells, bins) trials per ERROR_BINS bin
+    error_sum: np.ndarray # (species, wells)
+    error_sq_sum: np.ndarray # (species, wells)
+    trials: int
+
+    def levels(self) -> list[tuple]:
+        """Dose levels, [(species, nominal, well indices)], pooling the wells and plates that get the same dose."""
+        levels = {}
+        for s, species in enumerate(SPECIES):
+            for w, nominal in enumerate(self.nominal[s]):
+                if nominal > 0:
+                    levels.setdefault((species, float(f"{nominal:.6g}")), []).append(w)
+        return [(species, nominal, wells) for (species, nominal), wells in sorted(levels.items())]
+
+    def stats(self, species: str, wells: list, tolerance: float = TOLERANCE) -> dict:
+        """Bias, CV, 5-95 % range of the relative error and share of trials within tolerance, over some wells."""
+        s = SPECIES.index(species)
+        n = self.trials * len(wells)
+        mean = self.error_sum[s, wells].sum() / n
+        std = np.sqrt(max(self.error_sq_sum[s, wells].sum() / n - mean ** 2, 0.0))
+        counts = self.histogram[s, wells].sum(axis=0)
+        cumulative = np.cumsum(counts) / n
+        centres = (ERROR_BINS[:-1] + ERROR_BINS[1:]) / 2
+        return {
+            'bias': mean,
+            'cv': std / (1 + mean),
+            'p5': centres[np.searchsorted(cumulative, 0.05)],
+            'p95': centres[min(np.searchsorted(cumulative, 0.95), len(centres) - 1)],
+            'within': counts[np.abs(centres) <= tolerance + 1e-9].sum() / n,
+        }
+
+def with_mix_reps(plan: dict, reps: int) -> dict:
+    """The plan with every mix made of reps repetitions, to see what more or less mixing would do."""
+    return dict(plan, ops=[op._replace(reps=reps) if op.kind == 'mix' else op for op in plan['ops']])
+
+def _layout(plan: dict) -> tuple:
+    """
+    Row of the first well of every slot the model tracks, the row count, the stock of every reservoir well, and
+    the (rows, columns) of every slot's labware.
+    """
+    if set(plan['supplied']) != {slot for slot, label in plan['labels'].items() if label == 'reservoir'}:
+        # their gradients come from an earlier run, so the errors they carry are unknown here
+        raise ValueError("The plan reuses source plates of an earlier run; model the run that made them instead.")
+    slots = sorted({slot for slot, label in plan['labels'].items() if label != 'tips'}, key=int)
+    shapes = {slot: assay.labware_shape(plan['labware'][slot]) for slot in slots}
+    bases, total = {}, 0
+    for slot in slots:
+        bases[slot] = total
+        total += shapes[slot][0] * shapes[slot][1]
+    stocks = np.zeros((len(SPECIES), total, 1), dtype=np.float32)
+    for slot in plan['supplied']:
+        for (_, col), pool in assay.RESERVOIR_POOLS.items():
+            for s, species in enumerate(SPECIES):
+                if species in pool:
+                    stocks[s, bases[slot] + col * 8:bases[slot] + col * 8 + 8] = 1.0
+    return bases, total, stocks, shapes
+
+def _run(plan: dict, model: ErrorModel, trials: int, rng: np.random.Generator, layout: tuple) -> tuple:
+    """Replays a plan for a chunk of trials. Returns the volume (rows, trials) and amount (species, rows, trials) of every well."""
+    bases, rows, stocks, shapes = layout
+    supplied = {bases[slot] for slot in plan['supplied']}
+    channels = {mount: 8 if 'multi' in spec['name'] else 1 for mount, spec in plan['pipettes'].items()}
+    volume = np.zeros((rows, trials), dtype=np.float32)
+    amount = np.zeros((len(SPECIES), rows, trials), dtype=np.float32)
+    skew = np.zeros((len(SPECIES), rows, trials), dtype=np.float32) # drawn concentration minus the well's mean
+    bias = {mount: 1 + model.systematic_cv * rng.standard_normal(trials, dtype=np.float32) for mount in channels}
+    tip_volume = {mount: np.zeros((n, trials), dtype=np.float32) for mount, n in channels.items()}
+    tip_amount = {mount: np.zeros((len(SPECIES), n, trials), dtype=np.float32) for mount, n in channels.items()}
+    keep = 1 - model.mix_efficiency
+
+    def wells(mount, where):
+        slot, well = where.split('/')[:2]
+        plate_rows = shapes[slot][0]
+        first = bases[slot] + assay.well_number(well, plate_rows)
+        # the channels land on every other row of a 384-well plate
+        step = plate_rows // assay.CHANNELS
+        return bases[slot] in supplied, slice(first, first + channels[mount] * step, step)
+
+    def actual(mount, nominal):
+        if model.volume_cv == 0:
+            return nominal * bias[mount]
+        return nominal * (bias[mount] + model.volume_cv * rng.standard_normal(trials, dtype=np.float32))
+
+    def add(rows_, volume_in, concentration):
+        held = volume[rows_] + volume_in
+        share = volume_in / np.maximum(held, 1e-6)
+        volume[rows_] = held
+        amount[:, rows_] += concentration * volume_in
+        mean = amount[:, rows_] / np.maximum(held, 1e-6)
+        # the new liquid is a layer of its share of the well, only partly mixed in by the dispense
+        skew[:, rows_] = skew[:, rows_] * (1 - share) + keep * share * (concentration - mean)
+
+    for kind, mount, where, nominal, _, reps in plan['ops']:
+        if kind == 'aspirate':
+            is_supplied, rows_ = wells(mount, where)
+            if is_supplied:
+                taken = np.broadcast_to(actual(mount, nominal), tip_volume[mount].shape)
+                concentration = stocks[:, rows_]
+            else:
+                held = volume[rows_]
+                taken = np.minimum(actual(mount, nominal), held)
+                # a draw of the whole well gets its mean, a small one mostly what lies at the tip
+                share = taken / np.maximum(held, 1e-6)
+                concentration = np.maximum(amount[:, rows_] / np.maximum(held, 1e-6) + skew[:, rows_] * (1 - share), 0)
+                volume[rows_] = held - taken
+                amount[:, rows_] = np.maximum(amount[:, rows_] - concentration * taken, 0)
+            tip_volume[mount] += taken
+            tip_amount[mount] += concentration * taken
+        elif kind in ('dispense', 'blow_out'):
+            if kind == 'dispense':
+                given = np.clip(actual(mount, nominal), 0, np.maximum(tip_volume[mount] - model.dead_volume_ul, 0))
+            else:
+                given = tip_volume[mount].copy()
+            concentration = tip_amount[mount] / np.maximum(tip_volume[mount], 1e-6)
+            tip_volume[mount] -= given
+            tip_amount[mount] -= concentration * given
+            if where != assay.TRASH:
+                is_supplied, rows_ = wells(mount, where)
+                if not is_supplied:
+                    add(rows_, given, concentration)
+        elif kind == 'mix':
+            _, rows_ = wells(mount, where)
+            skew[:, rows_] *= keep ** reps
+        elif kind in ('pick_up_tip', 'drop_tip'):
+            tip_volume[mount][:] = 0
+            tip_amount[mount][:] = 0
+    return volume, amount
+
+def _destination_rows(plan: dict, layout: tuple) -> tuple:
+    """Addresses of the destination plate wells (A1, B1, ... H12 of each plate in slot order) and their model rows."""
+    bases, shapes = layout[0], layout[3]
+    labels = {plate['label'] for plate in assay.PLATE_FORMATS.values()}
+    slots = sorted((slot for slot, label in plan['labels'].items() if label in labels), key=int)
+    wells = [f"{slot}/{row}{col}" for slot in slots for col in range(1, shapes[slot][1] + 1) for row in assay.PLATE_ROWS[:shapes[slot][0]]]
+    rows = [bases[slot] + i for slot in slots for i in range(shapes[slot][0] * shapes[slot][1])]
+    return wells, rows
+
+def nominal_doses(plan: dict) -> tuple:
+    """
+    What every destination well gets with perfect pipetting: its addresses (see _destination_rows) and
+    doses (species, wells), relative to the stocks.
+    """
+    layout = _layout(plan)
+    wells, rows = _destination_rows(plan, layout)
+    volume, amount = _run(plan, PERFECT, 1, np.random.default_rng(0), layout)
+    return wells, amount[:, rows, 0] / np.maximum(volume[rows, 0], 1e-6)
+
+def dose_accuracy(plan: dict, model: ErrorModel = ErrorModel(), trials: int = TRIALS, seed: int | None = 0, chunk_trials: int = CHUNK_TRIALS) -> DoseAccuracy:
+    """Runs the Monte-Carlo model on a compiled plan, see the module docstring."""
+    layout = _layout(plan)
+    wells, rows = _destination_rows(plan, layout)
+
+    def doses(volume, amount):
+        return amount[:, rows] / np.maximum(volume[rows], 1e-6)
+
+    nominal = nominal_doses(plan)[1]
+    accuracy = DoseAccuracy(wells, nominal, np.zeros((len(SPECIES), len(wells), len(ERROR_BINS) - 1), dtype=np.int64), np.zeros(nominal.shape), np.zeros(nominal.shape), trials)
+    rng = np.random.default_rng(seed)
+    bins = len(ERROR_BINS) - 1
+    offsets = np.arange(len(SPECIES) * len(wells)).reshape(len(SPECIES), len(wells), 1) * bins
+    for start in range(0, trials, chunk_trials):
+        n = min(chunk_trials, trials - start)
+        error = doses(*_run(plan, model, n, rng, layout)) / np.where(nominal > 0, nominal, 1)[:, :, None] - 1
+        error[nominal == 0] = 0
+        accuracy.error_sum += error.sum(axis=2)
+        accuracy.error_sq_sum += np.square(error, dtype=np.float64).sum(axis=2)
+        index = np.clip(np.searchsorted(ERROR_BINS, error) - 1, 0, bins - 1)
+        accuracy.histogram += np.bincount((index + offsets).ravel(), minlength=accuracy.histogram.size).reshape(accuracy.histogram.shape)
+    return accuracy
+
+def format_accuracy(accuracy: DoseAccuracy, tolerance: float = TOLERANCE) -> str:
+    lines = [f"{'Inducer':<9}{'Dose (x stock)':>15}{'Wells':>7}{'Bias %':>8}{'CV %':>7}{'5-95 % range':>16}{f'Within {tolerance:.0%}':>12}"]
+    for species, nominal, wells in accuracy.levels():
+        stats = accuracy.stats(species, wells, tolerance)
+        spread = f"{stats['p5']:+.1%} {stats['p95']:+.1%}"
+        lines.append(f"{species.upper():<9}{nominal:>15.4g}{len(wells):>7}{stats['bias'] * 100:>8.2f}{stats['cv'] * 100:>7.2f}{spread:>16}{stats['within']:>12.1%}")
+    return "\n".join(lines)
+
+def sweep(config: dict, model: ErrorModel = ErrorModel(), trials: int = TRIALS, tolerance: float = TOLERANCE) -> str:
+    """
+    Dose accuracy against pipetting steps and run time, at SWEEP_MIX_REPS mix repetitions, for the serial
+    dilution and, if the config has the GUI's per-well volumes, the direct one.
+    """
+    lines = [f"{'Dilution':<10}{'Mix reps':>9}{'Steps':>7}{'Minutes':>9}{'Worst bias %':>14}{'Worst CV %':>12}{'Accurate levels':>17}"]
+    for direct in (False, True) if config.get("wells") else (False,):
+        plan = assay.compile_plan(dict(config, direct_dilution=direct))
+        for reps in SWEEP_MIX_REPS:
+            candidate = with_mix_reps(plan, reps)
+            estimate = estimator.estimate_plan(candidate)
+            accuracy = dose_accuracy(candidate, model, trials)
+            stats = [accuracy.stats(species, wells, tolerance) for species, _, wells in accuracy.levels()]
+            accurate = sum(s['within'] >= ACCURATE_SHARE for s in stats)
+            lines.append(f"{'direct' if direct else 'serial':<10}{reps:>9}{estimate.total_count('aspirate') + estimate.total_count('dispense'):>7}{estimate.total_s / 60:>9.2f}"
+                         f"{max(abs(s['bias']) for s in stats) * 100:>14.2f}{max(s['cv'] for s in stats) * 100:>12.2f}{f'{accurate} of {len(stats)}':>17}")
+    return "\n".join(lines)
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('config', nargs='?', default=assay.CONFIG_PATH)
+    parser.add_argument('--trials', type=int, default=TRIALS)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="relative dose error counted as accurate")
+    parser.add_argument('--volume-cv', type=float, default=ErrorModel.volume_cv)
+    parser.add_argument('--systematic-cv', type=float, default=ErrorModel.systematic_cv)
+    parser.add_argument('--mix-efficiency', type=float, default=ErrorModel.mix_efficiency)
+    parser.add_argument('--dead-volume', type=float, default=ErrorModel.dead_volume_ul, help="uL left in the tip by every dispense")
+    parser.add_argument('--sweep', action='store_true', help="compare serial and direct dilution at several mix repetitions")
+    args = parser.parse_args(argv)
+
+    if args.trials < 1 or not 0 < args.mix_efficiency <= 1:
+        parser.error("--trials must be at least 1 and --mix-efficiency within (0, 1]")
+    model = ErrorModel(args.volume_cv, args.systematic_cv, args.mix_efficiency, args.dead_volume)
+    config = assay.load_config(args.config)
+    start = time.perf_counter()
+    if args.sweep:
+        print(sweep(config, model, args.trials, args.tolerance))
+    else:
+        print(format_accuracy(dose_accuracy(assay.compile_plan(config), model, args.trials), args.tolerance))
+    print(f"{args.trials} trials per plan in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,218 @@
+"""
+Dose-response analysis of plate-reader output for the dual inducer assay.
+Every plate-reader CSV is one destination plate, mapped back to the layout run() makes (see PLATE LAYOUT in
+dual_inducer_assay.py), CSVs in the order of the run's plates. Each replicate's region has the blank (PBS and
+cells) in its column 1, the inducer A, inducer B and A + B controls in columns 2-4 and the A x B matrix after them,
+whose doses come from the config's compiled plan (see nominal_doses in dose_accuracy.py). Each replicate is
+blank-subtracted, normalised to its A + B control and fitted with a 2D Hill surface,
+    response = bottom + (top - bottom) * A^nA / (EC50_A^nA + A^nA) * B^nB / (EC50_B^nB + B^nB),
+by a Levenberg-Marquardt fit that runs on the replicates of a whole batch of plates at once. Batches can run in parallel
+processes, and results are written as each batch finishes. Doses and EC50s are relative to the stocks.
+
+Usage: python dose_response.py dilution_config.json plate.csv [plate.csv ...] [-o results.csv] [-j N]
+"""
+import argparse
+import csv
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator
+
+import numpy as np
+
+import dual_inducer_assay as assay
+import dose_accuracy
+
+# region columns (0-based), see fill_destination_plates()
+BLANK_COLUMN = assay.CONTROL_COLUMNS['blank']
+A_CONTROL_COLUMN = assay.CONTROL_COLUMNS['a']
+B_CONTROL_COLUMN = assay.CONTROL_COLUMNS['b']
+AB_CONTROL_COLUMN = assay.CONTROL_COLUMNS['ab']
+MATRIX_COLUMNS = slice(assay.MATRIX_START, None)
+PARAMETERS = ('bottom', 'top', 'ec50_a', 'hill_a', 'ec50_b', 'hill_b')
+RESULT_FIELDS = ('plate', 'replicate', 'blank', 'a_control', 'b_control') + PARAMETERS + ('r2', 'rmse')
+BATCH_PLATES = 64 # plates fitted at once, and per worker process
+FIT_ITERATIONS = 100
+HILL_RANGE = (0.2, 8.0) # Hill coefficients the fit may reach
+
+def read_plate(path: str, shape: tuple = (8, 12)) -> np.ndarray:
+    """
+    Reads one plate of shape (rows, columns), 8 x 12 (rows A-H) by default, from a plate-reader CSV: either a grid,
+    with a row label followed by a value per column on each row (header and metadata lines are skipped), or a
+    list with 'well' and 'value' columns.
+    """
+    rows, columns = shape
+    row_labels = assay.PLATE_ROWS[:rows]
+    with open(path, newline='') as f:
+        lines = [row for row in csv.reader(f) if any(cell.strip() for cell in row)]
+    plate = np.full(shape, np.nan)
+    header = [cell.strip().lower() for cell in lines[0]] if lines else []
+    if 'well' in header and 'value' in header:
+        well_idx, value_idx = header.index('well'), header.index('value')
+        for row in lines[1:]:
+            well = row[well_idx].strip().upper()
+            plate[row_labels.index(well[0]), int(well[1:]) - 1] = float(row[value_idx])
+    else:
+        for row in lines:
+            label = row[0].strip().upper()
+            if len(label) == 1 and label in row_labels and len(row) >= columns + 1:
+                plate[row_labels.index(label)] = [float(cell) for cell in row[1:columns + 1]]
+    if np.isnan(plate).any():
+        raise ValueError(f"{path}: expected a value for each of the {rows * columns} wells")
+    return plate
+
+def plate_shape(layout: assay.Layout) -> tuple:
+    """(rows, columns) of the destination plates of a layout (see plate_layout)."""
+    plate_format = assay.PLATE_FORMATS[layout.plate_format]
+    return plate_format['rows'], plate_format['columns']
+
+def region_values(plate: np.ndarray, region: assay.Region, width: int) -> np.ndarray:
+    """The (8, width) wells of a replicate's region of a plate, as the multichannel reaches them."""
+    return plate[region.row::region.step, region.column:region.column + width * region.step:region.step]
+
+def plate_doses(config: dict) -> np.ndarray:
+    """Doses (species, 8 rows, region columns) of a replicate's region. All replicates of a run get the same ones."""
+    layout = assay.plate_layout(config)
+    rows, columns = plate_shape(layout)
+    _, doses = dose_accuracy.nominal_doses(assay.compile_plan(config))
+    # wells come A1, B1, ... of each plate in turn; the first replicate is on the first plate
+    plate = doses[:, :rows * columns].reshape(len(dose_accuracy.SPECIES), columns, rows).transpose(0, 2, 1)
+    return np.stack([region_values(species, layout.regions[0], layout.width) for species in plate])
+
+def normalise(plates: np.ndarray) -> tuple:
+    """
+    Blank-subtracts replicates (replicates, 8, region columns) and scales them to their A + B control.
+    Returns the normalised replicates and the blank, A control and B control level of each.
+    """
+    blank = plates[:, :, BLANK_COLUMN].mean(axis=1)
+    signal = plates - blank[:, None, None]
+    full = signal[:, :, AB_CONTROL_COLUMN].mean(axis=1)
+    full = np.where(np.abs(full) > 1e-12, full, 1.0)
+    normalised = signal / full[:, None, None]
+    return normalised, blank, normalised[:, :, A_CONTROL_COLUMN].mean(axis=1), normalised[:, :, B_CONTROL_COLUMN].mean(axis=1)
+
+def _surface(theta: np.ndarray, log_a: np.ndarray, log_b: np.ndarray) -> tuple:
+    """The Hill surface at every dose and its Jacobian, for parameters (plates, 6): bottom, top, ln EC50_A, ln nA, ln EC50_B, ln nB."""
+    bottom, top = theta[:, 0:1], theta[:, 1:2]
+    hills = []
+    for log_ec50, log_hill, log_dose in ((theta[:, 2:3], theta[:, 3:4], log_a), (theta[:, 4:5], theta[:, 5:6], log_b)):
+        hill = np.exp(log_hill)
+        h = 1 / (1 + np.exp(np.clip(hill * (log_ec50 - log_dose), -50, 50)))
+        slope = h * (1 - h)
+        hills.append((h, -hill * slope, -hill * slope * (log_ec50 - log_dose)))
+    (ha, dha_ec50, dha_hill), (hb, dhb_ec50, dhb_hill) = hills
+    span = top - bottom
+    both = ha * hb
+    jacobian = np.stack([1 - both, both, span * hb * dha_ec50, span * hb * dha_hill, span * ha * dhb_ec50, span * ha * dhb_hill], axis=2)
+    return bottom + span * both, jacobian
+
+def fit_surfaces(doses: np.ndarray, responses: np.ndarray, iterations: int = FIT_ITERATIONS) -> tuple:
+    """
+    Fits the Hill surface to many plates at once, by Levenberg-Marquardt with a damping factor per plate.
+    doses are (species, points), shared by the plates; responses (plates, points).
+    Returns the parameters (plates, 6), as in PARAMETERS, and R squared (plates,).
+    """
+    log_a, log_b = np.log(doses[0]), np.log(doses[1])
+    plates = responses.shape[0]
+    theta = np.column_stack([responses.min(axis=1), responses.max(axis=1), np.full(plates, log_a.mean()), np.zeros(plates), np.full(plates, log_b.mean()), np.zeros(plates)])
+    # EC50s stay within a few e-folds of the doses measured, Hill coefficients within HILL_RANGE
+    low = np.array([-np.inf, -np.inf, log_a.min() - 3, np.log(HILL_RANGE[0]), log_b.min() - 3, np.log(HILL_RANGE[0])])
+    high = np.array([np.inf, np.inf, log_a.max() + 3, np.log(HILL_RANGE[1]), log_b.max() + 3, np.log(HILL_RANGE[1])])
+    damping = np.full(plates, 1e-2)
+    fitted, jacobian = _surface(theta, log_a, log_b)
+    cost = np.square(responses - fitted).sum(axis=1)
+    for _ in range(iterations):
+        residual = responses - fitted
+        normal = np.einsum('pni,pnj->pij', jacobian, jacobian)
+        gradient = np.einsum('pni,pn->pi', jacobian, residual)
+        diagonal = np.einsum('pii->pi', normal)
+        damped = normal + (damping[:, None] * (diagonal + 1e-9))[:, :, None] * np.eye(len(PARAMETERS))
+        step = np.linalg.solve(damped, gradient[:, :, None])[:, :, 0]
+        candidate = np.clip(theta + step, low, high)
+        candidate_fit, candidate_jacobian = _surface(candidate, log_a, log_b)
+        candidate_cost = np.square(responses - candidate_fit).sum(axis=1)
+        better = candidate_cost < cost
+        theta = np.where(better[:, None], candidate, theta)
+        fitted = np.where(better[:, None], candidate_fit, fitted)
+        jacobian = np.where(better[:, None, None], candidate_jacobian, jacobian)
+        # a plate is done when an accepted step barely helps, or no step helps any more
+        done = np.where(better, cost - candidate_cost <= 1e-10 * (1 + cost), damping >= 1e6)
+        cost = np.where(better, candidate_cost, cost)
+        damping = np.clip(np.where(better, damping / 3, damping * 3), 1e-9, 1e9)
+        if done.all():
+            break
+    total = np.square(responses - responses.mean(axis=1, keepdims=True)).sum(axis=1)
+    params = theta.copy()
+    params[:, 2:] = np.exp(theta[:, 2:])
+    return params, 1 - cost / np.where(total > 0, total, 1)
+
+def analyse_batch(paths: list, doses: np.ndarray, layout: assay.Layout, first: int = 0) -> list[dict]:
+    """
+    Reads, normalises and fits the replicates of a batch of plates, given the region doses (see plate_doses).
+    first is the position of the batch's first plate among all plates, which gives each its place in the layout.
+    """
+    regions, labels = [], []
+    for i, path in enumerate(paths):
+        plate = read_plate(path, plate_shape(layout))
+        # plates go round the run's plates, so several runs of a config can be analysed together
+        index = (first + i) % len(layout.plate_slots)
+        for replicate, region in enumerate(layout.regions):
+            if region.plate == index:
+                regions.append(region_values(plate, region, layout.width))
+                labels.append((path, replicate + 1))
+    normalised, blank, a_control, b_control = normalise(np.stack(regions))
+    matrix_doses = doses[:, :, MATRIX_COLUMNS].reshape(len(doses), -1)
+    responses = normalised[:, :, MATRIX_COLUMNS].reshape(len(regions), -1)
+    params, r2 = fit_surfaces(matrix_doses, responses)
+    fitted, _ = _surface(np.column_stack([params[:, :2], np.log(params[:, 2:])]), np.log(matrix_doses[0]), np.log(matrix_doses[1]))
+    rmse = np.sqrt(np.square(responses - fitted).mean(axis=1))
+    results = []
+    for i, (path, replicate) in enumerate(labels):
+        result = {'plate': path, 'replicate': replicate, 'blank': blank[i], 'a_control': a_control[i], 'b_control': b_control[i]}
+        result.update(zip(PARAMETERS, params[i]))
+        result.update(r2=r2[i], rmse=rmse[i])
+        results.append(result)
+    return results
+
+def analyse(config: dict, paths: Iterable[str], workers: int = 1, batch_plates: int = BATCH_PLATES) -> Iterator[dict]:
+    """Fits every replicate of every plate, yielding its result (see RESULT_FIELDS) in order as soon as its batch is done."""
+    doses = plate_doses(config)
+    layout = assay.plate_layout(config)
+    paths = list(paths)
+    starts = range(0, len(paths), batch_plates)
+    batches = [paths[i:i + batch_plates] for i in starts]
+    if workers <= 1:
+        for start, batch in zip(starts, batches):
+            yield from analyse_batch(batch, doses, layout, start)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for results in pool.map(analyse_batch, batches, [doses] * len(batches), [layout] * len(batches), starts):
+            yield from results
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('config')
+    parser.add_argument('plates', nargs='+', help="plate-reader CSVs, one per destination plate, in the order of the run's plates")
+    parser.add_argument('-o', '--output', help="write the results CSV here instead of printing it")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help=f"worker processes, each fitting {BATCH_PLATES} plates at a time")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    count = 0
+    try:
+        writer = csv.DictWriter(out, RESULT_FIELDS)
+        writer.writeheader()
+        for result in analyse(assay.load_config(args.config), args.plates, args.jobs):
+            writer.writerow({key: value if key in ('plate', 'replicate') else f"{value:.6g}" for key, value in result.items()})
+            count += 1
+            if count % BATCH_PLATES == 0:
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"{count} replicates in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,8 +1,18 @@
-from opentrons import protocol_api
-from opentrons import simulate 
+from __future__ import annotations
+import functools
 import json
-# for simulation run
-protocol = simulate.get_protocol_api('2.19')
+import math
+import os
+import sys
+import time
+from array import array
+from collections import namedtuple
+from typing import TYPE_CHECKING
+# opentrons is only imported for type hints here. The simulator is built on demand in
+# simulate_protocol() so that importing this module stays fast and side-effect free.
+if TYPE_CHECKING:
+    from opentrons import protocol_api
+
 metadata = {
     'protocolName': 'Dual Inducer Assay',
     'author': 'Agnes Cheung, Daniel Luo, Lihao Tao (Opentron Team 4)',
@@ -10,35 +20,94 @@ metadata = {
     'apiLevel': '2.14'
 }
 
-with open('dilution_config.json', 'r') as f:
-    config = json.load(f)
-    
-def validate_parameters(replicates, viscous_check):
-    if replicates not in [1, 2, 3]:
-        raise ValueError(f"Replicates must be 1, 2, or 3. Got: {replicates}")
-    
-    if not isinstance(viscous_check, bool):
-        raise ValueError(f"Warning: 'viscous_check' expected bool, got {type(viscous_check)}")
-
-REPLICATES = config.get("replicates") 
-VISCOUS = config.get("viscous_check")
-ASP_RATE = config.get("asp_rate")
-DISP_RATE = config.get("disp_rate")
-BLOW_RATE = config.get("blowout_rate")
+CONFIG_PATH = 'dilution_config.json'
+SIMULATION_API_LEVEL = '2.19'
+# mirrors config_tools.EXPERIMENT_DEFAULTS, for headless tooling
+DEFAULT_CONFIG = {
+    "replicates": 1,
+    "viscous_check": False,
+    "asp_rate": 50.0,
+    "disp_rate": 150.0,
+    "blowout_rate": 150.0,
+}
+
+# (absolute path, mtime) -> parsed config
+_config_cache: dict[tuple[str, int], dict] = {}
+
+def load_config(path: str = CONFIG_PATH) -> dict:
+    """
+    Reads the config written by config_gui.py. 
+    Parsed configs are cached per path and modification time, so repeated runs only hit the disk when the file changes.
+    """
+    abs_path = os.path.abspath(path)
+    try:
+        mtime = os.stat(abs_path).st_mtime_ns
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Config file '{abs_path}' not found. Generate one with config_gui.py first.") from None
+    key = (abs_path, mtime)
+    if key not in _config_cache:
+        # drop entries for older versions of the same file
+        for stale in [k for k in _config_cache if k[0] == abs_path]:
+            del _config_cache[stale]
+        with open(abs_path, 'r') as f:
+            _config_cache[key] = json.load(f)
+    return dict(_config_cache[key])
+
+# config switches, False when left out; viscous_check has to be set
+BOOL_FIELDS = ('viscous_check', 'tip_economy', 'multi_dispense', 'transposed_b', 'direct_dilution', 'reuse_source', 'optimize_travel', 'mixed_pipettes')
+
+def validate_parameters(config: dict):
+    """Checks the run parameters of a config. Raises ValueError on the first one that is wrong."""
+    for field in BOOL_FIELDS:
+        value = config.get(field, None if field == 'viscous_check' else False)
+        if not isinstance(value, bool):
+            raise ValueError(f"Warning: '{field}' expected bool, got {type(value)}")
+    replicates = config.get("replicates")
+    transposed_b = config.get("transposed_b", False)
+    plate_offset = config.get("plate_offset", 0)
+    tip_start_column = config.get("tip_start_column", 1)
+    single_tip_start = config.get("single_tip_start", 'A1')
+
+    # every replicate needs a B gradient of its own: a source plate column, or a B plate row (see plate_offset below)
+    if not isinstance(replicates, int) or not 1 <= replicates <= (B_PLATE_ROWS if transposed_b else len(B_SOURCE_COLUMNS)):
+        raise ValueError(f"Replicates must be 1 to {len(B_SOURCE_COLUMNS)}, or 1 to {B_PLATE_ROWS} with transposed_b. Got: {replicates}")
+    if transposed_b and replicates < TRANSPOSED_B_MIN_REPLICATES and not config.get("reuse_source", False):
+        raise ValueError(f"transposed_b makes a run of {replicates} replicate(s) slower; it needs {TRANSPOSED_B_MIN_REPLICATES} replicates or more, or reuse_source.")
+
+    # only the transposed B plate has a gradient per row, so only it can serve plates beyond the first run's
+    if plate_offset and not transposed_b:
+        raise ValueError("'plate_offset' needs transposed_b, which keeps one B gradient per B plate row.")
+    if not isinstance(plate_offset, int) or plate_offset < 0 or plate_offset + replicates > B_PLATE_ROWS:
+        raise ValueError(f"'plate_offset' plus replicates must stay within the {B_PLATE_ROWS} B plate rows. Got: {plate_offset}")
+
+    if tip_start_column not in range(1, 13):
+        raise ValueError(f"'tip_start_column' must be 1 to 12. Got: {tip_start_column}")
+
+    # the single-channel's own tip rack (mixed_pipettes) may be part used, from its next tip on
+    if not isinstance(single_tip_start, str) or single_tip_start not in [f"{row}{col}" for col in range(1, 13) for row in ROWS]:
+        raise ValueError(f"'single_tip_start' must be a tip rack well, A1 to H12. Got: {single_tip_start}")
+    if single_tip_start != 'A1' and not config.get("mixed_pipettes", False):
+        raise ValueError("'single_tip_start' needs mixed_pipettes, which gives the single-channel a tip rack of its own.")
+
+def get_flow_rates(config: dict) -> dict:
+    """Per-pipette flow rates (uL/s) from the config."""
+    asp_rate = config.get("asp_rate")
+    disp_rate = config.get("disp_rate")
+    blow_rate = config.get("blowout_rate")
+    return {
+        "p300m_asp":  asp_rate,
+        "p300m_disp": disp_rate,
+        "p300m_blow": blow_rate,
+        "p300s_asp":  asp_rate,
+        "p300s_disp": disp_rate,
+        "p300s_blow": blow_rate
+    }
+
 LABWARE = {
     'tips': 'opentrons_96_tiprack_300ul', 
     'reservoir': 'axygen_96_wellplate_500ul', 
     'plate': 'axygen_96_wellplate_500ul' 
 }
-FLOW_RATES = {
-    "p300m_asp":  ASP_RATE,
-    "p300m_disp": DISP_RATE,
-    "p300m_blow": BLOW_RATE,
-    "p300s_asp":  ASP_RATE,
-    "p300s_disp": DISP_RATE,
-    "p300s_blow": BLOW_RATE
-}
-
 FLOW_VOL = {
     "asp_vol": 300,
     "disp_vol": 300,
@@ -47,10 +116,11 @@ FLOW_VOL = {
     'cell_transfer_high': 70,
     'cell_transfer_low': 40,
 }
-RATE_MULTIPLIERS = {
-    'default': 1.0,
-    'slow': 0.5,
-}
+# run() is split into these phases. Each one is announced with a PHASE_PREFIX comment
+# so that tooling (e.g. estimator.py) can attribute commands to a phase.
+PHASES = ('pbs', 'inducer_a', 'inducer_b', 'controls', 'gradient', 'cells')
+PHASE_PREFIX = 'PHASE: '
+# deck slots by the number of destination plates (see PLATE LAYOUT)
 PLATE_LAYOUT = {
     1: {
         'plate_slots': [8],
@@ -65,54 +135,1377 @@ PLATE_LAYOUT = {
         'tip_slots':   [1, 2, 4, 7, 10]
     }
 }
+# tip economy mode needs fewer racks than the 3-plate layout has slots for: further destination plates take
+# its tip slots, from the last one back, as long as the racks left fit the run (see tip_usage)
+EXTRA_PLATE_SLOTS = [10, 7, 4, 2, 1]
+# transposed B mode builds the B gradient on an extra plate, in the one slot that is free in every layout
+B_PLATE_SLOT = 3
+# its extra plate and sweep only pay off from this many replicates on (see bench_transposed_b in benchmark.py);
+# runs that reuse the B plate of an earlier run (reuse_source) do not dilute, so they may be smaller
+TRANSPOSED_B_MIN_REPLICATES = 3
+# reservoir columns holding the PBS for the B plate (cols 9 & 10), so the source plate PBS columns are untouched
+B_PLATE_PBS_RES_COLS = [8, 9]
+# reservoir columns holding the cells (col 4, then cols 11 & 12 once a run needs more than col 4 holds, see cells_columns)
+CELL_RES_COLS = [3, 10, 11]
+# what each reservoir column (by index) holds, for fill sheets
+RESERVOIR_LIQUIDS = {1: 'inducer A stock', 2: 'inducer B stock', 3: 'cells', 4: 'PBS', 5: 'PBS', 6: 'PBS', 7: 'PBS', 8: 'PBS (B plate)', 9: 'PBS (B plate)', 10: 'cells', 11: 'cells'}
+RESERVOIR_DEAD_VOL = 50 # uL per reservoir well the tips cannot reach
+SOURCE_DEAD_VOL = 20 # uL per source plate well the tips cannot reach
+# (capacity, dead volume) in uL per well of the labware loaded under each label. LABWARE names the stand-ins 
+# the simulator knows; these are the wells of the custom labware on the deck (see README).
+WELL_VOLUMES = {
+    'reservoir': (2200, RESERVOIR_DEAD_VOL), # 4ti0136_96_wellplate_2200ul
+    'source plate': (2200, SOURCE_DEAD_VOL), # 4ti0136_96_wellplate_2200ul
+    'B plate': (2200, SOURCE_DEAD_VOL), # 4ti0136_96_wellplate_2200ul
+    'destination plate': (200, 0), # costar3370flatbottomtransparent_96_wellplate_200ul
+    '384-well destination plate': (112, 0), # corning_384_wellplate_112ul_flat
+    'tips': (0, 0),
+}
+
+## PLATE LAYOUT
+# Where every replicate goes on the destination plates, from the plate format ('plate_format', 96 or 384) and
+# the number of A levels ('a_levels', 1-8). A replicate fills a region: the blank, the A, B and A + B control
+# columns and a column per A level, each holding the 8 B levels down the rows one multichannel column reaches.
+# Regions sit side by side in grids of 8 x 12 wells the multichannel can address: a 96-well plate is one grid.
+# On a 384-well plate the channels land on every other row, so the plate holds four interleaved grids, starting
+# at A1, B1, A2 and B2, each taking every other row and column. The source plate keeps the A gradient in
+# cols 1 to a_levels, and each replicate's B gradient in a column of B_SOURCE_COLUMNS (or a B plate row).
+PLATE_FORMATS = {
+    96: {'load_name': LABWARE['plate'], 'label': 'destination plate', 'rows': 8, 'columns': 12},
+    384: {'load_name': 'corning_384_wellplate_112ul_flat', 'label': '384-well destination plate', 'rows': 16, 'columns': 24},
+}
+PLATE_ROWS = 'ABCDEFGHIJKLMNOP'
+CHANNELS = 8 # of the multichannel, one per row of a grid
+GRID_COLUMNS = 12
+CONTROL_COLUMNS = {'blank': 0, 'a': 1, 'b': 2, 'ab': 3} # region columns of the controls
+MATRIX_START = 4 # region column of the first A level
+MAX_A_LEVELS = 8 # source plate cols 1-8
+B_SOURCE_COLUMNS = (9, 10, 11) # source plate column of each replicate's B gradient, without transposed_b
+B_PLATE_ROWS = 8 # transposed B mode: one B gradient per B plate row
+# a replicate's region: its plate (index), first row and column (indices), and the step between its rows and columns
+Region = namedtuple('Region', ['plate', 'row', 'column', 'step'])
+Layout = namedtuple('Layout', ['plate_format', 'a_levels', 'width', 'plate_slots', 'tip_slots', 'regions'])
+
+def labware_shape(load_name: str) -> tuple:
+    """(rows, columns) of a labware: the destination formats' own, 96-well for everything else."""
+    for plate in PLATE_FORMATS.values():
+        if plate['load_name'] == load_name:
+            return plate['rows'], plate['columns']
+    return 8, 12
+
+def well_number(name: str, rows: int = 8) -> int:
+    """Position of a well (e.g. 'B3') in A1, B1, ... order, on labware with this many rows."""
+    return (int(name[1:]) - 1) * rows + PLATE_ROWS.index(name[0])
+
+def regions_per_plate(plate_format: int, a_levels: int) -> int:
+    step = PLATE_FORMATS[plate_format]['rows'] // CHANNELS
+    return step * step * (GRID_COLUMNS // (MATRIX_START + a_levels))
+
+def plate_layout(config: dict) -> Layout:
+    """Where a config's replicates go: the destination plate and tip rack slots, and a Region per replicate."""
+    replicates = config.get("replicates")
+    plate_format = config.get("plate_format", 96)
+    a_levels = config.get("a_levels", MAX_A_LEVELS)
+    if not isinstance(replicates, int) or replicates < 1:
+        raise ValueError(f"Replicates must be a positive whole number. Got: {replicates}")
+    if plate_format not in PLATE_FORMATS:
+        raise ValueError(f"'plate_format' must be one of {', '.join(str(f) for f in PLATE_FORMATS)}. Got: {plate_format}")
+    if not isinstance(a_levels, int) or not 1 <= a_levels <= MAX_A_LEVELS:
+        raise ValueError(f"'a_levels' must be 1 to {MAX_A_LEVELS}. Got: {a_levels}")
+    step = PLATE_FORMATS[plate_format]['rows'] // CHANNELS
+    width = MATRIX_START + a_levels
+    per_grid = GRID_COLUMNS // width
+    per_plate = regions_per_plate(plate_format, a_levels)
+    plates = math.ceil(replicates / per_plate)
+    if plates > max_plates(config):
+        raise ValueError(f"{replicates} replicates need {plates} destination plates, but at most {max_plates(config)} fit on the deck" + ("." if config.get("tip_economy", False) else " without tip_economy."))
+    regions = []
+    for i in range(replicates):
+        plate, k = divmod(i, per_plate)
+        grid, side = divmod(k, per_grid)
+        regions.append(Region(plate, grid % step, grid // step + side * width * step, step))
+    if plates in PLATE_LAYOUT:
+        return Layout(plate_format, a_levels, width, PLATE_LAYOUT[plates]['plate_slots'], PLATE_LAYOUT[plates]['tip_slots'], regions)
+    full = PLATE_LAYOUT[max(PLATE_LAYOUT)]
+    extra = EXTRA_PLATE_SLOTS[:plates - max(PLATE_LAYOUT)]
+    return Layout(plate_format, a_levels, width, full['plate_slots'] + extra, [slot for slot in full['tip_slots'] if slot not in extra], regions)
+
+def max_plates(config: dict) -> int:
+    """Most destination plates on the deck: those of PLATE_LAYOUT, and with tip_economy one in every slot of EXTRA_PLATE_SLOTS but the last, left for tips."""
+    return max(PLATE_LAYOUT) + (len(EXTRA_PLATE_SLOTS) - 1 if config.get("tip_economy", False) else 0)
+
+def max_replicates(config: dict) -> int:
+    """
+    Most replicates one run of a config holds: as many regions as fit on the deck, each with its own B gradient,
+    and no more than the tip racks and reservoir wells that fit can serve, i.e. the most that compile. 1 if even
+    that does not compile, so compiling it reports why.
+    """
+    deck = regions_per_plate(config.get("plate_format", 96), config.get("a_levels", MAX_A_LEVELS)) * max_plates(config)
+    most = min(deck, B_PLATE_ROWS if config.get("transposed_b", False) else len(B_SOURCE_COLUMNS))
+    for replicates in range(most, 1, -1):
+        try:
+            # travel optimization only reorders, so it cannot change what fits
+            compile_plan(dict(config, replicates=replicates, plate_offset=0, optimize_travel=False))
+            return replicates
+        except ValueError:
+            pass
+    return 1
+
+def cells_columns(replicates: int, width: int) -> list[int]:
+    """
+    Reservoir column (index) every replicate's cells come from: the first of CELL_RES_COLS until it is full,
+    then the next. Raises ValueError if they all are.
+    """
+    high = CONTROL_COLUMNS['ab']
+    per_replicate = high * FLOW_VOL['cell_transfer_high'] + (width - high) * FLOW_VOL['cell_transfer_low']
+    capacity, dead = WELL_VOLUMES['reservoir']
+    return [CELL_RES_COLS[i] for i in plan_source_wells([per_replicate] * replicates, capacity - dead, len(CELL_RES_COLS))]
+
+class PlanRegion:
+    """A replicate's region of a destination plate (see PLATE LAYOUT): columns of 8 wells, addressed like a plate of its own."""
+    def __init__(self, plate: PlanLabware, region: Region, width: int):
+        self.slot = plate.slot
+        self._columns = [plate.columns()[region.column + col * region.step][region.row::region.step] for col in range(width)]
+
+    def columns(self) -> list[list[PlanWell]]:
+        return self._columns
+
+## PLAN COMPILER
+# run() is split into a compile stage and an executor. The protocol logic below runs against a
+# PlanContext, a stand-in for ProtocolContext that records what the robot should do as a flat list
+# of Ops instead of doing it. execute_plan() then replays the Ops against a real ProtocolContext.
+# Wells are addressed as '<slot>/<well>', with '/top' appended for the top of the well.
+PLAN_VERSION = 2
+Op = namedtuple('Op', ['kind', 'pipette', 'where', 'volume', 'rate', 'reps'])
+TRASH = 'trash'
+ROWS = 'ABCDEFGH'
+
+class PlanLocation:
+    """A position in or above a well, by address."""
+    def __init__(self, address: str):
+        self.address = address
+
+    def __repr__(self):
+        return self.address
+
+class PlanWell(PlanLocation):
+    def __init__(self, address: str, ledger: VolumeLedger | None = None):
+        super().__init__(address)
+        self._ledger = ledger
+
+    def top(self) -> PlanLocation:
+        return PlanLocation(f"{self.address}/top")
+
+    def current_volume(self) -> float:
+        """uL in the well at this point of the plan. Supplied wells (see VolumeLedger) hold minus what was drawn."""
+        return self._ledger.volume(self.address)
+
+class PlanLabware:
+    """Labware as columns of wells (see labware_shape): 96-well, or a 384-well destination plate."""
+    def __init__(self, load_name: str, slot: int, ledger: VolumeLedger | None = None):
+        self.load_name = load_name
+        self.slot = slot
+        rows, columns = labware_shape(load_name)
+        self._columns = [[PlanWell(f"{slot}/{row}{col}", ledger) for row in PLATE_ROWS[:rows]] for col in range(1, columns + 1)]
+
+    def columns(self) -> list[list[PlanWell]]:
+        return self._columns
+
+    def wells_by_name(self) -> dict:
+        return {well.address.split('/')[1]: well for col in self._columns for well in col}
+
+class _SettingRecorder:
+    """Records attribute assignments (e.g. pipette.flow_rate.aspirate = 50) as 'set' ops."""
+    def __init__(self, ops: list, mount: str, group: str):
+        object.__setattr__(self, '_target', (ops, mount, group))
+
+    def __setattr__(self, name, value):
+        ops, mount, group = self._target
+        ops.append(Op('set', mount, f"{group}.{name}", value, 1.0, 0))
+        object.__setattr__(self, name, value)
+
+class PlanPipette:
+    """Records InstrumentContext calls as Ops."""
+    def __init__(self, ops: list, spec: dict, name: str, mount: str, max_volume: float, min_volume: float, ledger: VolumeLedger | None = None, spans: list | None = None):
+        self._ops = ops
+        self._spans = spans # calls of @traced helpers, see TRACING
+        self._spec = spec
+        self._ledger = ledger
+        self.name = name
+        self.mount = mount
+        self.max_volume = max_volume
+        self.min_volume = min_volume
+        self.flow_rate = _SettingRecorder(ops, mount, 'flow_rate')
+        self.well_bottom_clearance = _SettingRecorder(ops, mount, 'well_bottom_clearance')
+        self.liquid: dict | None = None # liquid class in use, see use_liquid()
+
+    @property
+    def starting_tip(self) -> PlanWell | None:
+        address = self._spec.get('starting_tip')
+        return None if address is None else PlanWell(address)
+
+    @starting_tip.setter
+    def starting_tip(self, well: PlanWell):
+        self._spec['starting_tip'] = well.address
+
+    def _op(self, kind: str, where: PlanLocation | str = '', volume: float = 0, rate: float = 1.0, reps: int = 0):
+        op = Op(kind, self.mount, where if isinstance(where, str) else where.address, volume, rate, reps)
+        self._ops.append(op)
+        if self._ledger is not None:
+            self._ledger.apply(op, len(self._ops) - 1)
+
+    def pick_up_tip(self):
+        self._op('pick_up_tip')
+
+    def drop_tip(self):
+        self._op('drop_tip', TRASH)
+
+    def aspirate(self, volume: float, location: PlanLocation, rate: float = 1.0):
+        self._op('aspirate', location, volume, rate)
+
+    def dispense(self, volume: float, location: PlanLocation, rate: float = 1.0):
+        self._op('dispense', location, volume, rate)
+
+    def mix(self, repetitions: int, volume: float, location: PlanLocation, rate: float = 1.0):
+        self._op('mix', location, volume, rate, repetitions)
+
+    def blow_out(self, location: PlanLocation | str = TRASH):
+        self._op('blow_out', location)
+
+    def delay(self, seconds: float):
+        """ProtocolContext.delay, recorded on this pipette's mount so the delay stays with its transfer."""
+        self._op('delay', '', seconds)
+
+    def distribute(self, volume: float, source: PlanWell, dest, new_tip: str = 'once'):
+        """
+        Same liquid handling as InstrumentContext.distribute for the calls this protocol makes: a disposal 
+        volume of min_volume per aspirate, blown out into the trash, and a tip 'once' or for every aspirate ('always').
+        Rates (multi_dispense_rate) and delays are those of the pipette's liquid class (see use_liquid), which the real one knows nothing of.
+        """
+        dests = []
+        for d in dest if isinstance(dest, list) else [dest]:
+            dests.extend(d if isinstance(d, list) else [d])
+        if 'multi' in self.name:
+            # the multichannel reaches a whole column from its first well (row A, or B of a 384-well plate), so only those count
+            firsts = {}
+            for d in dests:
+                slot, well = d.address.split('/')[:2]
+                firsts.setdefault((slot, well[1:]), d)
+            dests = list(firsts.values())
+        groups = pack_dispenses([volume] * len(dests), self.max_volume, self.min_volume)
+        if new_tip == 'once':
+            self.pick_up_tip()
+        for group in groups:
+            if new_tip == 'always':
+                self.pick_up_tip()
+            self.aspirate(volume * len(group) + self.min_volume, source, rate=liquid_rate(self, 'multi_dispense_rate'))
+            liquid_delay(self, 'aspirate_delay_s')
+            for i in group:
+                self.dispense(volume, dests[i], rate=liquid_rate(self, 'multi_dispense_rate'))
+                liquid_delay(self, 'dispense_delay_s')
+            self.blow_out(TRASH)
+            if new_tip == 'always':
+                self.drop_tip()
+        if new_tip == 'once':
+            self.drop_tip()
+
+# (max volume, min volume) of the pipettes we use
+PIPETTE_VOLUMES = {
+    'p300_multi_gen2': (300, 20),
+    'p300_single_gen2': (300, 20),
+}
+
+class PlanContext:
+    """
+    Records ProtocolContext calls into a plan: labware (with labels, see WELL_VOLUMES), pipettes and the flat
+    list of ops. Every op is also applied to a VolumeLedger, so the protocol can ask wells what they hold.
+    """
+    def __init__(self):
+        self.plan = {'version': PLAN_VERSION, 'labware': {}, 'labels': {}, 'supplied': [], 'pipettes': {}, 'ops': [], 'spans': []}
+        self.ledger = VolumeLedger()
+
+    def load_labware(self, load_name: str, slot: int, label: str | None = None) -> PlanLabware:
+        self.plan['labware'][str(slot)] = load_name
+        if label is not None:
+            self.plan['labels'][str(slot)] = label
+            self.ledger.add_labware(slot, label, labware_shape(load_name))
+        return PlanLabware(load_name, slot, self.ledger)
+
+    def load_instrument(self, instrument_name: str, mount: str, tip_racks: list) -> PlanPipette:
+        spec = {'name': instrument_name, 'tip_racks': [str(rack.slot) for rack in tip_racks]}
+        self.plan['pipettes'][mount] = spec
+        self.ledger.add_pipette(mount, instrument_name)
+        return PlanPipette(self.plan['ops'], spec, instrument_name, mount, *PIPETTE_VOLUMES[instrument_name], ledger=self.ledger, spans=self.plan['spans'])
+
+    def supply(self, labware: PlanLabware):
+        """Marks labware as loaded by hand before the run, with whatever the plan turns out to draw from it."""
+        self.plan['supplied'].append(str(labware.slot))
+        self.ledger.supply(labware.slot)
+
+    def comment(self, msg: str):
+        self.plan['ops'].append(Op('comment', '', msg, 0, 1.0, 0))
+
+def compile_plan(config: dict) -> dict:
+    """
+    Compiles a config into a plan: {'version', 'labware', 'labels', 'supplied', 'pipettes', 'ops', 'spans'}.
+    Raises ValueError if a well would run dry, be drawn into its dead volume or overflow.
+    """
+    context = PlanContext()
+    build_protocol(context, config)
+    issues = context.ledger.check()
+    if issues:
+        raise ValueError(format_issues(issues))
+    if config.get("optimize_travel", False):
+        # the reordered plan gets the same checks, on a replay
+        optimized = optimize_travel(context.plan)
+        issues = track_volumes(optimized).check()
+        if issues:
+            raise ValueError(format_issues(issues))
+        return optimized
+    return context.plan
+
+def execute_plan(protocol: protocol_api.ProtocolContext, plan: dict, tracer: Tracer | None = None, checkpoint: Checkpoint | None = None):
+    """
+    Replays a compiled plan against a ProtocolContext, passing every op to the tracer (see TRACING) and
+    the checkpoint (see CHECKPOINTS), if any.
+    """
+    labware = {slot: protocol.load_labware(load_name, int(slot), label=plan['labels'].get(slot)) for slot, load_name in plan['labware'].items()}
+    pipettes = {
+        mount: protocol.load_instrument(spec['name'], mount, tip_racks=[labware[slot] for slot in spec['tip_racks']])
+        for mount, spec in plan['pipettes'].items()
+    }
+    for mount, spec in plan['pipettes'].items():
+        if 'starting_tip' in spec:
+            slot, well = spec['starting_tip'].split('/')
+            pipettes[mount].starting_tip = labware[slot].wells_by_name()[well]
+
+    def resolve(pipette, address: str):
+        if address == TRASH:
+            trash = pipette.trash_container
+            # older API levels hand back the trash as labware rather than a trash bin
+            return trash.wells()[0] if hasattr(trash, 'wells') else trash
+        slot, well, *position = address.split('/')
+        well = labware[slot].wells_by_name()[well]
+        return well.top() if position else well
+
+    hooks = [hook for hook in (tracer, checkpoint) if hook is not None]
+    for hook in hooks:
+        hook.start(plan)
+    try:
+        for index, (kind, mount, where, volume, rate, reps) in enumerate(plan['ops']):
+            for hook in hooks:
+                hook.op_started(index)
+            pipette = pipettes.get(mount)
+            if kind == 'comment':
+                protocol.comment(where)
+            elif kind == 'set':
+                group, name = where.split('.')
+                setattr(getattr(pipette, group), name, volume)
+            elif kind == 'pick_up_tip':
+                # plans pick up the next tip; replays of part of a plan (see simulation.py) name the tip
+                pipette.pick_up_tip(resolve(pipette, where) if where else None)
+            elif kind == 'drop_tip':
+                pipette.drop_tip()
+            elif kind == 'aspirate':
+                pipette.aspirate(volume, resolve(pipette, where), rate=rate)
+            elif kind == 'dispense':
+                pipette.dispense(volume, resolve(pipette, where), rate=rate)
+            elif kind == 'mix':
+                pipette.mix(reps, volume, resolve(pipette, where), rate=rate)
+            elif kind == 'blow_out':
+                pipette.blow_out(resolve(pipette, where))
+            elif kind == 'delay':
+                protocol.delay(seconds=volume)
+            else:
+                raise ValueError(f"Unknown plan op '{kind}'")
+            for hook in hooks:
+                hook.op_finished(index)
+    finally:
+        # a run that fails part-way still leaves a trace and a checkpoint up to the failing op
+        for hook in hooks:
+            hook.close()
+
+## TRACING
+# Structured events of a plan's execution, to profile runs on the robot (set 'trace_path' in the config) or in
+# the simulator (see simulation.py --trace). Every op but comments is an event, with its phase, mount, well,
+# volume, rate and the tip on the pipette. Calls of the @traced helpers below (move_liquid, distribute_pbs, ...)
+# are recorded at compile time as spans of the ops they made, and become events with their source and destination
+# wells, as do phases. Times are seconds from the start of the run: real ones, or the estimator's when a simulation
+# passes op durations. Events are written one at a time, as JSON lines or as a Chrome trace (chrome://tracing or
+# ui.perfetto.dev), so a run that stops part-way still leaves its trace.
+TRACE_FORMATS = ('jsonl', 'chrome')
+TRACE_THREADS = {'phases': 0, 'left': 1, 'right': 2} # Chrome trace tracks
+
+def traced(helper):
+    """Records every call of a protocol helper, whose first argument is the pipette, as a span of the ops it made."""
+    @functools.wraps(helper)
+    def wrapper(pipette, *args, **kwargs):
+        start = len(pipette._ops)
+        result = helper(pipette, *args, **kwargs)
+        if pipette._spans is not None and len(pipette._ops) > start:
+            pipette._spans.append([helper.__name__, start, len(pipette._ops)])
+        return result
+    return wrapper
+
+class Tracer:
+    """
+    Writes the events of a plan's execution to path, in one of TRACE_FORMATS. durations: seconds per op
+    (see estimator.op_seconds) to time events by, instead of the clock.
+    """
+    def __init__(self, path: str, fmt: str = 'jsonl', durations: list | None = None):
+        if fmt not in TRACE_FORMATS:
+            raise ValueError(f"Unknown trace format '{fmt}', expected one of {', '.join(TRACE_FORMATS)}")
+        self.path = path
+        self.format = fmt
+        self.durations = durations
+        self._file = None
+
+    def start(self, plan: dict):
+        self._plan = plan
+        self._span_ends = {}
+        for name, first, end in plan.get('spans', []):
+            self._span_ends.setdefault(end - 1, []).append((name, first))
+        self._starts = [0.0] * len(plan['ops'])
+        self._used_tips = tips_gone(plan)
+        self._tips = {}
+        self._phase, self._phase_start = None, 0.0
+        self._elapsed, self._clock = 0.0, time.perf_counter()
+        self._file = open(self.path, 'w')
+        if self.format == 'chrome':
+            self._file.write('[\n')
+            self._sep = ''
+            for thread, tid in TRACE_THREADS.items():
+                self._write({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': thread}})
+
+    def _now(self) -> float:
+        return self._elapsed if self.durations is not None else time.perf_counter() - self._clock
+
+    def _write(self, record: dict):
+        if self.format == 'jsonl':
+            self._file.write(json.dumps(record) + '\n')
+        else:
+            self._file.write(self._sep + json.dumps(record))
+            self._sep = ',\n'
+
+    def _event(self, event: str, name: str, mount: str, start: float, end: float, details: dict):
+        if self.format == 'jsonl':
+            self._write({'event': event, 'name': name, 'phase': self._phase, 'mount': mount or None, 'start_s': round(start, 6), 'duration_s': round(end - start, 6), **details})
+        else:
+            self._write({'name': name, 'cat': event, 'ph': 'X', 'ts': round(start * 1e6), 'dur': round((end - start) * 1e6), 'pid': 1,
+                         'tid': TRACE_THREADS.get(mount, 0), 'args': dict(details, phase=self._phase)})
+
+    def _end_phase(self, end: float):
+        if self._phase is not None:
+            self._event('phase', self._phase, '', self._phase_start, end, {})
+
+    def op_started(self, index: int):
+        self._starts[index] = self._now()
+
+    def op_finished(self, index: int):
+        kind, mount, where, volume, rate, reps = self._plan['ops'][index]
+        if self.durations is not None:
+            self._elapsed += self.durations[index]
+        start, end = self._starts[index], self._now()
+        if kind == 'comment':
+            if where.startswith(PHASE_PREFIX):
+                self._end_phase(start)
+                self._phase, self._phase_start = where[len(PHASE_PREFIX):], start
+        else:
+            if kind == 'pick_up_tip':
+                self._tips[mount] = where or next_tip(self._plan, mount, self._used_tips)
+            self._event('op', kind, mount, start, end, {'op': index, 'where': where, 'volume': volume, 'rate': rate, 'reps': reps, 'tip': self._tips.get(mount)})
+            if kind == 'drop_tip':
+                self._tips[mount] = None
+        for name, first in self._span_ends.pop(index, []):
+            ops = self._plan['ops'][first:index + 1]
+            liquid = [op for op in ops if op.kind in ('aspirate', 'dispense')]
+            dests = [op.where for op in liquid if op.kind == 'dispense']
+            self._event('call', name, next((op.pipette for op in ops if op.pipette), ''), self._starts[first], end, {
+                'ops': [first, index + 1],
+                'sources': list(dict.fromkeys(op.where for op in liquid if op.kind == 'aspirate')),
+                'dests': list(dict.fromkeys(dests)),
+                'volume': sum(op.volume for op in liquid if op.kind == 'dispense'),
+                'rates': sorted({op.rate for op in liquid}),
+                'tips': sum(op.kind == 'pick_up_tip' for op in ops),
+            })
+
+    def close(self):
+        if self._file is None:
+            return
+        self._end_phase(self._now())
+        if self.format == 'chrome':
+            self._file.write('\n]\n')
+        self._file.close()
+        self._file = None
+
+def config_tracer(config: dict) -> Tracer | None:
+    """The tracer a config asks for with 'trace_path' (and 'trace_format', jsonl by default), if any."""
+    path = config.get('trace_path')
+    return None if not path else Tracer(path, config.get('trace_format', 'jsonl'))
+
+## CHECKPOINTS
+# A run that stops part-way (tips or a reservoir well run out, the robot is stopped) can be resumed rather than
+# started over. With 'checkpoint_path' in the config, execute_plan() records after every op how many ops of the
+# plan are done. 'resume_from' restarts the same config from that checkpoint ("checkpoint"), from the start of a
+# phase (by name) or from any op (by index; plan_tools.py resume lists the helper calls and transfers to start
+# from). resume_plan() skips the ops that are done, then puts back the pipette settings, the tips that were on
+# and whatever liquid they held when the run stopped, aspirated again from where it came from. That only works
+# for supplied sources: a stop between drawing from a plate well and dispensing it (e.g. within a serial dilution)
+# lost that liquid, and has to be resumed from an earlier point, which resume_plan() names. The rest of the
+# plan is checked against what the plates hold by then; the reservoir is topped up by hand to the levels of the
+# resumed plan's fill sheet. 'fresh_tips' tells it the tip racks were replaced with full ones.
+RESUME_CHECKPOINT = 'checkpoint'
+
+def plan_key(plan: dict) -> str:
+    """Hash of a plan's ops, so a checkpoint is only resumed with the plan it was written for."""
+    import hashlib # only needed for checkpoints, see the import time budget in benchmark.py
+    return hashlib.sha256(json.dumps([list(op) for op in plan['ops']]).encode()).hexdigest()[:16]
+
+class Checkpoint:
+    """Records in a JSON file how many ops of a plan are done, after every op (see CHECKPOINTS)."""
+    def __init__(self, path: str):
+        self.path = path
+
+    def start(self, plan: dict):
+        # a resumed plan counts the ops of the plan it was resumed from, so it can be resumed again
+        resumed = plan.get('resumed') or {'plan_key': plan_key(plan), 'done': 0, 'prefix': 0, 'ops': len(plan['ops'])}
+        self._resumed = resumed
+        self._write(resumed['done'])
+
+    def op_started(self, index: int):
+        pass
+
+    def op_finished(self, index: int):
+        if index >= self._resumed['prefix']:
+            self._write(self._resumed['done'] + index + 1 - self._resumed['prefix'])
+
+    def close(self):
+        pass
+
+    def _write(self, done: int):
+        # write then rename, so the robot stopping mid-write never leaves a corrupt checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'plan_key': self._resumed['plan_key'], 'done': done, 'ops': self._resumed['ops']}, f)
+        os.replace(tmp_path, self.path)
+
+def read_checkpoint(path: str, plan: dict) -> int:
+    """How many ops of the plan a checkpoint says are done. Raises ValueError if it is for another plan."""
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint['plan_key'] != plan_key(plan):
+        raise ValueError(f"Checkpoint {path} is for a different plan: the config or the protocol changed since it was written")
+    return checkpoint['done']
+
+def resume_index(plan: dict, point, checkpoint_path: str | None = None) -> int:
+    """The op to resume a plan from: RESUME_CHECKPOINT (read from checkpoint_path), a phase name or an op index."""
+    if point == RESUME_CHECKPOINT:
+        if not checkpoint_path:
+            raise ValueError("Resuming from the checkpoint needs a 'checkpoint_path'")
+        done = read_checkpoint(checkpoint_path, plan)
+    elif isinstance(point, str):
+        phases = [i for i, op in enumerate(plan['ops']) if op.kind == 'comment' and op.where == f"{PHASE_PREFIX}{point}"]
+        if not phases:
+            raise ValueError(f"Unknown phase '{point}' to resume from")
+        done = phases[0]
+    else:
+        done = int(point)
+    if not 0 <= done < len(plan['ops']):
+        raise ValueError(f"Nothing to resume: the plan has {len(plan['ops'])} ops and {done} are done")
+    return done
+
+def resume_points(plan: dict) -> list[tuple]:
+    """Where a plan can sensibly be resumed from: (op index, phase, what starts there) for phases, helper calls and transfers."""
+    starts = {}
+    for name, first, _ in plan.get('spans', []):
+        starts.setdefault(first, []).append(name)
+    points, phase = [], None
+    for index, op in enumerate(plan['ops']):
+        if op.kind == 'comment' and op.where.startswith(PHASE_PREFIX):
+            phase = op.where[len(PHASE_PREFIX):]
+            points.append((index, phase, f"phase {phase}"))
+        # helper calls start outermost first; a call starting with a tip pick-up starts there
+        calls = starts.get(index, [])[::-1]
+        if calls:
+            points.append((index, phase, " > ".join(calls)))
+        elif op.kind == 'aspirate':
+            points.append((index, phase, f"transfer from {op.where}"))
+    return points
+
+def held_liquid(plan: dict, done: int) -> dict:
+    """
+    The liquid in the tips when a plan stops after its first done ops, that the rest of the plan still dispenses:
+    {mount: (volume, index of the aspirate it came from)}.
+    """
+    ops = plan['ops']
+    holding, last_aspirate = [], {}
+    for index, op in enumerate(ops[:done]):
+        if op.kind == 'pick_up_tip':
+            holding.append(op.pipette)
+        elif op.kind == 'drop_tip':
+            holding.remove(op.pipette)
+        elif op.kind == 'aspirate':
+            last_aspirate[op.pipette] = index
+    in_tip = track_volumes(dict(plan, ops=ops[:done])).in_tip
+    held = {}
+    for mount in holding:
+        rest = next((op for op in ops[done:] if op.pipette == mount and op.kind in ('aspirate', 'dispense', 'pick_up_tip', 'drop_tip')), None)
+        if in_tip[mount] > 1e-6 and rest is not None and rest.kind == 'dispense':
+            held[mount] = (in_tip[mount], last_aspirate[mount])
+    return held
+
+def lost_liquid(plan: dict, done: int) -> tuple | None:
+    """The (mount, aspirate index) of tip contents a stop after done ops would lose for good: drawn from a well that is not supplied, so it cannot be drawn again."""
+    for mount, (_, aspirate) in held_liquid(plan, done).items():
+        if plan['ops'][aspirate].where.split('/')[0] not in plan['supplied']:
+            return mount, aspirate
+    return None
+
+def resume_plan(plan: dict, done: int, fresh_tips: bool = False) -> dict:
+    """
+    The rest of a plan once its first done ops have run, started from the state they left (see CHECKPOINTS).
+    Every tip is named. Liquid a tip held is aspirated again, which only works for supplied sources (the reservoir,
+    a reused source plate): raises ValueError naming the last resume point before it if the tip held liquid drawn
+    from a plate well, e.g. mid-way through a serial dilution. Also raises ValueError if tips run out, or a well
+    would run dry, be drawn into its dead volume or overflow given what the plates hold by then.
+    """
+    lost = lost_liquid(plan, done)
+    if lost is not None:
+        mount, aspirate = lost
+        safe = next((point for point in reversed(resume_points(plan)) if point[0] <= aspirate and lost_liquid(plan, point[0]) is None), None)
+        hint = f" Resume from op {safe[0]} ({safe[2]}) instead." if safe else " Start the run over."
+        raise ValueError(f"Cannot resume from op {done}: the {mount} pipette's tip held liquid drawn from {plan['ops'][aspirate].where} (op {aspirate}), which cannot be drawn again.{hint}")
+
+    ops = plan['ops']
+    settings = {mount: {} for mount in plan['pipettes']}
+    holding, phase = [], None
+    for op in ops[:done]:
+        if op.kind == 'set':
+            settings[op.pipette][op.where] = op.volume
+        elif op.kind == 'pick_up_tip':
+            holding.append(op.pipette)
+        elif op.kind == 'drop_tip':
+            holding.remove(op.pipette)
+        elif op.kind == 'comment' and op.where.startswith(PHASE_PREFIX):
+            phase = op
+    held = held_liquid(plan, done)
+
+    prefix = [Op('set', mount, where, value, 1.0, 0) for mount, values in settings.items() for where, value in values.items()]
+    if phase is not None and ops[done] != phase:
+        prefix.append(phase)
+    for mount in holding:
+        prefix.append(Op('pick_up_tip', mount, '', 0, 1.0, 0))
+        # what the tip held is lost when the run stops; it is aspirated again from its supplied source if there is more to dispense
+        if mount in held:
+            volume, aspirate = held[mount]
+            prefix.append(ops[aspirate]._replace(volume=round(volume, 2)))
+            prefix += [op for op in ops[aspirate + 1:aspirate + 2] if op.kind == 'delay' and op.pipette == mount]
+
+    used = set() if fresh_tips else tips_gone(plan)
+    if not fresh_tips:
+        for op in ops[:done]:
+            if op.kind == 'pick_up_tip':
+                next_tip(plan, op.pipette, used)
+    resumed_ops = [op._replace(where=op.where or next_tip(plan, op.pipette, used)) if op.kind == 'pick_up_tip' else op for op in prefix + ops[done:]]
+    shift = len(prefix) - done
+    resumed = dict(plan, ops=resumed_ops,
+                   spans=[[name, first + shift, end + shift] for name, first, end in plan.get('spans', []) if first >= done],
+                   resumed={'plan_key': plan_key(plan), 'done': done, 'prefix': len(prefix), 'ops': len(ops)})
+    issues = resume_volumes(plan, resumed).check()
+    if issues:
+        raise ValueError(format_issues(issues))
+    return resumed
+
+def resume_volumes(plan: dict, resumed: dict) -> VolumeLedger:
+    """Replays a resumed plan (see resume_plan) onto what the done ops of the plan left, with supplied labware topped up anew."""
+    ledger = track_volumes(dict(plan, ops=plan['ops'][:resumed['resumed']['done']]))
+    ledger.issues = []
+    for slot in plan['supplied']:
+        ledger.restock(int(slot))
+    for index, op in enumerate(resumed['ops']):
+        ledger.apply(op, index)
+    return ledger
+
+## VOLUME LEDGER
+# Tracks what every well on the deck holds as a plan is recorded (or replayed with track_volumes()).
+# Wells of supplied labware (the reservoir, and source plates kept from an earlier run) are filled by hand
+# with whatever the plan needs: they start at 0 and go negative as they are drawn from, and the lowest level
+# each reaches is what has to be loaded (see fill_sheet). Every other well starts empty and is checked.
+LedgerIssue = namedtuple('LedgerIssue', ['kind', 'op', 'address', 'volume', 'limit'])
+ISSUE_TEXT = {
+    'underflow': "is drawn below empty",
+    'dead_volume': "is drawn into its dead volume",
+    'mix': "is mixed with more than it holds",
+    'overflow': "overflows",
+    'supply': "needs more than the well holds",
+}
+MAX_LISTED_ISSUES = 10
+WELLS_PER_SLOT = 384 # room for the largest labware (see PLATE_FORMATS)
+SLOTS = 12
+
+class VolumeLedger:
+    """
+    Volumes (uL) of every well on the deck in one flat array, WELLS_PER_SLOT per slot, and what is in each pipette's tips.
+    apply() updates them per op and records a LedgerIssue whenever an unsupplied well is drawn below empty or
+    into its dead volume, mixed with more than it holds, or filled past its capacity.
+    """
+    def __init__(self):
+        size = WELLS_PER_SLOT * SLOTS
+        self.volumes = array('d', [0.0]) * size
+        self.lowest = array('d', [0.0]) * size
+        self.capacity = array('d', [math.inf]) * size
+        self.dead = array('d', [0.0]) * size
+        self.supplied = bytearray(size)
+        self.labels = {}
+        self.shapes = {} # (rows, columns) per slot, 96-well unless given
+        self.channels = {}
+        self.in_tip = {}
+        self.issues: list[LedgerIssue] = []
+
+    def _slot_range(self, slot: int) -> range:
+        rows, columns = self.shapes.get(slot, (8, 12))
+        return range((slot - 1) * WELLS_PER_SLOT, (slot - 1) * WELLS_PER_SLOT + rows * columns)
+
+    def _index(self, address: str) -> int:
+        """Position of a '<slot>/<well>' address in the ledger arrays."""
+        slot, well = address.split('/')[:2]
+        return (int(slot) - 1) * WELLS_PER_SLOT + well_number(well, self.shapes.get(int(slot), (8, 12))[0])
+
+    def add_labware(self, slot: int, label: str, shape: tuple = (8, 12)):
+        self.labels[slot] = label
+        self.shapes[slot] = shape
+        capacity, dead = WELL_VOLUMES[label]
+        wells = self._slot_range(slot)
+        self.capacity[wells.start:wells.stop] = array('d', [capacity]) * len(wells)
+        self.dead[wells.start:wells.stop] = array('d', [dead]) * len(wells)
+
+    def add_pipette(self, mount: str, name: str):
+        self.channels[mount] = 8 if 'multi' in name else 1
+        self.in_tip[mount] = 0.0
+
+    def supply(self, slot: int):
+        wells = self._slot_range(slot)
+        self.supplied[wells.start:wells.stop] = b'\x01' * len(wells)
+
+    def carry(self, previous: VolumeLedger, slot: int):
+        """Takes over what a slot held at the end of an earlier run, instead of supplying it."""
+        wells = self._slot_range(slot)
+        self.volumes[wells.start:wells.stop] = previous.volumes[wells.start:wells.stop]
+        self.lowest[wells.start:wells.stop] = previous.volumes[wells.start:wells.stop]
+        self.supplied[wells.start:wells.stop] = previous.supplied[wells.start:wells.stop]
+
+    def restock(self, slot: int):
+        """Starts a supplied slot over, as if it were not drawn from yet: it is refilled by hand to a new fill sheet."""
+        wells = self._slot_range(slot)
+        self.volumes[wells.start:wells.stop] = array('d', [0.0]) * len(wells)
+        self.lowest[wells.start:wells.stop] = array('d', [0.0]) * len(wells)
+
+    def volume(self, address: str) -> float:
+        return self.volumes[self._index(address)]
+
+    def _wells(self, mount: str, address: str) -> range:
+        # a multichannel reaches the column below the well it is sent to: every row, or every other row of a 384-well plate
+        first = self._index(address)
+        step = self.shapes.get(int(address.split('/')[0]), (8, 12))[0] // CHANNELS
+        return range(first, first + self.channels[mount] * step, step)
+
+    def _issue(self, kind: str, op: int, i: int, volume: float, limit: float):
+        slot, well = divmod(i, WELLS_PER_SLOT)
+        rows = self.shapes.get(slot + 1, (8, 12))[0]
+        self.issues.append(LedgerIssue(kind, op, f"{slot + 1}/{PLATE_ROWS[well % rows]}{well // rows + 1}", round(volume, 2), limit))
+
+    def _add(self, op: int, wells: range, volume: float):
+        for i in wells:
+            level = self.volumes[i] + volume
+            self.volumes[i] = level
+            if level > self.capacity[i] + 1e-6 and not self.supplied[i]:
+                self._issue('overflow', op, i, level, self.capacity[i])
+
+    def _take(self, op: int, wells: range, volume: float):
+        for i in wells:
+            level = self.volumes[i] - volume
+            self.volumes[i] = level
+            if self.supplied[i]:
+                self.lowest[i] = min(self.lowest[i], level)
+            elif level < -1e-6:
+                self._issue('underflow', op, i, level, 0.0)
+            elif level < self.dead[i] - 1e-6:
+                self._issue('dead_volume', op, i, level, self.dead[i])
+
+    def apply(self, op: Op, index: int):
+        """Applies one plan op; index is its position in the plan, for issues."""
+        kind, mount, where, volume, _, _ = op
+        if kind == 'aspirate':
+            self._take(index, self._wells(mount, where), volume)
+            self.in_tip[mount] += volume
+        elif kind == 'dispense':
+            self._add(index, self._wells(mount, where), volume)
+            self.in_tip[mount] -= volume
+        elif kind == 'blow_out':
+            # whatever is left in the tip goes where it is blown out
+            if where != TRASH:
+                self._add(index, self._wells(mount, where), self.in_tip[mount])
+            self.in_tip[mount] = 0.0
+        elif kind == 'mix':
+            for i in self._wells(mount, where):
+                if volume > self.volumes[i] + 1e-6 and not self.supplied[i]:
+                    self._issue('mix', index, i, volume, self.volumes[i])
+        elif kind in ('pick_up_tip', 'drop_tip'):
+            self.in_tip[mount] = 0.0
+
+    def required(self, slot: int) -> list[float]:
+        """uL to load into every well of a supplied slot (A1, B1, ... H12), dead volume included; 0 if unused."""
+        wells = self._slot_range(slot)
+        return [-self.lowest[i] + self.dead[i] if self.lowest[i] < 0 else 0.0 for i in wells]
+
+    def check(self) -> list[LedgerIssue]:
+        """Issues found so far, plus supplied wells that need more than they hold."""
+        issues = list(self.issues)
+        for slot in self.labels:
+            wells = self._slot_range(slot)
+            for i, needed in zip(wells, self.required(slot)):
+                if needed > self.capacity[i] + 1e-6:
+                    self._issue('supply', -1, i, needed, self.capacity[i])
+                    issues.append(self.issues.pop())
+        return issues
+
+def format_issues(issues: list[LedgerIssue]) -> str:
+    lines = [f"Volume check failed with {len(issues)} issue(s):"]
+    for issue in issues[:MAX_LISTED_ISSUES]:
+        where = f"op {issue.op}: " if issue.op >= 0 else ""
+        lines.append(f"  {where}{issue.address} {ISSUE_TEXT[issue.kind]} ({issue.volume:g} uL, limit {issue.limit:g} uL)")
+    if len(issues) > MAX_LISTED_ISSUES:
+        lines.append(f"  ... and {len(issues) - MAX_LISTED_ISSUES} more")
+    return "\n".join(lines)
+
+def track_volumes(plan: dict, carried: VolumeLedger | None = None) -> VolumeLedger:
+    """
+    Replays a plan onto a fresh VolumeLedger. With carried (the ledger of an earlier run), supplied labware 
+    that was not supplied in that run, i.e. source plates it made, starts with what it held at its end.
+    """
+    ledger = VolumeLedger()
+    for slot, label in plan['labels'].items():
+        ledger.add_labware(int(slot), label, labware_shape(plan['labware'][slot]))
+    for slot in plan['supplied']:
+        ledger.supply(int(slot))
+        if carried is not None and int(slot) in carried.labels and not carried.supplied[(int(slot) - 1) * WELLS_PER_SLOT]:
+            ledger.carry(carried, int(slot))
+    for mount, spec in plan['pipettes'].items():
+        ledger.add_pipette(mount, spec['name'])
+    for index, op in enumerate(plan['ops']):
+        ledger.apply(op, index)
+    return ledger
+
+def fill_sheet(ledger: VolumeLedger, slot: int = 5) -> dict:
+    """What to load into each reservoir column: {column: (liquid, uL per row A-H)}, dead volume included."""
+    needed = ledger.required(slot)
+    sheet = {}
+    for col_idx in range(12):
+        volumes = [math.ceil(vol - 1e-6) for vol in needed[col_idx * 8:(col_idx + 1) * 8]]
+        if max(volumes) > 0:
+            sheet[col_idx + 1] = (RESERVOIR_LIQUIDS.get(col_idx, 'unassigned'), volumes)
+    return sheet
+
+def format_fill_sheet(sheet: dict) -> list[str]:
+    """One line per reservoir column, with runs of rows that need the same volume grouped, e.g. 'A 1190, B-H 290'."""
+    lines = []
+    for col, (liquid, volumes) in sheet.items():
+        groups = []
+        for row, vol in zip(ROWS, volumes):
+            if groups and groups[-1][2] == vol:
+                groups[-1][1] = row
+            else:
+                groups.append([row, row, vol])
+        rows = f"{volumes[0]}" if len(groups) == 1 else ", ".join(f"{first}{'-' + last if last != first else ''} {vol}" for first, last, vol in groups)
+        lines.append(f"col {col:>2}: {liquid:<16}{rows}")
+    return lines
+
+## DECK GEOMETRY
+# Well positions come straight from the deck and labware definitions (opentrons_shared_data, imported on
+# first use), so plans can be routed and estimated without a simulator.
+TRAVEL_COST = {
+    'gantry_speed_mm_s': 400.0,  # OT-2 default max x/y speed
+    'slot_change_s': 1.2,        # lift to safe height, travel arc and descend between slots
+    'well_change_s': 0.4,        # short z hop between wells of the same labware
+}
+TRASH_SLOT = '12' # OT-2 fixed trash
+_geometry_cache: dict = {}
+
+def slot_origins() -> dict:
+    """Front-left corner (x, y) of every OT-2 deck slot."""
+    if 'slots' not in _geometry_cache:
+        from opentrons_shared_data.deck import load
+        deck = load('ot2_standard', 5)
+        cutouts = {cutout['id']: cutout['position'] for cutout in deck['locations']['cutouts']}
+        _geometry_cache['slots'] = {
+            area['id']: (cutouts[f"cutout{area['id']}"][0] + area['offsetFromCutoutFixture'][0], cutouts[f"cutout{area['id']}"][1] + area['offsetFromCutoutFixture'][1])
+            for area in deck['locations']['addressableAreas'] if f"cutout{area['id']}" in cutouts
+        }
+    return _geometry_cache['slots']
+
+def well_offsets(load_name: str) -> dict:
+    """(x, y) of every well of a labware, relative to its slot."""
+    if load_name not in _geometry_cache:
+        from opentrons_shared_data.labware import load_definition
+        wells = load_definition(load_name, 1)['wells']
+        _geometry_cache[load_name] = {name: (well['x'], well['y']) for name, well in wells.items()}
+    return _geometry_cache[load_name]
+
+def address_slot(address: str) -> str:
+    return TRASH_SLOT if address == TRASH else address.split('/')[0]
+
+def address_point(plan: dict, address: str) -> tuple:
+    """(x, y, z) of an address; the trash is aimed at the middle of its slot."""
+    if address == TRASH:
+        x, y = slot_origins()[TRASH_SLOT]
+        return (x + 64.0, y + 43.0, 0.0)
+    slot, well = address.split('/')[:2]
+    x, y = slot_origins()[slot]
+    dx, dy = well_offsets(plan['labware'][slot])[well]
+    return (x + dx, y + dy, 0.0)
+
+def travel_s(plan: dict, start: str, end: str) -> float:
+    """Gantry time between two addresses, priced like estimator.estimate_steps does."""
+    distance = math.dist(address_point(plan, start)[:2], address_point(plan, end)[:2])
+    if address_slot(start) != address_slot(end):
+        return distance / TRAVEL_COST['gantry_speed_mm_s'] + TRAVEL_COST['slot_change_s']
+    if distance > 0.5:
+        return distance / TRAVEL_COST['gantry_speed_mm_s'] + TRAVEL_COST['well_change_s']
+    return 0.0
+
+def next_tip(plan: dict, mount: str, used: set) -> str:
+    """Address of the tip the pipette picks up next: a full column for the multichannel, one tip for the single."""
+    multi = 'multi' in plan['pipettes'][mount]['name']
+    for slot in plan['pipettes'][mount]['tip_racks']:
+        for col in range(1, 13):
+            column = [f"{slot}/{row}{col}" for row in ROWS]
+            free = [tip for tip in column if tip not in used]
+            if multi and len(free) == len(column):
+                used.update(column)
+                return column[0]
+            if not multi and free:
+                used.add(free[0])
+                return free[0]
+    raise ValueError(f"Out of tips for the {mount} pipette")
+
+def tips_gone(plan: dict) -> set:
+    """Tips missing before a plan starts: a part-used first rack has nothing before its starting tip."""
+    gone = set()
+    for spec in plan['pipettes'].values():
+        if 'starting_tip' in spec:
+            slot, well = spec['starting_tip'].split('/')
+            gone.update(f"{slot}/{row}{col}" for row in ROWS for col in range(1, int(well[1:])))
+            # a single-channel rack (see MIXED-PIPETTE SCHEDULING) can also start part way down a column
+            gone.update(f"{slot}/{row}{well[1:]}" for row in ROWS[:ROWS.index(well[0])])
+    return gone
+
+## TRAVEL OPTIMIZER
+# Reorders a compiled plan to cut gantry travel, without changing what any well receives or which tip does what:
+# 1. dispenses that share an aspirate are routed as a short path, when each goes to the top of its well or
+#    into an empty one, so the tip picks nothing up;
+# 2. consecutive mixes on one tip are routed the same way when the wells hold the same liquid, so whatever
+#    the tip carries from one into the next is unchanged.
+# Tip pick-ups, drops and the order of the tips are left alone: most of the travel is the trip to the rack and
+# the trash, which no order avoids, and scheduling whole tips saved under a second on any plan.
+TravelSummary = namedtuple('TravelSummary', ['distance_mm', 'seconds', 'slot_changes', 'swaps'])
+
+def travel_summary(plan: dict) -> TravelSummary:
+    """Gantry travel of a plan, tip pick-ups included, and how often it switches pipettes."""
+    used = tips_gone(plan)
+    distance = seconds = 0.0
+    slot_changes = swaps = 0
+    here, mount = None, None
+    for kind, op_mount, where, *_ in plan['ops']:
+        if kind in ('comment', 'set', 'delay'):
+            continue
+        address = next_tip(plan, op_mount, used) if kind == 'pick_up_tip' else where
+        if here is not None:
+            distance += math.dist(address_point(plan, here)[:2], address_point(plan, address)[:2])
+            seconds += travel_s(plan, here, address)
+            slot_changes += address_slot(here) != address_slot(address)
+        swaps += mount is not None and op_mount != mount
+        here, mount = address, op_mount
+    return TravelSummary(round(distance, 1), seconds, slot_changes, swaps)
+
+def _well_of(address: str) -> str:
+    return '/'.join(address.split('/')[:2])
+
+def _channel_wells(plan: dict, mount: str, address: str) -> list[str]:
+    """Every well a pipette reaches at an address (the column below it for the multichannel)."""
+    well = _well_of(address)
+    if 'multi' not in plan['pipettes'][mount]['name']:
+        return [well]
+    slot, name = well.split('/')
+    rows = labware_shape(plan['labware'][slot])[0]
+    return [f"{slot}/{row}{name[1:]}" for row in PLATE_ROWS[PLATE_ROWS.index(name[0]):rows:rows // CHANNELS]]
+
+def _replay_contents(plan: dict) -> dict:
+    """
+    Follows the liquids through a plan: supplied wells hold a liquid of their own, every other well the mix 
+    it was given. Returns {op index: contents} for every dispense (before it) and mix, contents being one 
+    {liquid: uL} per channel.
+    """
+    supplied = set(plan['supplied'])
+    wells, tips, seen = {}, {}, {}
+
+    def take(well, volume):
+        if well.split('/')[0] in supplied:
+            return {well: volume}
+        contents = wells.get(well, {})
+        total = sum(contents.values())
+        if total <= 0:
+            return {}
+        share = {liquid: amount * volume / total for liquid, amount in contents.items()}
+        wells[well] = {liquid: amount - share[liquid] for liquid, amount in contents.items()}
+        return share
+
+    def give(well, share):
+        contents = wells.setdefault(well, {})
+        for liquid, amount in share.items():
+            contents[liquid] = contents.get(liquid, 0.0) + amount
+
+    for index, (kind, mount, where, volume, _, _) in enumerate(plan['ops']):
+        if kind in ('pick_up_tip', 'drop_tip'):
+            tips[mount] = None
+        elif kind == 'aspirate':
+            drawn = [take(well, volume) for well in _channel_wells(plan, mount, where)]
+            tips[mount] = [dict(tip) for tip in (tips.get(mount) or [{}] * len(drawn))]
+            for tip, share in zip(tips[mount], drawn):
+                for liquid, amount in share.items():
+                    tip[liquid] = tip.get(liquid, 0.0) + amount
+        elif kind in ('dispense', 'blow_out') and where != TRASH:
+            targets = _channel_wells(plan, mount, where)
+            if kind == 'dispense':
+                seen[index] = [dict(wells.get(well, {})) for well in targets]
+            for channel, well in enumerate(targets):
+                tip = (tips.get(mount) or [{}] * len(targets))[channel]
+                total = sum(tip.values())
+                if total > 0:
+                    fraction = min(1.0, volume / total) if kind == 'dispense' else 1.0
+                    share = {liquid: amount * fraction for liquid, amount in tip.items()}
+                    give(well, share)
+                    tips[mount][channel] = {liquid: amount - share[liquid] for liquid, amount in tip.items()}
+        elif kind == 'mix':
+            seen[index] = [dict(wells.get(well, {})) for well in _channel_wells(plan, mount, where)]
+    return seen
+
+def _same_liquid(a: list, b: list) -> bool:
+    """Whether two wells (one {liquid: uL} per channel) hold the same mix, whatever their volumes."""
+    def normalised(channel):
+        total = sum(channel.values())
+        return {liquid: round(amount / total, 9) for liquid, amount in channel.items() if amount > 1e-9} if total > 0 else {}
+    return [normalised(channel) for channel in a] == [normalised(channel) for channel in b]
+
+def _route(plan: dict, start: str, stops: list, end: str | None) -> list[int]:
+    """Short path from start through every stop (addresses) to end, if given: nearest neighbour, then 2-opt."""
+    order, left, here = [], list(range(len(stops))), start
+    while left:
+        nearest = min(left, key=lambda i: travel_s(plan, here, stops[i]))
+        order.append(nearest)
+        left.remove(nearest)
+        here = stops[nearest]
+
+    def cost(path):
+        points = [start] + [stops[i] for i in path] + ([end] if end is not None else [])
+        return sum(travel_s(plan, a, b) for a, b in zip(points, points[1:]))
+    best = cost(order)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(len(order) - 1):
+            for j in range(i + 2, len(order) + 1):
+                candidate = order[:i] + order[i:j][::-1] + order[j:]
+                candidate_cost = cost(candidate)
+                if candidate_cost < best - 1e-9:
+                    order, best, improved = candidate, candidate_cost, True
+    return order
+
+def _route_within_tips(plan: dict, contents: dict) -> list:
+    """Passes 1 and 2: reorders dispenses sharing an aspirate, and runs of mixes on wells of the same liquid."""
+    ops = list(plan['ops'])
+    i = 0
+    while i < len(ops):
+        kind, mount = ops[i].kind, ops[i].pipette
+        if kind == 'aspirate':
+            j = i + 1
+            while j < len(ops) and ops[j].kind == 'dispense' and ops[j].pipette == mount:
+                j += 1
+            dispenses = ops[i + 1:j]
+            end = ops[j].where if j < len(ops) and ops[j].kind == 'blow_out' and ops[j].pipette == mount else None
+            targets = [_well_of(op.where) for op in dispenses]
+            clean = all(op.where.endswith('/top') or not any(sum(ch.values()) > 0 for ch in contents[i + 1 + k]) for k, op in enumerate(dispenses))
+            if len(dispenses) > 1 and clean and len(set(targets)) == len(targets) and (end is None or _well_of(end) not in targets):
+                order = _route(plan, ops[i].where, [op.where for op in dispenses], end)
+                ops[i + 1:j] = [dispenses[k] for k in order]
+            i = j
+        elif kind == 'mix':
+            # a run of mix units (mix, then optionally a blow-out over the same well) on wells of one liquid
+            units, j = [], i
+            while j < len(ops) and ops[j].kind == 'mix' and ops[j].pipette == mount and _same_liquid(contents[j], contents[i]):
+                size = 2 if j + 1 < len(ops) and ops[j + 1].kind == 'blow_out' and _well_of(ops[j + 1].where) == _well_of(ops[j].where) else 1
+                units.append(ops[j:j + size])
+                j += size
+            if len(units) > 1:
+                # start from wherever the gantry was last sent, or from the first mix right after a pick-up
+                before = next((op for op in reversed(ops[:i]) if op.kind not in ('comment', 'set', 'delay')), None)
+                start = before.where if before is not None and before.kind != 'pick_up_tip' else ops[i].where
+                order = _route(plan, start, [unit[0].where for unit in units], None)
+                ops[i:j] = [op for k in order for op in units[k]]
+            i = max(j, i + 1)
+        else:
+            i += 1
+    return ops
+
+def optimize_travel(plan: dict) -> dict:
+    """A copy of a compiled plan, reordered to cut gantry travel (see TRAVEL OPTIMIZER), or the plan itself if that does not help."""
+    ops = _route_within_tips(plan, _replay_contents(plan))
+    optimized = dict(plan, ops=ops, spans=_move_spans(plan, ops))
+    return optimized if travel_summary(optimized).seconds < travel_summary(plan).seconds - 1e-6 else plan
+
+def _move_spans(plan: dict, ops: list) -> list:
+    """The plan's spans (see TRACING) over its reordered ops, for the calls whose ops still run one after another."""
+    position = {id(op): i for i, op in enumerate(ops)}
+    spans = []
+    for name, first, end in plan.get('spans', []):
+        moved = sorted(position[id(op)] for op in plan['ops'][first:end] if id(op) in position)
+        if moved and moved[-1] - moved[0] + 1 == len(moved):
+            spans.append([name, moved[0], moved[-1] + 1])
+    return spans
+
+## LIQUID CLASSES
+# How each liquid is pipetted, so only the transfers of a viscous liquid run slow. Rates scale the flow rates 
+# set in the GUI, clearances are mm above the well bottom, and delays (s) let the liquid settle in the tip after
+# an aspirate and leave it after a dispense. Mixes happen in wells already diluted with PBS, so a viscous
+# liquid is mixed at full speed. Multi-dispenses (distribute, multi_dispense) aspirate and dispense at
+# multi_dispense_rate: their disposal volume takes up what a fast draw leaves short, so a viscous liquid keeps
+# full speed there, as under the old global multiplier. No class delays by default; they cost time on every
+# transfer and are there to be set per source. Every reservoir source has a class, set per source under 
+# 'liquid_classes' in the config; 'viscous_check' makes both inducers viscous.
+LIQUID_CLASSES = {
+    'aqueous': {'aspirate_rate': 1.0, 'dispense_rate': 1.0, 'multi_dispense_rate': 1.0, 'mix_rate': 1.0, 'blow_out_rate': 1.0, 'aspirate_clearance_mm': 1.0, 'dispense_clearance_mm': 1.0, 'aspirate_delay_s': 0.0, 'dispense_delay_s': 0.0},
+    # we had issues with inaccurate volumes and air gaps with viscous liquids -> slower speeds, aspirate close to the bottom
+    'viscous': {'aspirate_rate': 0.5, 'dispense_rate': 0.5, 'multi_dispense_rate': 1.0, 'mix_rate': 1.0, 'blow_out_rate': 1.0, 'aspirate_clearance_mm': 0.2, 'dispense_clearance_mm': 1.0, 'aspirate_delay_s': 0.0, 'dispense_delay_s': 0.0},
+}
+LIQUID_SOURCES = ('pbs', 'inducer_a', 'inducer_b', 'cells')
+DEFAULT_CLEARANCE_MM = 1.0 # OT-2 well bottom clearance, before any liquid class sets one
+# the liquids of the tip economy planner's pools (see source_pool); destination wells are mixed once they hold cells
+POOL_LIQUIDS = {'pbs': 'pbs', 'a': 'inducer_a', 'b': 'inducer_b', 'cells': 'cells'}
+
+def liquid_classes(config: dict) -> dict:
+    """
+    The liquid class of every source: {source: class}, with the fields of LIQUID_CLASSES plus its 'name' and
+    'blow_out_flow_rate' (uL/s; blow-outs take no rate, so the class sets the pipette's flow rate).
+    A source's class is named, or a dict of fields to change, on top of the class named by its 'base' ('aqueous' by default).
+    """
+    default = 'viscous' if config.get("viscous_check") else 'aqueous'
+    chosen = config.get("liquid_classes") or {}
+    if not isinstance(chosen, dict):
+        raise ValueError(f"'liquid_classes' expected a dict of source: class, got {type(chosen)}")
+    unknown = set(chosen) - set(LIQUID_SOURCES)
+    if unknown:
+        raise ValueError(f"Unknown liquid sources {sorted(unknown)}. Expected some of {LIQUID_SOURCES}.")
+
+    classes = {}
+    for source in LIQUID_SOURCES:
+        spec = chosen.get(source, default if source in ('inducer_a', 'inducer_b') else 'aqueous')
+        fields = {'base': spec} if isinstance(spec, str) else dict(spec)
+        base = fields.pop('base', 'aqueous')
+        if base not in LIQUID_CLASSES:
+            raise ValueError(f"Unknown liquid class '{base}' for {source}. Expected one of {list(LIQUID_CLASSES)}.")
+        for field, value in fields.items():
+            if field not in LIQUID_CLASSES[base]:
+                raise ValueError(f"Unknown liquid class field '{field}' for {source}. Expected some of {list(LIQUID_CLASSES[base])}.")
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0 or (value == 0 and field.endswith('_rate')):
+                raise ValueError(f"Liquid class field '{field}' for {source} must be a number above 0 (delays and clearances may be 0). Got: {value}")
+        classes[source] = dict(LIQUID_CLASSES[base], **fields, name=base if not fields else f"{base} (adjusted)")
+        classes[source]['blow_out_flow_rate'] = config.get("blowout_rate") * classes[source]['blow_out_rate']
+    return classes
+
+def use_liquid(pipette: PlanPipette, liquid: dict):
+    """
+    Switches a pipette to a liquid class (see liquid_classes). Clearances and the blow-out flow rate are pipette
+    settings, only set when they change; aspirate and dispense rates and the delays are applied per transfer.
+    """
+    settings = {
+        'flow_rate.blow_out': liquid['blow_out_flow_rate'],
+        'well_bottom_clearance.aspirate': liquid['aspirate_clearance_mm'],
+        'well_bottom_clearance.dispense': liquid['dispense_clearance_mm'],
+    }
+    for setting, value in settings.items():
+        group, name = setting.split('.')
+        if getattr(getattr(pipette, group), name, DEFAULT_CLEARANCE_MM if group == 'well_bottom_clearance' else None) != value:
+            setattr(getattr(pipette, group), name, value)
+    pipette.liquid = liquid
+
+def liquid_delay(pipette: PlanPipette, field: str):
+    """The pipette's liquid class delay after an aspirate ('aspirate_delay_s') or dispense ('dispense_delay_s')."""
+    if pipette.liquid is not None and pipette.liquid[field] > 0:
+        pipette.delay(pipette.liquid[field])
+
+def liquid_rate(pipette: PlanPipette, field: str) -> float:
+    return 1.0 if pipette.liquid is None else pipette.liquid[field]
 
-validate_parameters(REPLICATES, VISCOUS)
-current_config = PLATE_LAYOUT[REPLICATES]
+def start_phase(protocol: PlanContext, phase: str):
+    """Marks the start of a phase of run() in the command stream."""
+    protocol.comment(f"{PHASE_PREFIX}{phase}")
 
 # helper function for liquid moving 
-def move_liquid(pipette: protocol_api.InstrumentContext, aspiration_vol: int, dispense_vol: int, in_location: protocol_api.labware.Well, out_location: protocol_api.labware.Well, rate:float = 1.0, mix_vol:int = 300, mix_reps:int = 0):
+@traced
+def move_liquid(pipette: PlanPipette, aspiration_vol: int, dispense_vol: int, in_location: PlanWell, out_location: PlanWell, mix_vol:int = 300, mix_reps:int = 0):
     """
-    Helper function for aspirate/dispense with optional mixing and rate control. 
+    Helper function for aspirate/dispense with optional mixing, at the rates and delays of the pipette's liquid class (see use_liquid). 
     """
-    pipette.aspirate(aspiration_vol, in_location, rate=rate)
-    pipette.dispense(dispense_vol, out_location, rate=rate)
+    pipette.aspirate(aspiration_vol, in_location, rate=liquid_rate(pipette, 'aspirate_rate'))
+    liquid_delay(pipette, 'aspirate_delay_s')
+    pipette.dispense(dispense_vol, out_location, rate=liquid_rate(pipette, 'dispense_rate'))
+    liquid_delay(pipette, 'dispense_delay_s')
     if mix_reps > 0:
             # This prevents trying to mix 300ul when you only transferred 30ul.
             volume_to_mix = mix_vol if mix_vol else dispense_vol
-            pipette.mix(mix_reps, volume_to_mix, out_location)
+            pipette.mix(mix_reps, volume_to_mix, out_location, rate=liquid_rate(pipette, 'mix_rate'))
     pipette.blow_out(out_location.top())
 
-def distribute_pbs(pipette: protocol_api.InstrumentContext, reservoir: protocol_api.labware.Labware, source_plate: protocol_api.labware.Labware, protocol: protocol_api.ProtocolContext, aspiration_vol: int, dispense_vol: int, max_well_vol: int, rate:float = 1.0):
-    """Distributes PBS (Diluent) to the Source Plate."""
-    target_cols_indices = list(range(0, 8)) + list(range(9, 11))
+## MULTI-DISPENSE
+DISPOSAL_VOL = 20 # extra volume per multi-dispense aspirate, blown back into the source (p300 minimum volume)
+
+def pack_dispenses(volumes: list, max_vol: float, disposal_vol: float = DISPOSAL_VOL) -> list[list[int]]:
+    """
+    Groups consecutive dispenses into as few aspirates as fit into the pipette, disposal volume included.
+    A dispense too large to share a tip load gets an aspirate of its own, without disposal volume.
+    Returns lists of indices into volumes.
+    """
+    groups = []
+    current = []
+    total = disposal_vol
+    for i, vol in enumerate(volumes):
+        if current and total + vol > max_vol:
+            groups.append(current)
+            current, total = [], disposal_vol
+        current.append(i)
+        total += vol
+    if current:
+        groups.append(current)
+    return groups
+
+def order_for_packing(volumes: list, max_vol: float, disposal_vol: float = DISPOSAL_VOL) -> list[int]:
+    """
+    First-fit decreasing order of dispenses whose order does not matter. pack_dispenses over the volumes 
+    in this order gives the first-fit decreasing packing, which usually needs fewer aspirates.
+    Returns indices into volumes.
+    """
+    bins = [] # [room left, indices]
+    for i in sorted(range(len(volumes)), key=lambda i: -volumes[i]):
+        for b in bins:
+            if volumes[i] <= b[0]:
+                b[0] -= volumes[i]
+                b[1].append(i)
+                break
+        else:
+            bins.append([max_vol - disposal_vol - volumes[i], [i]])
+    return [i for b in bins for i in b[1]]
+
+def split_volume(volume: float, max_vol: float) -> list[float]:
+    """Splits a volume into as few equal parts as fit into the pipette."""
+    parts = math.ceil(volume / max_vol)
+    return [volume / parts] * parts
+
+def aspirate_volume(group_vol: float, max_vol: float, disposal_vol: float = DISPOSAL_VOL) -> float:
+    """Volume aspirated for a group of dispenses: the disposal volume is only added when it fits."""
+    return group_vol + disposal_vol if group_vol + disposal_vol <= max_vol else group_vol
+
+def plan_source_wells(draws: list, usable_vol: float, n_wells: int, drawn: list | None = None) -> list[int]:
+    """
+    Rolls draws over reservoir wells that hold the same liquid. drawn is what was already taken from 
+    each well (see VolumeLedger), if anything.
+    Returns, for every draw, the index of the well it should come from, moving on to the next
+    well before a draw would overrun the current one.
+    """
+    remaining = [usable_vol - (drawn[i] if drawn else 0) for i in range(n_wells)]
+    well_idx = 0
+    plan = []
+    for vol in draws:
+        while well_idx < n_wells and remaining[well_idx] < vol:
+            well_idx += 1
+        if well_idx == n_wells:
+            raise ValueError(f"Reservoir wells run dry: {sum(draws)} uL needed, {usable_vol * n_wells} uL usable in {n_wells} wells.")
+        remaining[well_idx] -= vol
+        plan.append(well_idx)
+    return plan
+
+@traced
+def multi_dispense(pipette: PlanPipette, sources: list, dests: list, volumes: list, disposal_vol: float = DISPOSAL_VOL):
+    """
+    Dispenses into several destinations per aspirate. Every aspirate carries a disposal volume that is 
+    blown back into its source once, after the last dispense of the group. An aspirate with no room for
+    a disposal volume is blown out over its destination instead, like move_liquid does.
+    sources holds one source well per aspirate (see pack_dispenses), or a single well for all of them.
+    Destinations can be Wells or Locations, e.g. well.top() to dispense without touching the contents.
+    Rates (multi_dispense_rate) and delays are those of the pipette's liquid class. The pipette must already have a tip.
+    """
+    groups = pack_dispenses(volumes, pipette.max_volume, disposal_vol)
+    if len(sources) == 1:
+        sources = sources * len(groups)
+    for group, source in zip(groups, sources):
+        group_vol = sum(volumes[i] for i in group)
+        aspirated = aspirate_volume(group_vol, pipette.max_volume, disposal_vol)
+        pipette.aspirate(aspirated, source, rate=liquid_rate(pipette, 'multi_dispense_rate'))
+        liquid_delay(pipette, 'aspirate_delay_s')
+        for i in group:
+            pipette.dispense(volumes[i], dests[i], rate=liquid_rate(pipette, 'multi_dispense_rate'))
+            liquid_delay(pipette, 'dispense_delay_s')
+        if aspirated > group_vol:
+            pipette.blow_out(source.top())
+        else:
+            last = dests[group[-1]]
+            pipette.blow_out(last.top() if hasattr(last, 'top') else last)
+
+@traced
+def distribute_pbs(pipette: PlanPipette, reservoir: PlanLabware, source_plate: PlanLabware, protocol: PlanContext, aspiration_vol: int, dispense_vol: int, max_well_vol: int, multi: bool = False, b_plate: PlanLabware | None = None, a_diluent: dict | None = None, b_cols: tuple = B_SOURCE_COLUMNS[:2], a_levels: int = MAX_A_LEVELS):
+    """
+    Distributes PBS (Diluent) to the Source Plate: the A gradient columns (cols 1 to a_levels) and the B columns (b_cols, one per replicate).
+    With multi, every aspirate is sized to the pipette and dispensed into as many columns as fit.
+    With a b_plate (transposed B mode), its cols 1-8 are filled instead of the B columns of the source plate.
+    a_diluent ({source plate column index: volume}, see plan_direct_dilution) replaces the PBS for the 
+    A gradient columns; those volumes differ per column, so they are always multi-dispensed.
+    """
+    if a_diluent is None:
+        a_diluent = {col_idx: dispense_vol for col_idx in range(a_levels)}
+    else:
+        multi = True
+    target_cols = [(col_idx, vol) for col_idx, vol in a_diluent.items() for vol in split_volume(vol, pipette.max_volume)]
+    if b_plate is None:
+        target_cols += [(col_idx, dispense_vol) for col_idx in b_cols]
+    fills = [([source_plate.columns()[col_idx][0] for col_idx, _ in target_cols], [vol for _, vol in target_cols], [4, 5, 6, 7])] # Reservoir columns available for PBS
+    if b_plate is not None:
+        fills.append(([col[0] for col in b_plate.columns()[:8]], [dispense_vol] * 8, B_PLATE_PBS_RES_COLS))
     
-    # Logic to switch source well if volume runs low
-    res_cols = [4, 5, 6, 7] # Reservoir columns available for PBS
-    current_res_idx = 0
-    current_vol_tracker = 0
+    # each well in the reservoir can only take 2200 microlitres, 
+    # and sometimes less due to inaccurate manual pipetting, so we only count on max_well_vol.
+    # Which well every aspirate comes from is worked out before we start, so we never overrun one.
     pipette.pick_up_tip()   
-    # each well in the reservoir can only take 2200 microlitres. 
-    # and sometimes less due to inaccurate manual pipetting.
-    # so, we had to keep track of the current volume in the well so that 
-    # we would move to the next one to not run out?
-    # edge case: 3 replicates > would we have enough columns?
-
-    for col_idx in target_cols_indices:
-        dest = source_plate.columns()[col_idx][0]
-        source_well = reservoir.columns()[res_cols[current_res_idx]][0]
-        
-        # Switch reservoir well if we exceed limit
-        if current_vol_tracker > max_well_vol:
-            current_res_idx += 1
-            current_vol_tracker = 0
-            source_well = reservoir.columns()[res_cols[current_res_idx]][0]
-        move_liquid(pipette, aspiration_vol, dispense_vol,source_well, dest, rate=rate)
-        current_vol_tracker += dispense_vol
+    for dests, volumes, res_cols in fills:
+        if multi:
+            order = order_for_packing(volumes, pipette.max_volume)
+            dests, volumes = [dests[i] for i in order], [volumes[i] for i in order]
+            groups = pack_dispenses(volumes, pipette.max_volume)
+            draws = [aspirate_volume(sum(volumes[i] for i in group), pipette.max_volume) for group in groups]
+        else:
+            draws = [aspiration_vol] * len(dests)
+        # supplied wells hold minus what was drawn from them so far
+        well_plan = plan_source_wells(draws, max_well_vol, len(res_cols), [-reservoir.columns()[col][0].current_volume() for col in res_cols])
+        sources = [reservoir.columns()[res_cols[well_idx]][0] for well_idx in well_plan]
+
+        if multi:
+            multi_dispense(pipette, sources, dests, volumes)
+        else:
+            for source_well, dest in zip(sources, dests):
+                move_liquid(pipette, aspiration_vol, dispense_vol, source_well, dest)
         
     pipette.drop_tip()
     protocol.comment('INFO: PBS distribution complete')
 
-def perform_serial_dilution(pipette: protocol_api.InstrumentContext, wells: list[protocol_api.labware.Well], rate:float = 1.0, mix_reps: int = 3, mix_vol: int = 0):
+@traced
+def perform_serial_dilution(pipette: PlanPipette, wells: list[PlanWell], mix_reps: int = 3, mix_vol: int = 0):
     """
     Performs serial dilution across a list of opentron Well objects.
     Moves from wells[0] -> wells[1], then wells[1] -> wells[2], etc...
@@ -122,40 +1515,627 @@ def perform_serial_dilution(pipette: protocol_api.InstrumentContext, wells: list
         source = wells[i]
         dest = wells[i+1]
         
-        move_liquid(pipette, FLOW_VOL['asp_vol'], FLOW_VOL['disp_vol'], source, dest, rate=rate, mix_reps=mix_reps, mix_vol=mix_vol)
+        move_liquid(pipette, FLOW_VOL['asp_vol'], FLOW_VOL['disp_vol'], source, dest, mix_reps=mix_reps, mix_vol=mix_vol)
+
+@traced
+def dilute_across_columns(pipette: PlanPipette, stock: PlanWell, plate: PlanLabware, mix_vol: int = 0, levels: int = MAX_A_LEVELS):
+    """
+    Multichannel serial dilution of a stock along cols levels -> 1 of a plate (8 -> 1 by default), with one tip.
+    Col levels gets the stock, and the excess drawn from col 1 is discarded with the tip.
+    """
+    pipette.pick_up_tip()
+    move_liquid(pipette, FLOW_VOL['asp_vol'], FLOW_VOL['disp_vol'], stock, plate.columns()[levels - 1][0], mix_reps=3, mix_vol=mix_vol)
+    # Dilute backwards from the last column down to 1
+    # We grab the top well of each column for the multi-channel
+    dilution_path = [plate.columns()[i][0] for i in range(levels - 1, -1, -1)]
+    perform_serial_dilution(pipette, dilution_path, mix_reps=3, mix_vol=mix_vol)
+    # Discard what col 1 holds beyond the volume every gradient well is left with
+    last = plate.columns()[0][0]
+    pipette.aspirate(last.current_volume() - FLOW_VOL['disp_vol'], last)
+    pipette.drop_tip()
+
+@traced
+def place_gradient_b_transposed(pipette: PlanPipette, b_plate: PlanLabware, dests: list, rows: list):
+    """
+    Transposes the column-wise B gradient onto destination regions (see PLATE LAYOUT): the B level in col r+1 of
+    the B plate goes to row r of each region's A level columns, one multi-dispense per level and region.
+    Each region draws from its own row of the B plate (rows), so one B plate serves up to 8 plates (see plate_offset).
+    The tip only ever dispenses from the top and goes from low to high concentration, level by level across the
+    regions, so one tip does them all.
+    """
+    pipette.pick_up_tip()
+    for level in range(B_PLATE_ROWS):
+        for dest, row in zip(dests, rows):
+            wells = [dest.columns()[col][level].top() for col in range(MATRIX_START, len(dest.columns()))]
+            multi_dispense(pipette, [b_plate.columns()[level][row]], wells, [30] * len(wells))
+    pipette.drop_tip()
+
+## MIXED-PIPETTE SCHEDULING
+# Which pipette makes a transfer follows from its wells: whole columns go to the multichannel, the row-wise B
+# gradients (their dilution, or their placement in transposed B mode) to the single-channel. Both pipettes ride
+# one gantry, so they never work at the same time; what the single-channel costs is its tips and the pickups,
+# drops and trips that go with them. With 'mixed_pipettes', the single-channel gets a tip rack of its own (see
+# tip_usage), so the multichannel racks only ever lose whole columns, and its rack is used up tip by tip across
+# runs ('single_tip_start', carried over by campaign.py). Its work for all replicates is batched onto one tip,
+# level by level across the replicates: between replicates, the tip only carries a concentration into wells of
+# the same or a higher one, as tip economy mode allows (see _compatible).
+
+@traced
+def dilute_down_columns(pipette: PlanPipette, stock: PlanWell, columns: list, mix_vol: int = 300):
+    """
+    Single-channel serial dilution of a stock down rows H -> A of several columns with one tip, level by level
+    across the columns (see MIXED-PIPETTE SCHEDULING). Each row A is left holding disp_vol: the excess of every
+    column but the last is blown out into the trash, the last one's is discarded with the tip.
+    """
+    pipette.pick_up_tip()
+    # the stock goes in from the top, so the tip goes back into it clean, and is mixed in once all rows H have it
+    for col in columns:
+        pipette.aspirate(FLOW_VOL['asp_vol'], stock, rate=liquid_rate(pipette, 'aspirate_rate'))
+        liquid_delay(pipette, 'aspirate_delay_s')
+        pipette.dispense(FLOW_VOL['disp_vol'], col[7].top(), rate=liquid_rate(pipette, 'dispense_rate'))
+        liquid_delay(pipette, 'dispense_delay_s')
+        pipette.blow_out(col[7].top())
+    for col in columns:
+        pipette.mix(3, mix_vol, col[7], rate=liquid_rate(pipette, 'mix_rate'))
+    for row in range(7, 0, -1):
+        for col in columns:
+            move_liquid(pipette, FLOW_VOL['asp_vol'], FLOW_VOL['disp_vol'], col[row], col[row - 1], mix_reps=3, mix_vol=mix_vol)
+    for i, col in enumerate(columns):
+        pipette.aspirate(col[0].current_volume() - FLOW_VOL['disp_vol'], col[0])
+        if i < len(columns) - 1:
+            pipette.blow_out(TRASH)
+    pipette.drop_tip()
+
+## DIRECT DILUTION PLANNER
+# Instead of the fixed 2-fold serial dilution, the A gradient can be made at the concentrations requested 
+# in the GUI. config_gui.py writes a stock and diluent volume for every target ('wells'); only their ratio is
+# used, scaled to the volume a source plate column needs. A target whose stock volume would be below what the
+# pipette can measure accurately is made from a more concentrated gradient well instead, or from an 
+# intermediate stock in a spare column.
+STOCK = 'stock'
+# a planned well: where its stock comes from (STOCK, a column index or None for blanks), how much, and how 
+# many sources deep it is (wells of one generation are made together, once the previous one is mixed)
+DirectWell = namedtuple('DirectWell', ['col', 'fraction', 'source', 'draw', 'diluent', 'generation'])
+DIRECT_WELL_MAX_VOL = FLOW_VOL['asp_vol'] + FLOW_VOL['disp_vol'] # as much as a serial dilution well holds
+INTERMEDIATE_HEADROOM = 2 # intermediates are made so the wells they feed draw this many times the minimum volume
+
+def stock_fractions(wells: list) -> list[float]:
+    """Fraction of stock in every well, from the stock and diluent volumes written by config_gui.py."""
+    fractions = []
+    for well in wells:
+        stock, diluent = well['stock_vol_uL'], well['diluent_vol_uL']
+        if stock < 0 or diluent < 0 or stock + diluent <= 0:
+            raise ValueError(f"Target {well['final_conc_uM']} uM cannot be made from {stock} uL stock and {diluent} uL diluent. It may need more stock than the total volume.")
+        fractions.append(stock / (stock + diluent))
+    return fractions
+
+def plan_direct_dilution(wells: list, well_vol: float, min_vol: float, spare_cols: list, max_well_vol: float = DIRECT_WELL_MAX_VOL, levels: int = MAX_A_LEVELS) -> list[DirectWell]:
+    """
+    Plans the A gradient, one target per source plate column (cols 1 to levels), each left holding well_vol.
+    Every well takes its stock straight from the reservoir when that draw is at least min_vol, otherwise from
+    the most concentrated well that gives an accurate draw. Intermediate stocks go into spare_cols.
+    """
+    if len(wells) != levels:
+        raise ValueError(f"Direct dilution needs {levels} targets, one per gradient column. Got: {len(wells)}")
+    fraction = dict(enumerate(stock_fractions(wells)))
+    spare = list(spare_cols)
+    source_of = {}
+
+    def assign(col, target):
+        f = fraction[col]
+        if f == 0:
+            source_of[col] = None
+            return
+        candidates = [(1.0, STOCK)] + sorted(((fraction[c], c) for c in source_of if fraction[c] > f), reverse=True)
+        for source_f, source in candidates:
+            if well_vol * f / source_f >= min_vol:
+                source_of[col] = source
+                return
+        if not spare:
+            raise ValueError(f"Target {target} uM needs more intermediate stocks than there are spare columns ({len(spare_cols)}).")
+        intermediate = spare.pop(0)
+        # aim for INTERMEDIATE_HEADROOM times the minimum draw, but stay concentrated enough to be made 
+        # straight from the stock if the draw from this well allows it
+        fraction[intermediate] = min(f * well_vol / min_vol, max(f * well_vol / (INTERMEDIATE_HEADROOM * min_vol), min_vol / well_vol))
+        assign(intermediate, target)
+        source_of[col] = intermediate
+
+    for col in sorted(range(levels), key=lambda c: -fraction[c]):
+        assign(col, wells[col]['final_conc_uM'])
+
+    # wells feeding others hold well_vol plus what is drawn from them; dependents are always less concentrated
+    draw, total = {}, {}
+    for col in sorted(source_of, key=lambda c: fraction[c]):
+        total[col] = well_vol + sum(draw[c] for c in source_of if source_of[c] == col)
+        if total[col] > max_well_vol:
+            raise ValueError(f"Source plate column {col + 1} would need {total[col]:.1f} uL, more than {max_well_vol} uL.")
+        source = source_of[col]
+        draw[col] = 0.0 if source is None else total[col] * fraction[col] / (1.0 if source == STOCK else fraction[source])
+    generation = {}
+    for col in sorted(source_of, key=lambda c: -fraction[c]):
+        source = source_of[col]
+        generation[col] = None if source is None else 0 if source == STOCK else generation[source] + 1
+    return [DirectWell(col, fraction[col], source_of[col], round(draw[col], 2), round(total[col] - draw[col], 2), generation[col]) for col in sorted(source_of)]
+
+def direct_schedule(config: dict, transposed_b: bool = False) -> list | None:
+    """The planned A gradient for a config in direct dilution mode, or None for the serial dilution."""
+    if not config.get("direct_dilution", False):
+        return None
+    if not config.get("wells"):
+        raise ValueError("Direct dilution needs the per-well volumes ('wells') written by config_gui.py.")
+    # the source plate columns after the A gradient up to column 9 are always free; transposed B mode also frees the B columns
+    levels = config.get("a_levels", MAX_A_LEVELS)
+    spare_cols = list(range(levels, B_SOURCE_COLUMNS[0])) + (list(B_SOURCE_COLUMNS) if transposed_b else [])
+    return plan_direct_dilution(config["wells"], FLOW_VOL['disp_vol'], PIPETTE_VOLUMES['p300_multi_gen2'][1], spare_cols, levels=levels)
+
+def a_gradient_ranks(schedule: list | None) -> dict | None:
+    """
+    Concentration rank of every planned column, the A gradient's level for the tip economy planner (see
+    source_pool). None for the serial dilution, whose columns already rise with their index.
+    """
+    if schedule is None:
+        return None
+    fractions = sorted({well.fraction for well in schedule})
+    return {well.col: fractions.index(well.fraction) for well in schedule}
+
+def dilution_tips(schedule: list | None) -> int:
+    """Multichannel tips the A gradient takes: one per source and one to mix each generation, or one for the serial dilution."""
+    if schedule is None:
+        return 1
+    made = [well for well in schedule if well.source is not None]
+    return len({(well.generation, well.source) for well in made}) + len({well.generation for well in made})
+
+@traced
+def dilute_direct(pipette: PlanPipette, stock: PlanWell, plate: PlanLabware, schedule: list):
+    """
+    Makes a planned A gradient on a plate that already holds the diluent. Each source is dispensed into the 
+    wells it feeds from the top with one tip, then each generation is mixed with one tip, from low to high concentration.
+    """
+    made = [well for well in schedule if well.source is not None]
+    for generation in sorted({well.generation for well in made}):
+        wells = [well for well in made if well.generation == generation]
+        for source in dict.fromkeys(well.source for well in wells):
+            dests, volumes = [], []
+            for well in wells:
+                if well.source == source:
+                    for vol in split_volume(well.draw, pipette.max_volume):
+                        dests.append(plate.columns()[well.col][0].top())
+                        volumes.append(vol)
+            order = order_for_packing(volumes, pipette.max_volume)
+            pipette.pick_up_tip()
+            multi_dispense(pipette, [stock if source == STOCK else plate.columns()[source][0]], [dests[i] for i in order], [volumes[i] for i in order])
+            pipette.drop_tip()
+        pipette.pick_up_tip()
+        for well in sorted(wells, key=lambda w: w.fraction):
+            # like the serial dilution, mix half of what the well holds
+            target = plate.columns()[well.col][0]
+            pipette.mix(3, min(FLOW_VOL['mix_vol'], (well.draw + well.diluent) / 2), target, rate=liquid_rate(pipette, 'mix_rate'))
+            pipette.blow_out(target.top())
+        pipette.drop_tip()
+
+## TIP ECONOMY PLANNER
+# The destination phase can be planned as a list of PlanSteps addressed by (labware, column),
+# so that tips can be counted and assigned before any labware is loaded.
+# Every pool of liquid is described by its contents {liquid: level}, a higher level meaning a
+# higher concentration. A tip can be reused as long as every pool it touches already contains
+# at least as much of whatever the tip has picked up, i.e. we only ever go from low to high.
+PlanStep = namedtuple('PlanStep', ['source', 'dest', 'volume', 'mix_reps', 'mix_vol'])
+# a PlanStep with its phase, the tip it should use and whether the dispense may touch the well contents
+PlannedStep = namedtuple('PlannedStep', ['source', 'dest', 'volume', 'mix_reps', 'mix_vol', 'phase', 'tip', 'contact'])
+
+RESERVOIR_POOLS = {
+    ('reservoir', 1): {'a': 8}, # inducer A stock (A2)
+    ('reservoir', 2): {'b': 8}, # inducer B stock (A3)
+    ('reservoir', 3): {'cells': 1}, # cells (A4)
+    ('reservoir', 10): {'cells': 1}, # more cells (A11 & A12), see cells_columns
+    ('reservoir', 11): {'cells': 1},
+    ('reservoir', 7): {'pbs': 0}, # PBS for the blanks (A8), the last of the columns distribute_pbs draws from
+}
+# Each channel of the multichannel only ever sees its own row of the B gradient, and every B
+# gradient well in a row has the same concentration, so the whole gradient counts as one level.
+B_GRADIENT_LEVEL = 0
+MULTI_TIPS_SOURCE_PHASE = 2 # PBS distribution and inducer A dilution
+
+def source_pool(source: tuple, a_ranks: dict | None = None) -> dict:
+    """
+    Contents of a source well, by (labware, column). The A gradient's level is its column, or its rank in
+    a_ranks when the columns hold targets in any order (direct dilution, see a_gradient_ranks).
+    """
+    labware, col = source
+    if labware == 'reservoir':
+        return RESERVOIR_POOLS[source]
+    if labware == 'b_plate':
+        # transposed B mode: a row of the B plate, by replicate
+        return {'b': B_GRADIENT_LEVEL}
+    # source plate: columns 1-8 hold the A gradient, 10-12 the B gradients
+    if col >= 8:
+        return {'b': B_GRADIENT_LEVEL}
+    return {'a': col if a_ranks is None else a_ranks[col]}
+
+def _compatible(residue: dict, pool: dict) -> bool:
+    # PBS is the diluent of everything, so it never contaminates
+    return all(liquid == 'pbs' or (liquid in pool and level <= pool[liquid]) for liquid, level in residue.items())
+
+def _merge(a: dict, b: dict) -> dict:
+    merged = dict(a)
+    for liquid, level in b.items():
+        merged[liquid] = max(level, merged.get(liquid, level))
+    return merged
+
+def _touched(step: PlanStep, contents: dict, a_ranks: dict | None = None) -> list:
+    """Pools a step's tip touches: its source, and the destination if it mixes there."""
+    pools = []
+    after = contents.get(step.dest, {})
+    if step.source is not None:
+        pools.append(source_pool(step.source, a_ranks))
+        after = _merge(after, pools[0])
+    if step.mix_reps:
+        pools.append(after)
+    return pools
+
+def order_for_tip_reuse(stage: list, contents: dict, residue: dict | None = None, a_ranks: dict | None = None) -> list:
+    """
+    Greedily orders a stage of commuting steps (one per destination well) so consecutive steps can share a tip.
+    Each tip starts with the cleanest remaining step, then takes compatible steps from low to high concentration.
+    residue is what the tip in hand has picked up so far, if any.
+    """
+    def level(step):
+        return sum(sum(pool.values()) + len(pool) for pool in _touched(step, contents, a_ranks))
+    remaining = sorted(stage, key=level)
+    ordered = []
+    while remaining:
+        step = None
+        if residue is not None:
+            step = next((s for s in remaining if all(_compatible(residue, pool) for pool in _touched(s, contents, a_ranks))), None)
+        if step is None:
+            step, residue = remaining[0], {}
+        remaining.remove(step)
+        for pool in _touched(step, contents, a_ranks):
+            residue = _merge(residue, pool)
+        ordered.append(step)
+    return ordered
+
+def plan_tips(stages: list, a_ranks: dict | None = None) -> list:
+    """
+    Orders each (phase, steps) stage for tip reuse and assigns a tip to every step.
+    Dispenses only touch the well contents when the well is still empty, otherwise they are made from the top.
+    a_ranks ranks the A gradient columns by concentration (see a_gradient_ranks), if not by their index.
+    """
+    contents = {}
+    residue = None
+    tip = -1
+    planned = []
+    for phase, stage in stages:
+        for step in order_for_tip_reuse(stage, contents, residue, a_ranks):
+            pools = _touched(step, contents, a_ranks)
+            if residue is None or not all(_compatible(residue, pool) for pool in pools):
+                tip += 1
+                residue = {}
+            for pool in pools:
+                residue = _merge(residue, pool)
+            contact = step.dest not in contents
+            if step.source is not None:
+                contents[step.dest] = _merge(contents.get(step.dest, {}), source_pool(step.source, a_ranks))
+            planned.append(PlannedStep(*step, phase, tip, contact))
+    return planned
+
+def plan_destination(replicates: int, a_levels: int = MAX_A_LEVELS, transposed_b: bool = False) -> list:
+    """
+    (phase, steps) stages of the destination phase in tip economy mode. Everything is dispensed first 
+    without touching the wells, then each well is mixed once, so only the mixing has to change tips.
+    Destinations are (replicate region index, column index), see PLATE LAYOUT. With transposed_b, the B gradient
+    comes from the B plate rows, placed by the single-channel (see split_b_gradient).
+    """
+    plates = range(replicates)
+    gradient_cols = range(MATRIX_START, MATRIX_START + a_levels)
+    width = MATRIX_START + a_levels
+    blank, a, b, ab = (CONTROL_COLUMNS[name] for name in ('blank', 'a', 'b', 'ab'))
+    cells = cells_columns(replicates, width)
+    return [
+        # controls: PBS to col 1, inducer A to cols 2 & 4, inducer B to cols 3 & 4
+        ('controls', [PlanStep(('reservoir', 7), (p, blank), 30, 0, 0) for p in plates]),
+        ('controls', [PlanStep(('reservoir', 2), (p, c), 30, 0, 0) for p in plates for c in (b, ab)]),
+        ('controls', [PlanStep(('reservoir', 1), (p, c), 30, 0, 0) for p in plates for c in (a, ab)]),
+        # B gradient (source plate col 10 + replicate index) to cols 5-12
+        ('gradient', [PlanStep(('b_plate', p) if transposed_b else ('source_plate', B_SOURCE_COLUMNS[p]), (p, c), 30, 0, 0) for p in plates for c in gradient_cols]),
+        # A gradient, source plate cols 1-8 to cols 5-12
+        ('gradient', [PlanStep(('source_plate', c - MATRIX_START), (p, c), 30, 0, 0) for c in gradient_cols for p in plates]),
+        ('cells', [PlanStep(('reservoir', cells[p]), (p, c), FLOW_VOL['cell_transfer_high'] if c < ab else FLOW_VOL['cell_transfer_low'], 0, 0) for p in plates for c in range(width)]),
+        # mix every well once everything is in
+        ('cells', [PlanStep(None, (p, c), 0, 3, 50) for p in plates for c in range(width)]),
+    ]
+
+def split_b_gradient(planned: list) -> tuple[list, list]:
+    """
+    Splits a planned destination phase into the steps before and after its B gradient stage, which 
+    transposed B mode places with the single-channel instead (see place_gradient_b_transposed).
+    """
+    b_steps = [i for i, step in enumerate(planned) if step.source is not None and (step.source[0] == 'b_plate' or (step.source[0] == 'source_plate' and step.source[1] in B_SOURCE_COLUMNS))]
+    return planned[:b_steps[0]], planned[b_steps[-1] + 1:]
+
+def planned_tip_count(planned: list, transposed_b: bool = False) -> int:
+    """Multichannel tips used by apply_tip_plan. Splitting around the B stage starts a fresh tip after it."""
+    if transposed_b:
+        return sum(len({step.tip for step in part}) for part in split_b_gradient(planned))
+    return planned[-1].tip + 1
+
+def tip_usage(layout: Layout, tip_economy: bool, transposed_b: bool = False, source_phase_tips: int = MULTI_TIPS_SOURCE_PHASE, tip_start_column: int = 1, mixed_pipettes: bool = False, a_ranks: dict | None = None) -> dict:
+    """
+    Tips and tip racks needed per run. Multichannel pickups use a full column of a rack, while the 
+    single-channel pickups (inducer B dilution, or B placement in transposed mode) share one partially used column.
+    source_phase_tips is what the source plate phases take (see source_tips), and the first rack may be partly 
+    used already, starting at tip_start_column. The layout (see plate_layout) gives the replicates and their width.
+    With mixed_pipettes (see MIXED-PIPETTE SCHEDULING), the single-channel takes one tip from a rack of its own
+    instead, in the slot after the multichannel racks ('single_slot'). a_ranks is passed on to plan_tips.
+    """
+    replicates = len(layout.regions)
+    layout_slots = layout.tip_slots
+    if tip_economy:
+        planned = plan_tips(plan_destination(replicates, layout.a_levels, transposed_b), a_ranks)
+        multi_tips = source_phase_tips + planned_tip_count(planned, transposed_b)
+    else:
+        # 3 control + 2 gradient + one cell pickup per column of each replicate (the B gradient pickup moves to the single-channel when transposed)
+        multi_tips = source_phase_tips + (layout.width + (4 if transposed_b else 5)) * replicates
+    single_tips = 1 if mixed_pipettes else replicates
+    tip_columns = multi_tips + (0 if mixed_pipettes else math.ceil(replicates / 8))
+    racks = math.ceil((tip_columns + tip_start_column - 1) / 12)
+    # racks go into the layout's tip slots first (the default modes always fit), then into free slots
+    slots = layout_slots + free_deck_slots(layout, transposed_b)
+    tip_slots = slots[:racks]
+    if racks > len(tip_slots):
+        raise ValueError(f"This run needs {racks} tip racks, but only {len(tip_slots)} fit on the deck.")
+    single_slot = None
+    if mixed_pipettes:
+        if racks == len(slots):
+            raise ValueError(f"This run needs {racks} tip racks and one for the single-channel, but only {len(slots)} fit on the deck.")
+        single_slot = slots[racks]
+    return {
+        'multi_tips': multi_tips,
+        'single_tips': single_tips,
+        'tip_columns': tip_columns,
+        'tip_slots': tip_slots,
+        'single_slot': single_slot,
+        'free_slots': [slot for slot in layout_slots if slot not in tip_slots and slot != single_slot],
+    }
+
+def source_tips(a_schedule: list | None, transposed_b: bool = False, reuse_source: bool = False) -> int:
+    """Multichannel tips of the source plate phases: PBS, both dilutions (see dilution_tips), or none when the source plates are reused."""
+    if reuse_source:
+        return 0
+    # transposed B mode dilutes B with one more multichannel tip, and places it with one single-channel tip per plate
+    return MULTI_TIPS_SOURCE_PHASE + (dilution_tips(a_schedule) - 1) + (1 if transposed_b else 0)
+
+def config_tip_usage(config: dict) -> dict:
+    """tip_usage() for a config."""
+    transposed_b = config.get("transposed_b", False)
+    a_schedule = direct_schedule(config, transposed_b)
+    tips = source_tips(a_schedule, transposed_b, config.get("reuse_source", False))
+    return tip_usage(plate_layout(config), config.get("tip_economy", False), transposed_b, tips, config.get("tip_start_column", 1), config.get("mixed_pipettes", False), a_gradient_ranks(a_schedule))
+
+def free_deck_slots(layout: Layout, transposed_b: bool = False) -> list[int]:
+    """Deck slots the layout leaves empty (slot 12 is the trash)."""
+    used = set(layout.plate_slots) | set(layout.tip_slots) | {5, 6} | ({B_PLATE_SLOT} if transposed_b else set())
+    return [slot for slot in range(1, 12) if slot not in used]
+
+def apply_tip_plan(protocol: PlanContext, pipette: PlanPipette, planned: list, labware: dict, dest_plates: list, liquids: dict | None = None):
+    """
+    Runs a planned destination phase. Consecutive dispenses from the same source on the same tip
+    are made with multi_dispense, in the liquid class of the source (liquids, see liquid_classes), if given.
+    """
+    def well(address):
+        name, col = address
+        plate = dest_plates[name] if isinstance(name, int) else labware[name]
+        return plate.columns()[col][0]
+
+    current_tip = None
+    phase = None
+    i = 0
+    while i < len(planned):
+        step = planned[i]
+        if step.phase != phase:
+            start_phase(protocol, step.phase)
+            phase = step.phase
+        if step.tip != current_tip:
+            if current_tip is not None:
+                pipette.drop_tip()
+            pipette.pick_up_tip()
+            current_tip = step.tip
+        if liquids is not None:
+            use_liquid(pipette, liquids[POOL_LIQUIDS[next(iter(source_pool(step.source)))] if step.source is not None else 'cells'])
+        if step.source is None:
+            pipette.mix(step.mix_reps, step.mix_vol, well(step.dest), rate=liquid_rate(pipette, 'mix_rate'))
+            pipette.blow_out(well(step.dest).top())
+            i += 1
+            continue
+        # group the run of plain dispenses that share this source and tip
+        group = [step]
+        while i + len(group) < len(planned):
+            nxt = planned[i + len(group)]
+            if nxt.tip != step.tip or nxt.source != step.source or nxt.mix_reps or nxt.phase != step.phase:
+                break
+            group.append(nxt)
+        dests = [well(s.dest) if s.contact else well(s.dest).top() for s in group]
+        multi_dispense(pipette, [well(step.source)], dests, [s.volume for s in group])
+        i += len(group)
+    if current_tip is not None:
+        pipette.drop_tip()
+
+def fill_controls_multi(p300_multi: PlanPipette, sources: dict, dest_plates: list, liquids: dict | None = None):
+    """
+    Fills the control columns of every destination region with one multi-dispense and one tip per reagent,
+    in the reagent's liquid class (liquids, see liquid_classes), if given.
+    Wells that already hold a reagent are dispensed into from the top, so the tip stays clean.
+    """
+    col = lambda idx: [plate.columns()[idx][0] for plate in dest_plates]
+    fills = [
+        ('pbs', col(CONTROL_COLUMNS['blank'])), # PBS to Col 1
+        ('a', col(CONTROL_COLUMNS['a']) + col(CONTROL_COLUMNS['ab'])), # Inducer A to Col 2 & 4
+        ('b', col(CONTROL_COLUMNS['b']) + [well.top() for well in col(CONTROL_COLUMNS['ab'])]), # Inducer B to Col 3 & 4
+    ]
+    for pool, dests in fills:
+        if liquids is not None:
+            use_liquid(p300_multi, liquids[POOL_LIQUIDS[pool]])
+        p300_multi.pick_up_tip()
+        multi_dispense(p300_multi, [sources[pool]], dests, [30] * len(dests))
+        p300_multi.drop_tip()
+
+def fill_destination_plates(protocol: PlanContext, p300_multi: PlanPipette, reservoir: PlanLabware, source_plate: PlanLabware, dest_plates: list, liquids: dict, multi: bool = False, p300_single: PlanPipette | None = None, b_plate: PlanLabware | None = None, plate_offset: int = 0, mixed_pipettes: bool = False):
+    """
+    Adds controls, both gradients and cells to the destination regions (see PLATE LAYOUT), one tip per transfer
+    group, each in the liquid class of its source (liquids, see liquid_classes). A region's columns after the
+    controls take the A levels. With multi, the control columns of all regions are filled by multi-dispense.
+    With a b_plate (transposed B mode), the B gradient is placed from it by p300_single, 
+    plate i drawing from B plate row plate_offset + i. With mixed_pipettes, it is placed on every plate with one
+    tip (see MIXED-PIPETTE SCHEDULING) once their A gradients are in, and the cells follow.
+    """
+    res_pbs_source = reservoir.columns()[7][0]
+    res_A_source = reservoir.wells_by_name()['A2']
+    res_B_source = reservoir.wells_by_name()['A3']
+    # cells come from reservoir col 4, and from cols 11 & 12 once it is full
+    res_cell_sources = [reservoir.columns()[col][0] for col in cells_columns(len(dest_plates), len(dest_plates[0].columns()))]
+
+    def add_cells(i, dest):
+        start_phase(protocol, 'cells')
+        use_liquid(p300_multi, liquids['cells'])
+        # Group wells by volume
+        cols = dest.columns()
+        wells_70 = [cols[k][0] for k in range(CONTROL_COLUMNS['ab'])] # A1, A2, A3
+        wells_40 = [cols[k][0] for k in range(CONTROL_COLUMNS['ab'], len(cols))] # A4 + A5-A12
+        
+        for w in wells_70:
+            p300_multi.pick_up_tip()
+            move_liquid(p300_multi, 70, 70, res_cell_sources[i], w, mix_vol=50, mix_reps=3)
+            p300_multi.drop_tip()
+        for w in wells_40:
+            p300_multi.pick_up_tip()
+            move_liquid(p300_multi, 40, 40, res_cell_sources[i], w, mix_vol=50, mix_reps=3)
+            p300_multi.drop_tip()
+        protocol.comment(f"INFO: Substrate/Cells added to plate {i} cols 1–{len(cols)}")        
+
+    ## 1. Distribute Reagents (PBS, A, B) to Dest Plates
+    # add controls and blanks to the destination plate (replicate)
+    start_phase(protocol, 'controls')
+    if multi:
+        fill_controls_multi(p300_multi, {'pbs': res_pbs_source, 'a': res_A_source, 'b': res_B_source}, dest_plates, liquids)
+    else:
+        for dest_plate in dest_plates:
+            cols = dest_plate.columns()
+            
+            # Distribute PBS to Col 1
+            use_liquid(p300_multi, liquids['pbs'])
+            p300_multi.distribute(30, res_pbs_source, cols[CONTROL_COLUMNS['blank']], new_tip='once') 
+            
+            # Distribute Inducer A to Col 2 & 4
+            use_liquid(p300_multi, liquids['inducer_a'])
+            p300_multi.distribute(30, res_A_source, [cols[CONTROL_COLUMNS['a']], cols[CONTROL_COLUMNS['ab']]], new_tip='once')
+            
+            # Distribute Inducer B to Col 3 & 4
+            use_liquid(p300_multi, liquids['inducer_b'])
+            p300_multi.distribute(30, res_B_source, [cols[CONTROL_COLUMNS['b']], cols[CONTROL_COLUMNS['ab']]], new_tip='once')
+
+    # gradients from step A are transferred to the destination plates
+    ## 2. Transfer Gradient A & B and Cells
+    for i, dest in enumerate(dest_plates):
+        start_phase(protocol, 'gradient')
+        protocol.comment(f"INFO: Transferring Gradient for Plate {i+1}")
+        levels = len(dest.columns()) - MATRIX_START
+        
+        use_liquid(p300_multi, liquids['inducer_a'])
+        p300_multi.pick_up_tip()
+        # Transfer Gradient A (Col 8-1 -> Col 12-5)
+        for level in reversed(range(levels)):
+            source_well = source_plate.columns()[level][0]
+            dest_well = dest.columns()[MATRIX_START + level][0]
+            move_liquid(p300_multi, 30, 30, source_well, dest_well, mix_vol=10, mix_reps=1)            
+        p300_multi.drop_tip()
+        
+        if b_plate is not None:
+            if mixed_pipettes:
+                # placed on every plate at once, below
+                continue
+            # Transfer B (B plate row plate_offset + i, Cols 1-8 -> Dest Rows A-H)
+            use_liquid(p300_single, liquids['inducer_b'])
+            place_gradient_b_transposed(p300_single, b_plate, [dest], [plate_offset + i])
+        else:
+            # Transfer B (Specific Source Cols -> Dest Cols 12-5)
+            b_source_idx = B_SOURCE_COLUMNS[i]
+            b_source_well = source_plate.columns()[b_source_idx][0]
+            
+            # Target: Columns 12 down to 5 (Indices 11 to 4)
+            targets_B = [dest.columns()[MATRIX_START + level][0] for level in reversed(range(levels))]
+            
+            use_liquid(p300_multi, liquids['inducer_b'])
+            p300_multi.distribute(30, b_source_well, targets_B, new_tip='always') 
+
+        # Add Cells
+        add_cells(i, dest)
+
+    if b_plate is not None and mixed_pipettes:
+        # Transfer B (B plate rows plate_offset + i, Cols 1-8 -> Dest Rows A-H) to every plate, then the cells
+        use_liquid(p300_single, liquids['inducer_b'])
+        place_gradient_b_transposed(p300_single, b_plate, dest_plates, [plate_offset + i for i in range(len(dest_plates))])
+        for i, dest in enumerate(dest_plates):
+            add_cells(i, dest)
+
+def build_protocol(protocol: PlanContext, config: dict):
+    """The protocol logic, run against a PlanContext by compile_plan()."""
+    REPLICATES = config.get("replicates")
+    TIP_ECONOMY = config.get("tip_economy", False)
+    MULTI_DISPENSE = config.get("multi_dispense", False)
+    TRANSPOSED_B = config.get("transposed_b", False)
+    # campaign runs (see campaign.py) can reuse the source plates of an earlier run, and a part-used tip rack
+    REUSE_SOURCE = config.get("reuse_source", False)
+    PLATE_OFFSET = config.get("plate_offset", 0)
+    TIP_START_COLUMN = config.get("tip_start_column", 1)
+    # the single-channel's transfers are batched, from a tip rack of its own (see MIXED-PIPETTE SCHEDULING)
+    MIXED = config.get("mixed_pipettes", False)
+    SINGLE_TIP_START = config.get("single_tip_start", "A1")
+    validate_parameters(config)
+    FLOW_RATES = get_flow_rates(config)
+    # how each source is pipetted; viscous_check only picks the inducers' default class
+    LIQUIDS = liquid_classes(config)
+    # where the replicates go on the destination plates
+    layout = plate_layout(config)
+    # the A gradient at the GUI's concentrations, planned before anything is loaded
+    a_schedule = direct_schedule(config, TRANSPOSED_B)
+    # tip economy mode needs fewer racks; the slots it frees take further destination plates (see EXTRA_PLATE_SLOTS), or stay empty
+    usage = config_tip_usage(config)
+    tip_slots = usage['tip_slots']
 
-def run(protocol: protocol_api.ProtocolContext):
     ### A. Setup Dilutions
     ## 1. Define Labware Setup
     # Define tip box position and destination plate position 
-    dest_plates = [protocol.load_labware(LABWARE['plate'], slot) for slot in current_config['plate_slots']]
-    tips_300 = [protocol.load_labware(LABWARE['tips'], slot) for slot in current_config['tip_slots']]
+    plate_format = PLATE_FORMATS[layout.plate_format]
+    plates = [protocol.load_labware(plate_format['load_name'], slot, label=plate_format['label']) for slot in layout.plate_slots]
+    # every replicate is addressed through its region, as a plate of its own
+    dest_plates = [PlanRegion(plates[region.plate], region, layout.width) for region in layout.regions]
+    tips_300 = [protocol.load_labware(LABWARE['tips'], slot, label='tips') for slot in tip_slots]
+    single_tips = [protocol.load_labware(LABWARE['tips'], usage['single_slot'], label='tips')] if MIXED else tips_300
     # Define pipette selection
     p300_multi = protocol.load_instrument('p300_multi_gen2', 'left', tip_racks=tips_300)
-    p300_single = protocol.load_instrument('p300_single_gen2', 'right', tip_racks=tips_300)    
+    p300_single = protocol.load_instrument('p300_single_gen2', 'right', tip_racks=single_tips)    
+    if TIP_START_COLUMN > 1:
+        p300_multi.starting_tip = tips_300[0].columns()[TIP_START_COLUMN - 1][0]
+        if not MIXED:
+            p300_single.starting_tip = tips_300[0].columns()[TIP_START_COLUMN - 1][0]
+    if SINGLE_TIP_START != "A1":
+        p300_single.starting_tip = single_tips[0].wells_by_name()[SINGLE_TIP_START]
     
     # Define reservoir (PBS, Cells, Dyes) and source (cocentration gradient)    
-    reservoir = protocol.load_labware(LABWARE['reservoir'], 5)
-    source_plate = protocol.load_labware(LABWARE['reservoir'], 6) 
+    reservoir = protocol.load_labware(LABWARE['reservoir'], 5, label='reservoir')
+    source_plate = protocol.load_labware(LABWARE['reservoir'], 6, label='source plate') 
+    # transposed B mode: the B gradient is built along the columns of its own (deep well) plate
+    b_plate = protocol.load_labware(LABWARE['reservoir'], B_PLATE_SLOT, label='B plate') if TRANSPOSED_B else None
+    # the reservoir is filled by hand with what the plan draws (see fill_sheet), as are source plates kept from an earlier run
+    for supplied in [reservoir] + ([source_plate, b_plate] if REUSE_SOURCE else []):
+        if supplied is not None:
+            protocol.supply(supplied)
 
     protocol.comment("INFO: Labware Definitions Defined.")
-    # Dye A source
-    res_A_source = reservoir.wells_by_name()['A2']
-    # Dye B source
-    res_B_source = reservoir.wells_by_name()['A3']
-    # Cell source
-    res_cell_source = reservoir.wells_by_name()['A4']
     
     # Define flow rates
-    # take in viscous boolean value and update pipette settings
-    if VISCOUS == True: # we had issues with inaccurate volumes and air gaps with viscous liquids - > therefore we set slower speeds
-        rate_multiplier = RATE_MULTIPLIERS['slow']
-        p300_multi.well_bottom_clearance.aspirate = 0.2
-        p300_single.well_bottom_clearance.aspirate = 0.2
-        protocol.comment(f"INFO: Viscosity setting set to True. Rate multiplier set to {rate_multiplier}")
-    else: 
-        rate_multiplier = RATE_MULTIPLIERS['default']
-        protocol.comment(f"INFO: Viscosity setting set to False. Rate multiplier set to {rate_multiplier}")
+    # the liquid classes scale them per transfer (see use_liquid)
+    protocol.comment("INFO: Liquid classes: " + ", ".join(f"{source} {liquid['name']}" for source, liquid in LIQUIDS.items()))
     p300_multi.flow_rate.aspirate = FLOW_RATES["p300m_asp"]
     p300_multi.flow_rate.dispense = FLOW_RATES["p300m_disp"]
     p300_multi.flow_rate.blow_out = FLOW_RATES["p300m_blow"]
@@ -164,95 +2144,103 @@ def run(protocol: protocol_api.ProtocolContext):
     p300_single.flow_rate.blow_out = FLOW_RATES["p300s_blow"]
     protocol.comment("INFO: Flow rates defined.")
 
-    ## 2. Add PBS to source plate to begin serial dilution
-    distribute_pbs(p300_multi, reservoir, source_plate, protocol, FLOW_VOL["asp_vol"], FLOW_VOL["disp_vol"], FLOW_VOL["pbs_max_well"])
-    
-    ## 3. Add Inducer A and start dilution.
-    protocol.comment("INFO: Starting Inducer A dilution.")
-    p300_multi.pick_up_tip()
-    move_liquid(p300_multi, FLOW_VOL['asp_vol'], FLOW_VOL['disp_vol'], reservoir.columns()[1][0], source_plate.columns()[7][0], rate=rate_multiplier, mix_reps=3)
-    # Dilute backwards from Col 8 down to 1
-    # We grab the top well of each column for the multi-channel
-    dilution_path_A = [source_plate.columns()[i][0] for i in range(7, -1, -1)]
-    perform_serial_dilution(p300_multi, dilution_path_A, mix_reps=3, rate=rate_multiplier)
-    protocol.comment("INFO: Inducer A dilution completed.")
-    # Discard last volume
-    p300_multi.aspirate(FLOW_VOL['asp_vol'], source_plate.columns()[0][0])
-    p300_multi.drop_tip()
-    
-    ## 4. Inducer B Serial Dilution (Single-channel)
-    protocol.comment(f"INFO: Starting Inducer B Dilution on last {REPLICATES} columns.")
-    target_columns = source_plate.columns()[-REPLICATES:]
+    if REUSE_SOURCE:
+        # the source plate (and B plate) still hold the gradients of an earlier run
+        protocol.comment("INFO: Reusing the source plates of an earlier run.")
+    else:
+        ## 2. Add PBS to source plate to begin serial dilution
+        start_phase(protocol, 'pbs')
+        use_liquid(p300_multi, LIQUIDS['pbs'])
+        distribute_pbs(p300_multi, reservoir, source_plate, protocol, FLOW_VOL["asp_vol"], FLOW_VOL["disp_vol"], FLOW_VOL["pbs_max_well"], multi=MULTI_DISPENSE, b_plate=b_plate, a_diluent=None if a_schedule is None else {well.col: well.diluent for well in a_schedule if well.diluent > 0}, b_cols=B_SOURCE_COLUMNS[:REPLICATES], a_levels=layout.a_levels)
     
-    for col in target_columns:
-        p300_single.pick_up_tip()
-        # Initial transfer Reservoir -> Top of column (Row H / index 7)
-        move_liquid(p300_single, FLOW_VOL["asp_vol"], FLOW_VOL["disp_vol"], reservoir.columns()[2][0], col[7], mix_reps=3, rate=rate_multiplier)
-        protocol.comment(f"INFO: Liquid moved from {reservoir.columns()[2][0]} to {col[7]}")
-        # Define path: Row 7 down to Row 0 within this specific column
-        dilution_path_B = [col[i] for i in range(7, -1, -1)]
-        perform_serial_dilution(p300_single, dilution_path_B, mix_reps=3, mix_vol=300, rate=rate_multiplier)
-        protocol.comment(f"INFO: Inducer B dilution complete for {col} in {target_columns}")
-        # Discard last volume
-        p300_single.aspirate(FLOW_VOL['asp_vol'], col[0])
-        p300_single.drop_tip()
-    protocol.comment(f"INFO: Inducer B dilution complete.")
+        ## 3. Add Inducer A and start dilution.
+        start_phase(protocol, 'inducer_a')
+        protocol.comment("INFO: Starting Inducer A dilution.")
+        use_liquid(p300_multi, LIQUIDS['inducer_a'])
+        if a_schedule is None:
+            dilute_across_columns(p300_multi, reservoir.columns()[1][0], source_plate, levels=layout.a_levels)
+        else:
+            dilute_direct(p300_multi, reservoir.columns()[1][0], source_plate, a_schedule)
+        protocol.comment("INFO: Inducer A dilution completed.")
     
-    if REPLICATES > 3:
-        raise ValueError("replicates > 3. Maximum of 3 replicates and minimum of 1 replicate can be executed in each run. PLEASE ENTER AGAIN.")
+        ## 4. Inducer B Serial Dilution (Single-channel, or one multichannel sweep when transposed)
+        start_phase(protocol, 'inducer_b')
+        if TRANSPOSED_B:
+            # every row of the B plate holds the whole gradient, enough for one replicate each
+            protocol.comment("INFO: Starting transposed Inducer B dilution on the B plate.")
+            use_liquid(p300_multi, LIQUIDS['inducer_b'])
+            dilute_across_columns(p300_multi, reservoir.columns()[2][0], b_plate, mix_vol=300)
+        else:
+            protocol.comment(f"INFO: Starting Inducer B Dilution on columns {B_SOURCE_COLUMNS[0] + 1} to {B_SOURCE_COLUMNS[REPLICATES - 1] + 1}.")
+        # one B column per replicate, from column 10 on, where the PBS went and the gradient is placed from
+        target_columns = [] if TRANSPOSED_B else [source_plate.columns()[col] for col in B_SOURCE_COLUMNS[:REPLICATES]]
+        if target_columns:
+            use_liquid(p300_single, LIQUIDS['inducer_b'])
+        if MIXED and target_columns:
+            # every column with one tip, level by level
+            dilute_down_columns(p300_single, reservoir.columns()[2][0], target_columns)
+            target_columns = []
+        for col in target_columns:
+            p300_single.pick_up_tip()
+            # Initial transfer Reservoir -> Top of column (Row H / index 7)
+            move_liquid(p300_single, FLOW_VOL["asp_vol"], FLOW_VOL["disp_vol"], reservoir.columns()[2][0], col[7], mix_reps=3)
+            protocol.comment(f"INFO: Liquid moved from {reservoir.columns()[2][0]} to {col[7]}")
+            # Define path: Row 7 down to Row 0 within this specific column
+            dilution_path_B = [col[i] for i in range(7, -1, -1)]
+            perform_serial_dilution(p300_single, dilution_path_B, mix_reps=3, mix_vol=300)
+            protocol.comment(f"INFO: Inducer B dilution complete for {col} in {target_columns}")
+            # Discard what row A holds beyond the volume every gradient well is left with
+            p300_single.aspirate(col[0].current_volume() - FLOW_VOL['disp_vol'], col[0])
+            p300_single.drop_tip()
+        protocol.comment(f"INFO: Inducer B dilution complete.")
     
     ### B. Setup Final Destination Plate
-    ## 1. Distribute Reagents (PBS, A, B) to Dest Plates
-    # add controls and blanks to the destination plate (replicate)
-    for dest_plate in dest_plates:
-        cols = dest_plate.columns()
-        
-        # Distribute PBS to Col 1
-        p300_multi.distribute(30, res_A_source, cols[0], new_tip='once') 
-        
-        # Distribute Inducer A to Col 2 & 4
-        p300_multi.distribute(30, res_A_source, [cols[1], cols[3]], new_tip='once')
-        
-        # Distribute Inducer B to Col 3 & 4
-        p300_multi.distribute(30, res_B_source, [cols[2], cols[3]], new_tip='once')
+    if TIP_ECONOMY:
+        # direct dilution puts the targets in the columns in the order they were entered
+        planned = plan_tips(plan_destination(REPLICATES, layout.a_levels, TRANSPOSED_B), a_gradient_ranks(a_schedule))
+        labware = {'reservoir': reservoir, 'source_plate': source_plate}
+        if TRANSPOSED_B:
+            # the B gradient stage is placed by the single-channel, between the planned steps around it
+            before_b, after_b = split_b_gradient(planned)
+            apply_tip_plan(protocol, p300_multi, before_b, labware, dest_plates, LIQUIDS)
+            start_phase(protocol, 'gradient')
+            use_liquid(p300_single, LIQUIDS['inducer_b'])
+            if MIXED:
+                # every plate with one tip, level by level
+                place_gradient_b_transposed(p300_single, b_plate, dest_plates, [PLATE_OFFSET + i for i in range(len(dest_plates))])
+            else:
+                for i, dest in enumerate(dest_plates):
+                    place_gradient_b_transposed(p300_single, b_plate, [dest], [PLATE_OFFSET + i])
+            apply_tip_plan(protocol, p300_multi, after_b, labware, dest_plates, LIQUIDS)
+        else:
+            apply_tip_plan(protocol, p300_multi, planned, labware, dest_plates, LIQUIDS)
+        protocol.comment(f"INFO: Destination plates filled with {planned_tip_count(planned, TRANSPOSED_B)} tips.")
+    else:
+        fill_destination_plates(protocol, p300_multi, reservoir, source_plate, dest_plates, LIQUIDS, multi=MULTI_DISPENSE, p300_single=p300_single, b_plate=b_plate, plate_offset=PLATE_OFFSET, mixed_pipettes=MIXED)
 
-    # gradients from step A are transferred to the destination plates
-    ## 2. Transfer Gradient A & B and Cells
-    for i, dest in enumerate(dest_plates):
-        protocol.comment(f"INFO: Transferring Gradient for Plate {i+1}")
-        
-        p300_multi.pick_up_tip()
-        # Transfer Gradient A (Col 8-1 -> Col 12-5)
-        for offset in range(8):
-            source_well = source_plate.columns()[7 - offset][0]
-            dest_well = dest.columns()[11 - offset][0]
-            move_liquid(p300_multi, 30, 30, source_well, dest_well, mix_vol=10, mix_reps=1, rate=rate_multiplier)            
-        p300_multi.drop_tip()
-        
-        # Transfer B (Specific Source Cols -> Dest Cols 12-5)
-        b_source_idx = 9 + i
-        b_source_well = source_plate.columns()[b_source_idx][0]
-        
-        # Target: Columns 12 down to 5 (Indices 11 to 4)
-        targets_B = [dest.columns()[11-k][0] for k in range(8)]
-        
-        p300_multi.distribute(30, b_source_well, targets_B, new_tip='always') 
+def run(protocol: protocol_api.ProtocolContext, config: dict | None = None):
+    # config is read here rather than at import, so analysis and tooling can pass their own
+    if config is None:
+        config = load_config()
+    plan = compile_plan(config)
+    if config.get('resume_from') is not None:
+        plan = resume_plan(plan, resume_index(plan, config['resume_from'], config.get('checkpoint_path')), config.get('fresh_tips', False))
+    checkpoint = Checkpoint(config['checkpoint_path']) if config.get('checkpoint_path') else None
+    execute_plan(protocol, plan, config_tracer(config), checkpoint)
 
-        # Add Cells
-        # Group wells by volume
-        cols = dest.columns()
-        wells_70 = [cols[0][0], cols[1][0], cols[2][0]] # A1, A2, A3
-        wells_40 = [cols[3][0]] + [cols[k][0] for k in range(4, 12)] # A4 + A5-A12
-        
-        for w in wells_70:
-            p300_multi.pick_up_tip()
-            move_liquid(p300_multi, 70, 70, res_cell_source, w, mix_vol=50, mix_reps=3)
-            p300_multi.drop_tip()
-        for w in wells_40:
-            p300_multi.pick_up_tip()
-            move_liquid(p300_multi, 40, 40, res_cell_source, w, mix_vol=50, mix_reps=3)
-            p300_multi.drop_tip()
-        protocol.comment(f"INFO: Substrate/Cells added to plate {i} cols 1–12")        
-        
-        for cmd in protocol.commands():
-            print(cmd)
\ No newline at end of file
+def simulate_protocol(config: dict | str = CONFIG_PATH) -> protocol_api.ProtocolContext:
+    """
+    Entry point for simulation runs. Builds a simulated ProtocolContext and runs the protocol against it.
+    config can be a parsed config dict or a path to a config file.
+    """
+    from opentrons import simulate
+    if isinstance(config, str):
+        config = load_config(config)
+    protocol = simulate.get_protocol_api(SIMULATION_API_LEVEL)
+    run(protocol, config)
+    return protocol
+
+if __name__ == "__main__":
+    simulated = simulate_protocol(sys.argv[1] if len(sys.argv) > 1 else CONFIG_PATH)
+    for cmd in simulated.commands():
+        print(cmd)
@@ -0,0 +1,238 @@
+"""
+Headless run-time estimator for the dual inducer assay protocol.
+Walks the liquid-handling commands of a config's compiled plan (or of a full simulator pass)
+and prices each one with a simple per-command cost model, broken down per phase.
+
+Usage: python estimator.py [dilution_config.json]
+"""
+import contextlib
+import io
+import math
+import sys
+from collections import Counter, namedtuple
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List
+
+import dual_inducer_assay as assay
+
+## COST MODEL
+# All times in seconds. Liquid handling time comes from the flow rate the pipette was set
+# to when the command ran; everything else is a fixed, approximate cost for an OT-2.
+COST_MODEL = {
+    **assay.TRAVEL_COST,         # gantry speed, slot and well changes
+    'command_overhead_s': 0.3,   # plunger preparation / settle per aspirate, dispense or blow-out
+    'blow_out_ul': 30.0,         # plunger travel past the bottom position, as an equivalent volume
+    'pick_up_tip_s': 4.0,
+    'drop_tip_s': 3.0,
+}
+
+TRASH_SLOT = assay.TRASH_SLOT
+
+# one leaf liquid-handling command, reduced to what the cost model needs; a delay's volume is its seconds,
+# and it has no slot or point, as the gantry stays put
+Step = namedtuple('Step', ['kind', 'phase', 'slot', 'point', 'volume', 'flow_rate', 'in_mix'])
+
+CATEGORIES = ('aspirate', 'dispense', 'mix', 'blow_out', 'tips', 'delay', 'travel')
+
+@dataclass
+class Estimate:
+    """Predicted duration per phase and category, plus command counts per phase."""
+    seconds: dict = field(default_factory=dict)  # phase -> {category: seconds}
+    counts: dict = field(default_factory=dict)   # phase -> Counter of step kinds
+
+    def add(self, phase: str, category: str, seconds: float):
+        phase_seconds = self.seconds.setdefault(phase, dict.fromkeys(CATEGORIES, 0.0))
+        phase_seconds[category] += seconds
+
+    def phase_total_s(self, phase: str) -> float:
+        return sum(self.seconds.get(phase, {}).values())
+
+    @property
+    def total_s(self) -> float:
+        return sum(self.phase_total_s(phase) for phase in self.seconds)
+
+    def total_count(self, kind: str) -> int:
+        return sum(counter[kind] for counter in self.counts.values())
+
+    def format(self) -> str:
+        lines = [f"{'Phase':<12}{'Minutes':>9}{'Aspirates':>11}{'Dispenses':>11}{'Tips':>6}"]
+        for phase in self.seconds:
+            counts = self.counts.get(phase, Counter())
+            lines.append(f"{phase:<12}{self.phase_total_s(phase) / 60:>9.2f}{counts['aspirate']:>11}{counts['dispense']:>11}{counts['pick_up_tip']:>6}")
+        lines.append(f"{'total':<12}{self.total_s / 60:>9.2f}{self.total_count('aspirate'):>11}{self.total_count('dispense'):>11}{self.total_count('pick_up_tip'):>6}")
+        return "\n".join(lines)
+
+def _slot_of(location) -> str:
+    """Deck slot name of a Well, Location or disposal location."""
+    labware = getattr(location, 'labware', None)
+    if labware is not None:
+        location = labware.as_well() or labware.as_labware()
+    if hasattr(location, 'well_name'):
+        # Well -> Labware -> slot
+        return str(location.parent.parent)
+    return TRASH_SLOT
+
+def _point_of(location, protocol):
+    if hasattr(location, 'point'):
+        return tuple(location.point)
+    if hasattr(location, 'well_name'):
+        return tuple(location.top().point)
+    # trash bins have no wells; aim for the middle of their slot
+    corner = protocol.deck.position_for(int(TRASH_SLOT)).point
+    return (corner.x + 64.0, corner.y + 43.0, corner.z)
+
+def record_steps(config: dict, commands: list | None = None) -> List[Step]:
+    """
+    Simulates run() for a config and returns the leaf liquid-handling commands it issued.
+    If commands is given, the text of every command (comments and mixes included) is appended to it.
+    """
+    from opentrons import simulate
+    from opentrons.legacy_commands import types as command_types
+
+    # the simulator warns about missing calibration files every time it is built
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        protocol = simulate.get_protocol_api(assay.SIMULATION_API_LEVEL)
+    steps: List[Step] = []
+    stack: list = []  # names of the commands currently open
+    phase = 'setup'
+
+    def on_command(message):
+        nonlocal phase
+        name = message['name']
+        if message['$'] == 'after':
+            stack.pop()
+            return
+        stack.append(name)
+        payload = message['payload']
+        if commands is not None:
+            commands.append(payload['text'])
+        if name == command_types.COMMENT:
+            if payload['text'].startswith(assay.PHASE_PREFIX):
+                phase = payload['text'][len(assay.PHASE_PREFIX):]
+            return
+        if name == command_types.DELAY:
+            steps.append(Step('delay', phase, None, None, payload['minutes'] * 60 + payload['seconds'], 0, False))
+            return
+        in_mix = command_types.MIX in stack[:-1]
+        pipette = payload.get('instrument')
+        location = payload.get('location')
+        if name == command_types.ASPIRATE:
+            flow_rate = pipette.flow_rate.aspirate * payload['rate']
+            steps.append(Step('aspirate', phase, _slot_of(location), _point_of(location, protocol), payload['volume'], flow_rate, in_mix))
+        elif name == command_types.DISPENSE:
+            flow_rate = pipette.flow_rate.dispense * payload['rate']
+            steps.append(Step('dispense', phase, _slot_of(location), _point_of(location, protocol), payload['volume'], flow_rate, in_mix))
+        elif name in (command_types.BLOW_OUT, command_types.BLOW_OUT_IN_DISPOSAL_LOCATION):
+            steps.append(Step('blow_out', phase, _slot_of(location), _point_of(location, protocol), 0, pipette.flow_rate.blow_out, in_mix))
+        elif name == command_types.PICK_UP_TIP:
+            steps.append(Step('pick_up_tip', phase, _slot_of(location), _point_of(location, protocol), 0, 0, in_mix))
+        elif name in (command_types.DROP_TIP, command_types.DROP_TIP_IN_DISPOSAL_LOCATION):
+            steps.append(Step('drop_tip', phase, _slot_of(location), _point_of(location, protocol), 0, 0, in_mix))
+
+    unsubscribe = protocol.broker.subscribe(command_types.COMMAND, on_command)
+    try:
+        assay.run(protocol, config)
+    finally:
+        unsubscribe()
+    return steps
+
+def _price_steps(steps: Iterable[Step], cost_model: dict) -> Iterator[tuple]:
+    """Yields every step with its costs, [(category, seconds)], travel to it included."""
+    last_slot, last_point = None, None
+    for step in steps:
+        costs = []
+        if step.kind == 'delay':
+            yield step, [('delay', step.volume)]
+            continue
+        # gantry travel to the step's location (the gantry is shared by both mounts)
+        if last_point is not None:
+            distance = math.dist(last_point[:2], step.point[:2])
+            if step.slot != last_slot:
+                costs.append(('travel', distance / cost_model['gantry_speed_mm_s'] + cost_model['slot_change_s']))
+            elif distance > 0.5:
+                costs.append(('travel', distance / cost_model['gantry_speed_mm_s'] + cost_model['well_change_s']))
+        last_slot, last_point = step.slot, step.point
+
+        if step.kind in ('aspirate', 'dispense'):
+            seconds = step.volume / step.flow_rate + cost_model['command_overhead_s']
+            costs.append(('mix' if step.in_mix else step.kind, seconds))
+        elif step.kind == 'blow_out':
+            costs.append(('blow_out', cost_model['blow_out_ul'] / step.flow_rate + cost_model['command_overhead_s']))
+        elif step.kind == 'pick_up_tip':
+            costs.append(('tips', cost_model['pick_up_tip_s']))
+        elif step.kind == 'drop_tip':
+            costs.append(('tips', cost_model['drop_tip_s']))
+        yield step, costs
+
+def estimate_steps(steps: Iterable[Step], cost_model: dict = COST_MODEL) -> Estimate:
+    """Prices a stream of steps with the cost model."""
+    estimate = Estimate()
+    for step, costs in _price_steps(steps, cost_model):
+        counts = estimate.counts.setdefault(step.phase, Counter())
+        counts[step.kind] += 1
+        for category, seconds in costs:
+            estimate.add(step.phase, category, seconds)
+    return estimate
+
+def _plan_steps(plan: dict) -> Iterator[tuple]:
+    """Yields the leaf liquid-handling commands of a compiled plan, each with the index of the op it comes from."""
+    flow_rates = {mount: {} for mount in plan['pipettes']}
+    used_tips = assay.tips_gone(plan)
+    phase = 'setup'
+    for index, (kind, mount, where, volume, rate, reps) in enumerate(plan['ops']):
+        if kind == 'comment':
+            if where.startswith(assay.PHASE_PREFIX):
+                phase = where[len(assay.PHASE_PREFIX):]
+            continue
+        if kind == 'set':
+            group, name = where.split('.')
+            if group == 'flow_rate':
+                flow_rates[mount][name] = volume
+            continue
+        if kind == 'pick_up_tip':
+            tip = assay.next_tip(plan, mount, used_tips)
+            yield index, Step('pick_up_tip', phase, tip.split('/')[0], assay.address_point(plan, tip), 0, 0, False)
+            continue
+        if kind == 'delay':
+            yield index, Step('delay', phase, None, None, volume, 0, False)
+            continue
+        slot = assay.address_slot(where)
+        point = assay.address_point(plan, where)
+        if kind == 'drop_tip':
+            yield index, Step('drop_tip', phase, slot, point, 0, 0, False)
+        elif kind in ('aspirate', 'dispense'):
+            yield index, Step(kind, phase, slot, point, volume, flow_rates[mount][kind] * rate, False)
+        elif kind == 'mix':
+            for _ in range(reps):
+                yield index, Step('aspirate', phase, slot, point, volume, flow_rates[mount]['aspirate'] * rate, True)
+                yield index, Step('dispense', phase, slot, point, volume, flow_rates[mount]['dispense'] * rate, True)
+        elif kind == 'blow_out':
+            yield index, Step('blow_out', phase, slot, point, 0, flow_rates[mount]['blow_out'], False)
+
+def steps_from_plan(plan: dict) -> List[Step]:
+    """The leaf liquid-handling commands of a compiled plan, without simulating it."""
+    return [step for _, step in _plan_steps(plan)]
+
+def op_seconds(plan: dict, cost_model: dict = COST_MODEL) -> list[float]:
+    """Estimated seconds of every op of a plan, travel to it included; 0 for comments and settings."""
+    seconds = [0.0] * len(plan['ops'])
+    indexed = list(_plan_steps(plan))
+    for (index, _), (_, costs) in zip(indexed, _price_steps((step for _, step in indexed), cost_model)):
+        seconds[index] += sum(cost for _, cost in costs)
+    return seconds
+
+def estimate_plan(plan: dict) -> Estimate:
+    """Predicted wall-clock duration of a compiled plan."""
+    return estimate_steps(steps_from_plan(plan))
+
+def estimate_run(config: dict) -> Estimate:
+    """Predicted wall-clock duration of run() for a config, from its compiled plan."""
+    return estimate_plan(assay.compile_plan(config))
+
+def estimate_simulated(config: dict) -> Estimate:
+    """Like estimate_run, but from the command stream of a full simulator pass."""
+    return estimate_steps(record_steps(config))
+
+if __name__ == "__main__":
+    config = assay.load_config(sys.argv[1] if len(sys.argv) > 1 else assay.CONFIG_PATH)
+    print(estimate_run(config).format())
@@ -0,0 +1,37 @@
+"""
+Compares the run time of per-liquid classes against the old viscosity switch, which slowed both inducers
+whenever one of them was viscous. With 'viscous_check' the viscous class takes the same time as the switch
+did (benchmark_baseline.json holds those runs), so the previous behaviour is the config with both inducers viscous.
+Times are per phase, estimated from the compiled plans.
+
+Usage: python liquid_report.py [dilution_config.json]
+"""
+import sys
+
+import dual_inducer_assay as assay
+import estimator
+
+def previous_config(config: dict) -> dict:
+    """The config as the old switch ran it: both inducers viscous if either is in a slower class than aqueous, PBS and cells aqueous."""
+    classes = assay.liquid_classes(config)
+    aqueous = assay.LIQUID_CLASSES['aqueous']
+    slow = any(classes[source][field] < aqueous[field] for source in ('inducer_a', 'inducer_b') for field in ('aspirate_rate', 'dispense_rate'))
+    return dict(config, liquid_classes=None, viscous_check=slow)
+
+def liquid_report(config: dict) -> str:
+    classes = assay.liquid_classes(config)
+    per_liquid = estimator.estimate_plan(assay.compile_plan(config))
+    previous = estimator.estimate_plan(assay.compile_plan(previous_config(config)))
+
+    lines = ["Liquid classes: " + ", ".join(f"{source} {liquid['name']}" for source, liquid in classes.items())]
+    lines.append(f"{'Phase':<12}{'Old switch':>12}{'Per liquid':>12}{'Recovered':>11}")
+    for phase in previous.seconds:
+        old_min, new_min = previous.phase_total_s(phase) / 60, per_liquid.phase_total_s(phase) / 60
+        lines.append(f"{phase:<12}{old_min:>12.2f}{new_min:>12.2f}{old_min - new_min:>11.2f}")
+    old_min, new_min = previous.total_s / 60, per_liquid.total_s / 60
+    lines.append(f"{'total':<12}{old_min:>12.2f}{new_min:>12.2f}{old_min - new_min:>11.2f}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    config = assay.load_config(sys.argv[1] if len(sys.argv) > 1 else assay.CONFIG_PATH)
+    print(liquid_report(config))
@@ -0,0 +1,178 @@
+"""
+Tooling for compiled plans (see compile_plan() in dual_inducer_assay.py): JSON files, an on-disk
+cache keyed by config hash, and diffs between plans.
+
+Usage:
+    python plan_tools.py compile dilution_config.json [-o plan.json]
+    python plan_tools.py diff old.json new.json
+    python plan_tools.py volumes dilution_config.json
+    python plan_tools.py travel dilution_config.json
+    python plan_tools.py resume dilution_config.json [--from checkpoint|PHASE|OP] [--checkpoint checkpoint.json] [--fresh-tips]
+Files passed to diff, volumes, travel and resume can be configs (compiled through the cache) or saved plans.
+resume lists where a plan can be resumed from (see CHECKPOINTS in dual_inducer_assay.py), or checks
+resuming it from a point and prints the reservoir levels that needs.
+"""
+import argparse
+import difflib
+import hashlib
+import json
+import os
+import sys
+
+import dual_inducer_assay as assay
+import estimator
+
+PLAN_CACHE_DIR = '.plan_cache'
+
+_source_hash = None
+
+def source_hash() -> str:
+    """Hash of the protocol source, so cached plans are dropped whenever the protocol logic changes."""
+    global _source_hash
+    if _source_hash is None:
+        with open(assay.__file__, 'rb') as f:
+            _source_hash = hashlib.sha256(f.read()).hexdigest()
+    return _source_hash
+
+def config_hash(config: dict) -> str:
+    key = json.dumps({'config': config, 'plan_version': assay.PLAN_VERSION, 'source': source_hash()}, sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+def plan_to_json(plan: dict) -> str:
+    """Serialises a plan with one op per line, so that plan files diff cleanly."""
+    header = {key: value for key, value in plan.items() if key != 'ops'}
+    lines = [json.dumps(header)[:-1] + ', "ops": [']
+    lines += [json.dumps(list(op)) + ',' for op in plan['ops']]
+    if plan['ops']:
+        lines[-1] = lines[-1][:-1]
+    lines.append(']}')
+    return "\n".join(lines) + "\n"
+
+def plan_from_json(text: str) -> dict:
+    plan = json.loads(text)
+    plan['ops'] = [assay.Op(*op) for op in plan['ops']]
+    return plan
+
+def load_or_compile(config: dict, cache_dir: str = PLAN_CACHE_DIR) -> dict:
+    """Compiles a config, or loads its plan from the cache if it was compiled before."""
+    key = config_hash(config)
+    path = os.path.join(cache_dir, f"{key}.json")
+    if os.path.exists(path):
+        with open(path) as f:
+            return plan_from_json(f.read())
+    plan = assay.compile_plan(config)
+    plan['config_hash'] = key
+    os.makedirs(cache_dir, exist_ok=True)
+    # write then rename, so an interrupted write never leaves a corrupt cache entry; the temporary file is
+    # per process, as config_tools.py compiles in parallel
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(plan_to_json(plan))
+    os.replace(tmp_path, path)
+    return plan
+
+def format_op(op: assay.Op) -> str:
+    kind, pipette, where, volume, rate, reps = op
+    if kind == 'comment':
+        return f"# {where}"
+    text = f"{kind:<12}{pipette:<6}{where}"
+    if kind in ('aspirate', 'dispense', 'mix', 'set') and volume is not None:
+        text += f" {volume:g}"
+    elif kind == 'delay':
+        text += f"{volume:g} s"
+    if rate != 1.0:
+        text += f" @{rate:g}x"
+    if reps:
+        text += f" x{reps}"
+    return text
+
+def diff_plans(old: dict, new: dict, context: int = 2) -> list[str]:
+    """Unified diff of two plans, one op per line."""
+    old_lines = [json.dumps({k: v for k, v in old.items() if k not in ('ops', 'spans', 'config_hash')}, sort_keys=True)] + [format_op(op) for op in old['ops']]
+    new_lines = [json.dumps({k: v for k, v in new.items() if k not in ('ops', 'spans', 'config_hash')}, sort_keys=True)] + [format_op(op) for op in new['ops']]
+    return list(difflib.unified_diff(old_lines, new_lines, 'old', 'new', n=context, lineterm=''))
+
+def travel_report(plan: dict) -> list[str]:
+    """Gantry travel and estimated run time of a plan, before and after optimize_travel()."""
+    optimized = assay.optimize_travel(plan)
+    lines = [f"{'':<10}{'Travel (m)':>11}{'Travel (min)':>13}{'Slot changes':>13}{'Swaps':>7}{'Run (min)':>10}"]
+    for label, candidate in (('before', plan), ('after', optimized)):
+        travel = assay.travel_summary(candidate)
+        minutes = estimator.estimate_plan(candidate).total_s / 60
+        lines.append(f"{label:<10}{travel.distance_mm / 1000:>11.2f}{travel.seconds / 60:>13.2f}{travel.slot_changes:>13}{travel.swaps:>7}{minutes:>10.2f}")
+    return lines
+
+def resume_report(plan: dict, point, checkpoint_path: str | None = None, fresh_tips: bool = False) -> list[str]:
+    """Where resuming a plan from point starts, how long the rest takes and the reservoir levels it needs."""
+    done = assay.resume_index(plan, point, checkpoint_path)
+    resumed = assay.resume_plan(plan, done, fresh_tips)
+    lines = [f"Resuming at op {done}: {format_op(plan['ops'][done])}"]
+    lines.append(f"{done} of {len(plan['ops'])} ops done, {estimator.estimate_plan(resumed).total_s / 60:.1f} of {estimator.estimate_plan(plan).total_s / 60:.1f} min left")
+    lines.append("Top up the reservoir to (uL per well, rows A-H unless noted):")
+    lines += assay.format_fill_sheet(assay.fill_sheet(assay.resume_volumes(plan, resumed)))
+    return lines
+
+def _load_plan_or_config(path: str) -> dict:
+    with open(path) as f:
+        data = json.load(f)
+    if 'ops' in data:
+        data['ops'] = [assay.Op(*op) for op in data['ops']]
+        return data
+    return load_or_compile(data)
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    compile_cmd = commands.add_parser('compile', help="compile a config into a plan")
+    compile_cmd.add_argument('config')
+    compile_cmd.add_argument('-o', '--output', help="write the plan here instead of printing it")
+    diff_cmd = commands.add_parser('diff', help="diff two plans or configs")
+    diff_cmd.add_argument('old')
+    diff_cmd.add_argument('new')
+    volumes_cmd = commands.add_parser('volumes', help="check well volumes and print the reservoir fill sheet")
+    volumes_cmd.add_argument('plan')
+    travel_cmd = commands.add_parser('travel', help="compare gantry travel before and after optimize_travel()")
+    travel_cmd.add_argument('plan')
+    resume_cmd = commands.add_parser('resume', help="list resume points, or check resuming from one")
+    resume_cmd.add_argument('plan')
+    resume_cmd.add_argument('--from', dest='point', help=f"'{assay.RESUME_CHECKPOINT}', a phase name or an op index")
+    resume_cmd.add_argument('--checkpoint', help="checkpoint file written by the interrupted run")
+    resume_cmd.add_argument('--fresh-tips', action='store_true', help="the tip racks were replaced with full ones")
+    args = parser.parse_args(argv)
+
+    if args.command == 'compile':
+        text = plan_to_json(load_or_compile(assay.load_config(args.config)))
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text)
+        else:
+            sys.stdout.write(text)
+    elif args.command == 'diff':
+        lines = diff_plans(_load_plan_or_config(args.old), _load_plan_or_config(args.new))
+        print("\n".join(lines) if lines else "Plans are identical.")
+    elif args.command == 'travel':
+        print("\n".join(travel_report(_load_plan_or_config(args.plan))))
+    elif args.command == 'resume':
+        plan = _load_plan_or_config(args.plan)
+        if args.point is None:
+            for index, phase, what in assay.resume_points(plan):
+                print(f"{index:>6}  {phase or '':<12}{what}")
+            return 0
+        point = int(args.point) if args.point.isdigit() else args.point
+        try:
+            print("\n".join(resume_report(plan, point, args.checkpoint, args.fresh_tips)))
+        except ValueError as e:
+            print(e)
+            return 1
+    else:
+        ledger = assay.track_volumes(_load_plan_or_config(args.plan))
+        issues = ledger.check()
+        if issues:
+            print(assay.format_issues(issues))
+            return 1
+        print("Reservoir (uL per well, rows A-H unless noted):")
+        print("\n".join(assay.format_fill_sheet(assay.fill_sheet(ledger))))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
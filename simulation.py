@@ -0,0 +1,187 @@
+"""
+Cached simulator runs of the dual inducer assay protocol.
+A run's command log is cached per config and protocol source. When either changes, the config is recompiled
+(through the plan cache, see plan_tools.py) and split into one segment per phase. Each segment is replayed on its
+own, from the pipette settings and tips it starts with, so only the phases whose ops changed are simulated again;
+the log of every other phase comes from the cache. Commands are printed once, as they are produced.
+With --trace, the whole run is simulated and traced (see TRACING in dual_inducer_assay.py), timed by the estimator.
+
+Usage: python simulation.py [dilution_config.json] [--no-cache] [-q] [--trace trace.json [--trace-format chrome]]
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass
+from importlib import metadata
+from typing import Callable
+
+import dual_inducer_assay as assay
+import estimator
+import plan_tools
+
+SIM_CACHE_DIR = '.sim_cache'
+
+@dataclass
+class SimulationResult:
+    """The command log of a simulated run, and how much of it had to be simulated."""
+    commands: list[str]
+    segments: int
+    simulated: int # segments that were not in the cache
+    cached_run: bool # the whole run was in the cache, so nothing was compiled
+
+    def summary(self) -> str:
+        if self.cached_run:
+            return f"{len(self.commands)} commands, all from the cache"
+        return f"{len(self.commands)} commands, {self.simulated} of {self.segments} segments simulated"
+
+def simulator_version() -> str:
+    # read from the package metadata, so cache hits never import opentrons
+    return f"opentrons {metadata.version('opentrons')}, API {assay.SIMULATION_API_LEVEL}"
+
+def _key(data) -> str:
+    return hashlib.sha256(json.dumps([data, simulator_version()], sort_keys=True).encode()).hexdigest()[:16]
+
+def run_key(config: dict) -> str:
+    """Cache key of a whole run: the config, the protocol source and the simulator."""
+    return _key(plan_tools.config_hash(config))
+
+def split_segments(plan: dict) -> list[dict]:
+    """
+    Splits a plan into self-contained plans, one per phase (plus the setup before the first one). Each loads only
+    the labware its ops touch, starts with the pipette settings in force at that point, and names every tip it
+    picks up, so it replays the same commands as its part of the whole plan.
+    """
+    settings = {mount: {} for mount in plan['pipettes']}
+    used_tips = assay.tips_gone(plan)
+    holding = set()
+    segments = []
+    for op in plan['ops']:
+        # a new phase starts a new segment, unless a pipette still has a tip on
+        if not segments or (op.kind == 'comment' and op.where.startswith(assay.PHASE_PREFIX) and not holding):
+            ops = [assay.Op('set', mount, where, value, 1.0, 0) for mount, values in settings.items() for where, value in values.items()]
+            segments.append(ops)
+        if op.kind == 'set':
+            settings[op.pipette][op.where] = op.volume
+        elif op.kind == 'pick_up_tip':
+            op = op._replace(where=assay.next_tip(plan, op.pipette, used_tips))
+            holding.add(op.pipette)
+        elif op.kind == 'drop_tip':
+            holding.discard(op.pipette)
+        segments[-1].append(op)
+
+    plans = []
+    for ops in segments:
+        slots = sorted({assay.address_slot(op.where) for op in ops if op.kind not in ('comment', 'set', 'delay') and op.where != assay.TRASH}, key=int)
+        plans.append({
+            'version': assay.PLAN_VERSION,
+            'labware': {slot: plan['labware'][slot] for slot in slots},
+            'labels': {slot: plan['labels'][slot] for slot in slots if slot in plan['labels']},
+            'supplied': [slot for slot in plan['supplied'] if slot in slots],
+            'pipettes': {mount: {'name': spec['name'], 'tip_racks': []} for mount, spec in plan['pipettes'].items()},
+            'ops': ops,
+        })
+    return plans
+
+def simulate_plan(plan: dict, emit: Callable[[str], None] | None = None, tracer: assay.Tracer | None = None) -> list[str]:
+    """Replays a plan in a fresh simulator and returns its command log, passing each command to emit as it runs."""
+    from opentrons import simulate
+    from opentrons.legacy_commands import types as command_types
+
+    # the simulator warns about missing calibration files every time it is built
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        protocol = simulate.get_protocol_api(assay.SIMULATION_API_LEVEL)
+    commands = []
+
+    def on_command(message):
+        if message['$'] == 'before':
+            commands.append(message['payload']['text'])
+            if emit is not None:
+                emit(commands[-1])
+
+    unsubscribe = protocol.broker.subscribe(command_types.COMMAND, on_command)
+    try:
+        assay.execute_plan(protocol, plan, tracer)
+    finally:
+        unsubscribe()
+    return commands
+
+def _read_json(path: str):
+    with open(path) as f:
+        return json.load(f)
+
+def _write_json(path: str, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write then rename, so an interrupted write never leaves a corrupt cache entry (per process, see plan_tools)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def simulate(config: dict, emit: Callable[[str], None] | None = None, cache_dir: str | None = SIM_CACHE_DIR) -> SimulationResult:
+    """
+    Simulates a config, reusing cached command logs: of the whole run if the config and protocol source are
+    unchanged, otherwise of every phase whose segment (see split_segments) is. cache_dir=None disables the cache.
+    """
+    if cache_dir is None:
+        commands = simulate_plan(assay.compile_plan(config), emit)
+        return SimulationResult(commands, 1, 1, False)
+    run_path = os.path.join(cache_dir, f"{run_key(config)}.json")
+    if os.path.exists(run_path):
+        # a run entry lists its segments, whose logs are shared with every other run that has them
+        keys = _read_json(run_path)
+        if all(os.path.exists(os.path.join(cache_dir, 'segments', f"{key}.json")) for key in keys):
+            commands = []
+            for key in keys:
+                for command in _read_json(os.path.join(cache_dir, 'segments', f"{key}.json")):
+                    commands.append(command)
+                    if emit is not None:
+                        emit(command)
+            return SimulationResult(commands, len(keys), 0, True)
+
+    plan = plan_tools.load_or_compile(config, os.path.join(cache_dir, 'plans'))
+    commands, keys, simulated = [], [], 0
+    for segment in split_segments(plan):
+        key = _key(plan_tools.plan_to_json(segment))
+        path = os.path.join(cache_dir, 'segments', f"{key}.json")
+        if os.path.exists(path):
+            segment_commands = _read_json(path)
+            if emit is not None:
+                for command in segment_commands:
+                    emit(command)
+        else:
+            segment_commands = simulate_plan(segment, emit)
+            _write_json(path, segment_commands)
+            simulated += 1
+        commands += segment_commands
+        keys.append(key)
+    _write_json(run_path, keys)
+    return SimulationResult(commands, len(keys), simulated, False)
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('config', nargs='?', default=assay.CONFIG_PATH)
+    parser.add_argument('--no-cache', action='store_true', help="simulate the whole run, without reading or writing the cache")
+    parser.add_argument('-q', '--quiet', action='store_true', help="only print the summary")
+    parser.add_argument('--trace', metavar='PATH', help="write a trace of the run here, with estimated times (bypasses the cache)")
+    parser.add_argument('--trace-format', choices=assay.TRACE_FORMATS, default='jsonl')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.trace:
+        plan = assay.compile_plan(assay.load_config(args.config))
+        tracer = assay.Tracer(args.trace, args.trace_format, estimator.op_seconds(plan))
+        commands = simulate_plan(plan, None if args.quiet else print, tracer)
+        print(f"{len(commands)} commands traced to {args.trace} in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+        return 0
+    result = simulate(assay.load_config(args.config), None if args.quiet else print, None if args.no_cache else SIM_CACHE_DIR)
+    # the summary goes to stderr, so stdout is exactly the command log
+    print(f"{result.summary()} in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,176 @@
+"""
+Checks of compiled plans: tip economy never carries a tip into a lower concentration, optimize_travel() only
+reorders, interrupted runs resume to the same plates, and max_replicates() agrees with compile_plan().
+
+Usage: python -m pytest test_plans.py
+"""
+import itertools
+
+import pytest
+
+import config_tools
+import dual_inducer_assay as assay
+
+SPECIES = ('a', 'b')
+# the phases that put liquid on the destination plates, where carry-over would bias a well
+DEST_PHASES = ('controls', 'gradient', 'cells')
+TARGET_ORDERS = ("0, 2, 4, 6, 8, 10, 12, 14", "14, 12, 10, 8, 6, 4, 2, 0", "4, 0, 14, 2, 8, 12, 6, 10")
+
+def config_for(targets: str = TARGET_ORDERS[0], **fields) -> dict:
+    """A config as the GUI writes it, for the given A targets (uM, from a 15 uM stock)."""
+    result = config_tools.calculate_dilutions(15.0, 100.0, config_tools.parse_targets(targets))
+    return dict(config_tools.make_config(dict(config_tools.EXPERIMENT_DEFAULTS), result), **fields)
+
+def tip_carryover(plan: dict) -> list[tuple]:
+    """
+    Replays a plan's liquid per channel and returns (op index, well, species, residue, concentration) for every
+    destination phase aspirate, contact dispense or mix of a tip that held more of a species than the well does.
+    Reservoir wells hold their pool's species at 1.0, other supplied wells none.
+    """
+    channels = {mount: 8 if 'multi' in spec['name'] else 1 for mount, spec in plan['pipettes'].items()}
+    supplied = set(plan['supplied'])
+    stocks = {}
+    for slot in supplied:
+        for (_, col), pool in assay.RESERVOIR_POOLS.items():
+            for row in assay.ROWS:
+                stocks[f"{slot}/{row}{col + 1}"] = {s: 1.0 if s in pool else 0.0 for s in SPECIES}
+    wells = {} # address: (volume, {species: amount})
+    residue = {mount: [{} for _ in range(n)] for mount, n in channels.items()}
+    in_tip = {mount: [None] * n for mount, n in channels.items()}
+    checking, issues = False, []
+
+    def addresses(mount, where):
+        slot, well = where.split('/')[:2]
+        step = assay.labware_shape(plan['labware'][slot])[0] // assay.CHANNELS
+        first = assay.PLATE_ROWS.index(well[0])
+        return [f"{slot}/{assay.PLATE_ROWS[first + i * step]}{well[1:]}" for i in range(channels[mount])]
+
+    def concentration(address):
+        if address.split('/')[0] in supplied:
+            return stocks.get(address, {s: 0.0 for s in SPECIES})
+        volume, amount = wells.get(address, (0.0, {}))
+        return {s: amount.get(s, 0.0) / volume if volume > 1e-9 else 0.0 for s in SPECIES}
+
+    def touch(index, mount, channel, address):
+        conc = concentration(address)
+        for s, level in residue[mount][channel].items():
+            if level > conc[s] * (1 + 1e-6) + 1e-9:
+                issues.append((index, address, s, level, conc[s]))
+        for s in SPECIES:
+            residue[mount][channel][s] = max(residue[mount][channel].get(s, 0.0), conc[s])
+
+    for index, (kind, mount, where, volume, _, _) in enumerate(plan['ops']):
+        if kind == 'comment' and where.startswith(assay.PHASE_PREFIX):
+            checking = where[len(assay.PHASE_PREFIX):] in DEST_PHASES
+        elif kind == 'pick_up_tip':
+            residue[mount] = [{} for _ in residue[mount]]
+        elif kind in ('aspirate', 'dispense', 'mix'):
+            for channel, address in enumerate(addresses(mount, where)):
+                if kind == 'aspirate':
+                    conc = concentration(address)
+                    if checking:
+                        touch(index, mount, channel, address)
+                    if address.split('/')[0] not in supplied:
+                        held, amount = wells[address]
+                        wells[address] = (held - volume, {s: amount.get(s, 0.0) - conc[s] * volume for s in SPECIES})
+                    in_tip[mount][channel] = conc
+                elif kind == 'dispense':
+                    conc = in_tip[mount][channel]
+                    held, amount = wells.get(address, (0.0, {}))
+                    wells[address] = (held + volume, {s: amount.get(s, 0.0) + conc[s] * volume for s in SPECIES})
+                    # a dispense from the top leaves the tip clean
+                    if checking and not where.endswith('/top'):
+                        touch(index, mount, channel, address)
+                elif checking:
+                    touch(index, mount, channel, address)
+    return issues
+
+## tip economy
+@pytest.mark.parametrize("targets", TARGET_ORDERS)
+def test_tip_economy_never_carries_down(targets):
+    for replicates, direct_dilution, transposed_b, multi_dispense, mixed_pipettes in itertools.product((1, 3), (False, True), (False, True), (False, True), (False, True)):
+        config = config_for(targets, tip_economy=True, replicates=replicates, direct_dilution=direct_dilution, transposed_b=transposed_b, multi_dispense=multi_dispense, mixed_pipettes=mixed_pipettes)
+        if transposed_b and replicates < assay.TRANSPOSED_B_MIN_REPLICATES:
+            with pytest.raises(ValueError, match="transposed_b"):
+                assay.compile_plan(config)
+            continue
+        assert tip_carryover(assay.compile_plan(config)) == [], config
+
+def test_carryover_check_finds_the_default_modes_reuse():
+    # without tip economy, one tip places the A gradient from high to low and dispenses B into the A + B controls
+    assert tip_carryover(assay.compile_plan(config_for()))
+
+def test_tip_economy_puts_more_plates_in_the_tip_slots_it_frees():
+    config = config_for(transposed_b=True, tip_economy=True)
+    assert assay.max_replicates(config) >= 4
+    plan = assay.compile_plan(dict(config, replicates=5))
+    layout = assay.plate_layout(dict(config, replicates=5))
+    assert layout.plate_slots == [8, 9, 11, 10, 7]
+    assert not set(plan['pipettes']['left']['tip_racks']) & {str(slot) for slot in layout.plate_slots}
+    assert tip_carryover(plan) == []
+    # without tip economy, its racks take those slots
+    with pytest.raises(ValueError, match="without tip_economy"):
+        assay.compile_plan(dict(config, tip_economy=False, replicates=5))
+
+## travel optimization
+@pytest.mark.parametrize("fields", [{'tip_economy': True}, {'transposed_b': True, 'multi_dispense': True}])
+def test_optimize_travel_shortens_the_run_and_fills_the_same_plates(fields):
+    config = config_for(replicates=3, **fields)
+    plan, optimized = assay.compile_plan(config), assay.compile_plan(dict(config, optimize_travel=True))
+    assert assay.travel_summary(optimized).seconds < assay.travel_summary(plan).seconds
+    assert destination_volumes(plan, assay.track_volumes(plan)) == destination_volumes(optimized, assay.track_volumes(optimized))
+    if fields.get('tip_economy'):
+        assert tip_carryover(optimized) == []
+
+## resuming
+def destination_volumes(plan: dict, ledger: assay.VolumeLedger) -> dict:
+    """What every well of the destination plates (the slots the cells go to) holds in a ledger."""
+    cells = [i for i, op in enumerate(plan['ops']) if op.where == f"{assay.PHASE_PREFIX}cells"][0]
+    slots = {op.where.split('/')[0] for op in plan['ops'][cells:] if op.kind == 'dispense'}
+    rows = {slot: assay.labware_shape(plan['labware'][slot]) for slot in slots}
+    return {f"{slot}/{assay.PLATE_ROWS[row]}{col + 1}": round(ledger.volume(f"{slot}/{assay.PLATE_ROWS[row]}{col + 1}"), 3)
+            for slot, (n_rows, n_cols) in rows.items() for row in range(n_rows) for col in range(n_cols)}
+
+# a stop after every op, with transposed B covering its B plate and single-channel placement
+@pytest.mark.parametrize("fields", [{}, {'tip_economy': True, 'multi_dispense': True}, {'transposed_b': True, 'replicates': 3}])
+def test_resume_round_trips(fields):
+    plan = assay.compile_plan(config_for(**fields))
+    finished = destination_volumes(plan, assay.track_volumes(plan))
+    # with fresh tip racks, as the tips put back can outrun a rack the plan fills exactly
+    for done in range(1, len(plan['ops'])):
+        lost = assay.lost_liquid(plan, done)
+        if lost is not None:
+            # the error names a resume point before the lost aspirate, and that one resumes
+            with pytest.raises(ValueError, match=r"Resume from op (\d+)") as error:
+                assay.resume_plan(plan, done, fresh_tips=True)
+            point = int(error.value.args[0].split("Resume from op ")[1].split()[0])
+            assert point <= lost[1]
+            assay.resume_plan(plan, point, fresh_tips=True)
+            continue
+        resumed = assay.resume_plan(plan, done, fresh_tips=True)
+        prefix = resumed['resumed']['prefix']
+        # the rest of the plan is unchanged, apart from its tips being named
+        assert [op._replace(where='') if op.kind == 'pick_up_tip' else op for op in resumed['ops'][prefix:]] == \
+               [op._replace(where='') if op.kind == 'pick_up_tip' else op for op in plan['ops'][done:]]
+        # a disposal volume lost with the tip leaves its source short, but the destination plates come out the same
+        assert destination_volumes(plan, assay.resume_volumes(plan, resumed)) == finished, done
+
+def test_resumed_checkpoint_counts_original_ops(tmp_path):
+    plan = assay.compile_plan(config_for())
+    done = assay.resume_index(plan, 'gradient')
+    resumed = assay.resume_plan(plan, done)
+    checkpoint = assay.Checkpoint(str(tmp_path / "checkpoint.json"))
+    checkpoint.start(resumed)
+    assert assay.read_checkpoint(checkpoint.path, plan) == done
+    checkpoint.op_finished(resumed['resumed']['prefix'] + 4)
+    assert assay.read_checkpoint(checkpoint.path, plan) == done + 5
+    assay.resume_plan(plan, done + 5)
+
+## max_replicates
+@pytest.mark.parametrize("fields", [{}, {'a_levels': 2}, {'transposed_b': True}, {'transposed_b': True, 'tip_economy': True}, {'transposed_b': True, 'plate_format': 384}, {'transposed_b': True, 'plate_format': 384, 'tip_economy': True}, {'plate_format': 384, 'mixed_pipettes': True}])
+def test_max_replicates_compiles_and_one_more_does_not(fields):
+    config = config_for(**fields)
+    most = assay.max_replicates(config)
+    assay.compile_plan(dict(config, replicates=most))
+    with pytest.raises(ValueError):
+        assay.compile_plan(dict(config, replicates=most + 1))
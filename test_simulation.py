@@ -0,0 +1,32 @@
+"""
+Checks of the simulation cache (see simulation.py): command logs put together from cached phase segments match
+a whole-run simulation, so reusing a segment never changes what the robot is shown to do.
+
+Usage: python -m pytest test_simulation.py
+"""
+import dual_inducer_assay as assay
+import simulation
+
+# each config changes one setting of the one before, so only some of its segments are simulated again
+CONFIGS = [
+    {},
+    {'multi_dispense': True},
+    {'multi_dispense': True, 'tip_economy': True},
+    {'multi_dispense': True, 'tip_economy': True, 'viscous_check': True},
+    {'multi_dispense': True, 'tip_economy': True, 'viscous_check': True, 'replicates': 2},
+]
+
+def test_cached_segments_match_a_whole_run(tmp_path):
+    cache_dir = str(tmp_path / "sim_cache")
+    reused = 0
+    for fields in CONFIGS:
+        config = dict(assay.DEFAULT_CONFIG, **fields)
+        whole = simulation.simulate(config, cache_dir=None).commands
+        segmented = simulation.simulate(config, cache_dir=cache_dir)
+        assert segmented.commands == whole, fields
+        reused += segmented.segments - segmented.simulated
+        # the second time, the whole run comes from the cache
+        again = simulation.simulate(config, cache_dir=cache_dir)
+        assert again.cached_run and again.commands == whole, fields
+    # the check is only worth something if segments were reused along the way
+    assert reused > 0
@@ -0,0 +1,30 @@
+"""
+Compares tip consumption of the default destination phase against tip economy mode, each with and without
+mixed-pipette scheduling. Tip counts come from simulating the modes, rack counts and freed deck slots from the tip planner.
+
+Usage: python tip_report.py [dilution_config.json]
+"""
+import sys
+
+import dual_inducer_assay as assay
+import estimator
+
+def tip_report(config: dict) -> str:
+    lines = [f"{'Mode':<22}{'Tips':>6}{'Racks':>7}{'Minutes':>9}  Free tip slots"]
+    for label, tip_economy, mixed in (("default", False, False), ("tip economy", True, False), ("mixed", False, True), ("tip economy, mixed", True, True)):
+        mode = dict(config, tip_economy=tip_economy, mixed_pipettes=mixed)
+        try:
+            usage = assay.config_tip_usage(mode)
+        except ValueError as e:
+            # the single-channel's own rack may not fit on the deck
+            lines.append(f"{label:<22}  {e}")
+            continue
+        estimate = estimator.estimate_run(mode)
+        racks = len(usage['tip_slots']) + (usage['single_slot'] is not None)
+        free_slots = ", ".join(str(slot) for slot in usage['free_slots']) or "-"
+        lines.append(f"{label:<22}{estimate.total_count('pick_up_tip'):>6}{racks:>7}{estimate.total_s / 60:>9.2f}  {free_slots}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    config = assay.load_config(sys.argv[1] if len(sys.argv) > 1 else assay.CONFIG_PATH)
+    print(tip_report(config))